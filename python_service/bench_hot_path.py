@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks do caminho por mensagem
+Mede em µs por chamada: parse_gv50_message (corpus de frames, inclusive malformados),
+FrameBuffer, construção/serialização de DadosVeiculo e Veiculo, process_battery_alert,
+a compressão de mensagem_raw e a instrumentação de métricas, e compara com a linha de base gravada em bench_baseline.json.
+
+Uso:
+  python bench_hot_path.py                 Compara com a linha de base (sai com 1 se houver regressão)
+  python bench_hot_path.py --save          Grava os resultados atuais como nova linha de base
+  python bench_hot_path.py --filter parse  Apenas benchmarks cujo nome contém "parse"
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import timeit
+from typing import Callable, Dict, List, Tuple
+import gv50_samples
+from battery_monitor import process_battery_alert
+from frame_reader import FrameBuffer
+from metrics import ACK_LATENCY, FRAMES
+from models import Veiculo, dados_from_message
+from mongodb_client import mongodb_client
+from protocol_parser import parse_gv50_message
+from raw_storage import RawCodec, default_dictionary
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+def benchmarks() -> List[Tuple[str, Callable[[], object]]]:
+    """Lista (nome, função sem argumentos) de tudo que é medido."""
+    cases: List[Tuple[str, Callable[[], object]]] = []
+    frames = gv50_samples.corpus()
+
+    for name, frame in frames:
+        view = memoryview(frame)
+        cases.append((f"parse/{name}", lambda view=view: parse_gv50_message(view)))
+
+    stream = b"".join(frame for name, frame in frames if not name.startswith("invalido"))
+    frame_buffer = FrameBuffer(16384)
+    cases.append(("frame_buffer/feed-6-frames", lambda: list(frame_buffer.feed(stream))))
+
+    parsed = parse_gv50_message(dict(frames)["GTFRI"])
+    dados = dados_from_message(parsed)
+    cases.append(("dados_veiculo/build", lambda: dados_from_message(parsed)))
+    cases.append(("dados_veiculo/to_document", lambda: mongodb_client.dados_to_document(dados)))
+
+    veiculo_document = Veiculo(IMEI=parsed.imei, ds_placa="ABC1D23", bateria_voltagem=12.4).model_dump()
+    cases.append(("veiculo/build", lambda: Veiculo(**veiculo_document)))
+    veiculo = Veiculo(**veiculo_document)
+    cases.append(("veiculo/model_dump", lambda: veiculo.model_dump(exclude={'_id'})))
+
+    coordinates = {'latitude': parsed.latitude, 'longitude': parsed.longitude}
+    for voltage in ("10.2", "11.2", "12.6"):
+        cases.append((f"battery/process_alert-{voltage}V",
+                      lambda voltage=voltage: process_battery_alert(parsed.imei, voltage, coordinates)))
+
+    # Compressão de mensagem_raw por documento no lote (RAW_STORAGE_MODE=compressed)
+    raw_codec = RawCodec('zlib', default_dictionary())
+    cases.append(("raw_storage/compress-zlib", lambda: raw_codec.compress(parsed.raw_message)))
+
+    # Instrumentação feita a cada frame em process_message
+    cases.append(("metrics/counter_inc", lambda: FRAMES.inc(parsed.message_type, parsed.command_type)))
+    cases.append(("metrics/histogram_observe", lambda: ACK_LATENCY.observe(0.0012)))
+    return cases
+
+def measure(function: Callable[[], object], repeat: int) -> float:
+    """Melhor tempo por chamada (µs) entre `repeat` rodadas de ~0,2s."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+def environment() -> Dict[str, str]:
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'processor': platform.processor() or platform.machine(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks do caminho por mensagem")
+    parser.add_argument("--save", action="store_true", help="Gravar os resultados como linha de base")
+    parser.add_argument("--filter", default="", help="Rodar apenas benchmarks cujo nome contém este texto")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--threshold", type=float, default=20.0, help="Regressão tolerada em %%")
+    parser.add_argument("--with-logging", action="store_true", help="Incluir o custo dos logs do parser")
+    args = parser.parse_args()
+
+    if not args.with_logging:
+        logging.disable(logging.CRITICAL)
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as file:
+            baseline = json.load(file)
+        if not args.save and baseline.get('environment') != environment():
+            print(f"⚠️ Linha de base gravada em outro ambiente: {baseline.get('environment')}")
+
+    results: Dict[str, float] = {}
+    regressions = []
+    print(f"{'benchmark':<34} {'µs':>9} {'base':>9} {'Δ':>8}")
+    for name, function in benchmarks():
+        if args.filter not in name:
+            continue
+        micros = measure(function, args.repeat)
+        results[name] = round(micros, 3)
+        reference = baseline.get('results', {}).get(name)
+        if reference:
+            change = (micros - reference) / reference * 100
+            flag = " ❌" if change > args.threshold else ""
+            if flag:
+                regressions.append(name)
+            print(f"{name:<34} {micros:>9.2f} {reference:>9.2f} {change:>+7.1f}%{flag}")
+        else:
+            print(f"{name:<34} {micros:>9.2f} {'-':>9} {'':>8}")
+
+    if args.save:
+        saved = baseline.get('results', {}) if args.filter else {}
+        saved.update(results)
+        with open(BASELINE_FILE, 'w') as file:
+            json.dump({'environment': environment(), 'results': saved}, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"\nLinha de base gravada em {BASELINE_FILE}")
+        return
+
+    if regressions:
+        print(f"\n{len(regressions)} regressões acima de {args.threshold:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
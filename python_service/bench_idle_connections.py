@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark de long-connections ociosas
+Abre N conexões (processo cliente separado) contra o GPSDeviceHandler e mede
+memória por conexão, timers agendados no event loop, CPU e atraso do loop em repouso.
+
+Uso: python bench_idle_connections.py [--connections 10000] [--idle 30] [--legacy]
+  --legacy usa um handler com asyncio.wait_for por leitura (comportamento anterior) para comparação
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import resource
+import time
+from config import get_settings
+from tcp_server import GPSDeviceHandler
+
+def raise_fd_limit():
+    """Sobe o limite de arquivos abertos até o limite rígido do sistema."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+def rss_kb() -> int:
+    """Memória residente atual do processo (kB)."""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+def run_clients(port: int, count: int, ready, stop):
+    """Processo cliente: abre `count` conexões ociosas e as mantém até o sinal de parada."""
+    raise_fd_limit()
+
+    async def clients():
+        writers = []
+        semaphore = asyncio.Semaphore(500)  # Evitar estourar o backlog do listen
+
+        async def connect():
+            async with semaphore:
+                _, writer = await asyncio.open_connection('127.0.0.1', port)
+                writers.append(writer)
+
+        await asyncio.gather(*(connect() for _ in range(count)))
+        ready.send(len(writers))
+        await asyncio.get_running_loop().run_in_executor(None, stop.recv)
+        for writer in writers:
+            writer.close()
+
+    asyncio.run(clients())
+
+async def legacy_handle_device(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Loop de leitura anterior: um asyncio.wait_for (timer criado/cancelado) por leitura."""
+    settings = get_settings()
+    while True:
+        try:
+            data = await asyncio.wait_for(reader.read(settings.read_chunk_size), timeout=settings.keep_alive_timeout)
+        except asyncio.TimeoutError:
+            continue
+        except OSError:
+            break
+        if not data:
+            break
+    writer.close()
+
+async def measure_loop_lag(duration: float, interval: float = 0.05) -> float:
+    """Maior atraso (ms) observado de um sleep no event loop durante `duration` segundos."""
+    worst = 0.0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.monotonic() - start - interval)
+    return worst * 1000
+
+async def bench(connections: int, idle: float, legacy: bool):
+    limit = raise_fd_limit()
+    if connections + 100 > limit:
+        print(f"⚠️ Limite de arquivos abertos ({limit}) é menor que o número de conexões")
+
+    handler = GPSDeviceHandler()
+    handler.admission.max_connections = connections
+    if legacy:
+        handle = legacy_handle_device
+    else:
+        handle = handler.handle_device
+        await handler.idle_wheel.start()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0, backlog=4096)
+    port = server.sockets[0].getsockname()[1]
+    loop = asyncio.get_running_loop()
+    baseline_rss = rss_kb()
+    baseline_timers = len(getattr(loop, '_scheduled', []))
+
+    context = multiprocessing.get_context('fork')
+    ready_recv, ready_send = context.Pipe(duplex=False)
+    stop_recv, stop_send = context.Pipe(duplex=False)
+    client = context.Process(target=run_clients, args=(port, connections, ready_send, stop_recv))
+    client.start()
+
+    started = time.monotonic()
+    opened = await loop.run_in_executor(None, ready_recv.recv)
+    connect_time = time.monotonic() - started
+    await asyncio.sleep(1)  # Deixar os handlers chegarem ao primeiro read
+
+    timers = len(getattr(loop, '_scheduled', [])) - baseline_timers
+    memory = rss_kb() - baseline_rss
+    cpu_start = time.process_time()
+    lag = await measure_loop_lag(idle)
+    cpu = time.process_time() - cpu_start
+
+    print(f"=== {'wait_for por leitura' if legacy else 'roda de prazos'}: {opened} conexões ociosas ===")
+    print(f"Tempo para abrir:      {connect_time:.2f}s")
+    print(f"Memória por conexão:   {memory * 1024 / max(opened, 1):.0f} bytes (RSS +{memory / 1024:.1f} MB)")
+    print(f"Timers no event loop:  {timers}")
+    print(f"CPU em repouso:        {cpu * 1000 / idle:.1f} ms/s")
+    print(f"Atraso máx. do loop:   {lag:.1f} ms")
+
+    stop_send.send(True)
+    await loop.run_in_executor(None, client.join)
+    # Aguardar os handlers processarem o fechamento antes de encerrar o loop
+    deadline = time.monotonic() + 10
+    while handler.admission.active and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    server.close()
+    if not legacy:
+        await handler.idle_wheel.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de long-connections ociosas")
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--idle", type=float, default=30, help="Segundos medindo com as conexões em repouso")
+    parser.add_argument("--legacy", action="store_true", help="Comparar com asyncio.wait_for por leitura")
+    args = parser.parse_args()
+    asyncio.run(bench(args.connections, args.idle, args.legacy))
+
+if __name__ == "__main__":
+    main()
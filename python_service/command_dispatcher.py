@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Despacho imediato de comandos (bloqueio/desbloqueio/troca de IP)
+Observa a coleção veiculo e envia o comando direto para a conexão ativa
+"""
+
+import asyncio
+from typing import TYPE_CHECKING, Optional
+from pymongo.errors import OperationFailure
+from mongodb_client import mongodb_client
+from veiculo_cache import COMMAND_FIELDS
+from config import get_settings
+from logger import get_logger
+
+if TYPE_CHECKING:
+    from tcp_server import GPSDeviceHandler
+
+logger = get_logger(__name__)
+
+class CommandDispatcher:
+    """Recebe alterações de comando via change stream (ou poll) e envia ao dispositivo conectado."""
+
+    @property
+    def settings(self):
+        return get_settings()
+
+    def __init__(self, device_handler: "GPSDeviceHandler"):
+        self.device_handler = device_handler
+        self.watch_task: Optional[asyncio.Task] = None
+        self._resume_token = None  # Retomar o change stream sem perder eventos após falha
+
+    async def start(self):
+        """Inicia a task que observa comandos pendentes."""
+        self.watch_task = asyncio.create_task(self._watch_loop())
+
+    async def stop(self):
+        """Para a observação de comandos."""
+        if self.watch_task:
+            self.watch_task.cancel()
+            self.watch_task = None
+
+    async def dispatch(self, imei: str, document: dict):
+        """Atualiza o cache com os campos de comando e envia se o dispositivo estiver conectado aqui."""
+        self.device_handler.veiculo_cache.apply_remote(imei, document)
+
+        device_info = self.device_handler.connected_devices.get(imei)
+        if not device_info:
+            return  # Será enviado quando o dispositivo conectar e mandar o primeiro relatório
+        if document.get('comandoBloqueo') is None and not document.get('comandoTrocarIP'):
+            return
+        await self.device_handler.check_pending_commands(imei, device_info['outbound'])
+
+    async def _watch_loop(self):
+        """Usa change stream quando disponível; sem replica set, faz poll dos comandos pendentes."""
+        while True:
+            try:
+                async with mongodb_client.watch_comandos_veiculo(self._resume_token) as stream:
+                    logger.info("Change stream de comandos em veiculo ativo")
+                    async for change in stream:
+                        document = change.get('fullDocument')
+                        if document and document.get('IMEI'):
+                            await self.dispatch(document['IMEI'], document)
+                        self._resume_token = stream.resume_token
+            except OperationFailure as e:
+                logger.info(
+                    f"Change stream indisponível ({e.code}), usando poll de comandos "
+                    f"a cada {self.settings.command_poll_interval}s"
+                )
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Change stream de comandos interrompido: {e}, reabrindo")
+                await asyncio.sleep(self.settings.command_poll_interval)
+
+        await self._poll_loop()
+
+    async def _poll_loop(self):
+        """Busca numa única consulta todos os veículos com comando pendente."""
+        while True:
+            await asyncio.sleep(self.settings.command_poll_interval)
+            try:
+                for veiculo in await mongodb_client.get_veiculos_com_comando_pendente():
+                    await self.dispatch(veiculo.IMEI, veiculo.model_dump(include=set(COMMAND_FIELDS)))
+            except Exception as e:
+                logger.error(f"Erro no poll de comandos pendentes: {e}")
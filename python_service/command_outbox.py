@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Fila de saída de comandos para os dispositivos (coleção comandos)
+Cada comando recebe um serial próprio no lugar de FFFF e fica em voo até o +ACK
+com o mesmo serial; sem confirmação é reenviado com backoff. O estado fica no
+MongoDB, então comandos pendentes sobrevivem a reinícios e reconexões.
+"""
+
+import asyncio
+import random
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from bson import ObjectId
+from mongodb_client import mongodb_client
+from connection_manager import DeadlineWheel, OutboundWriter
+from protocol_parser import GV50Message
+from metrics import COMMANDS_CONFIRMED, COMMANDS_FAILED, COMMANDS_SENT
+from events import event_bus
+from config import get_settings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Tipo do comando -> comando GV50 que volta no +ACK
+COMMAND_TYPES = {
+    'bloqueio': 'GTOUT',
+    'desbloqueio': 'GTOUT',
+    'trocar_ip': 'GTSRI',
+}
+
+class CommandOutbox:
+    """
+    Comandos ativos por IMEI (carregados na primeira mensagem da conexão).
+
+    Documento: IMEI, tipo, comando (GTOUT/GTSRI), serial, texto, status
+    (pendente, enviado, confirmado, falhou, cancelado), tentativas, criado_em,
+    enviado_em, confirmado_em, atualizado_em.
+    """
+
+    @property
+    def settings(self):
+        return get_settings()
+
+    def __init__(self, lookup_outbound: Callable[[str], Optional[OutboundWriter]],
+                 on_confirmed: Callable[[dict], Awaitable[None]]):
+        self.lookup_outbound = lookup_outbound  # Conexão atual do IMEI neste worker
+        self.on_confirmed = on_confirmed  # Aplica o efeito do comando (ex: bloqueado)
+        self._active: Dict[str, List[dict]] = {}  # IMEI -> comandos sem +ACK
+        self._by_id: Dict[ObjectId, dict] = {}
+        self._awaiting_ack: Set[ObjectId] = set()  # Enviados na conexão atual, dentro do prazo
+        self._sending: Set[ObjectId] = set()
+        self._serial = random.randrange(1, 0xFFFF)  # Workers começam em pontos diferentes
+        self.retry_wheel = DeadlineWheel(self.settings.timer_resolution, self._on_ack_timeout, name="comandos")
+        self.background_tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._awaiting_ack)
+
+    async def start(self):
+        await self.retry_wheel.start()
+
+    async def stop(self):
+        await self.retry_wheel.stop()
+
+    def _next_serial(self, imei: str) -> str:
+        """Serial 0001-FFFE ainda não usado por um comando ativo do IMEI (FFFF = sem rastreio)."""
+        in_use = {command['serial'] for command in self._active.get(imei, ())}
+        while True:
+            self._serial = self._serial % 0xFFFE + 1
+            serial = f"{self._serial:04X}"
+            if serial not in in_use:
+                return serial
+
+    def _remove(self, command: dict):
+        command_id = command['_id']
+        self._by_id.pop(command_id, None)
+        self._awaiting_ack.discard(command_id)
+        self.retry_wheel.cancel(command_id)
+        commands = self._active.get(command['IMEI'])
+        if commands and command in commands:
+            commands.remove(command)
+
+    async def load(self, imei: str):
+        """Carrega do MongoDB os comandos ativos do IMEI (uma vez por conexão)."""
+        if imei in self._active:
+            return
+        commands = await mongodb_client.get_comandos_ativos(imei)
+        if imei in self._active:
+            return  # Carregado por outra chamada enquanto esta aguardava
+        self._active[imei] = commands
+        for command in commands:
+            self._by_id[command['_id']] = command
+        if commands:
+            logger.info(f"{len(commands)} comandos sem confirmação para {imei} serão reenviados")
+
+    def evict(self, imei: str):
+        """Descarta da memória os comandos de um dispositivo desconectado (continuam no MongoDB)."""
+        for command in self._active.pop(imei, ()):
+            self._by_id.pop(command['_id'], None)
+            self._awaiting_ack.discard(command['_id'])
+            self.retry_wheel.cancel(command['_id'])
+
+    async def submit(self, imei: str, tipo: str, build: Callable[[str], str], outbound: OutboundWriter):
+        """Registra um comando novo (substituindo o anterior do mesmo tipo) e envia."""
+        comando = COMMAND_TYPES[tipo]
+        await self.load(imei)
+        await mongodb_client.cancel_comandos(imei, comando)
+        for previous in [command for command in self._active[imei] if command['comando'] == comando]:
+            self._remove(previous)
+            logger.info(f"Comando {previous['tipo']} ({previous['serial']}) de {imei} substituído por {tipo}")
+
+        serial = self._next_serial(imei)
+        now = datetime.utcnow()
+        command = {
+            'IMEI': imei,
+            'tipo': tipo,
+            'comando': comando,
+            'serial': serial,
+            'texto': build(serial),
+            'status': 'pendente',
+            'tentativas': 0,
+            'criado_em': now,
+            'atualizado_em': now,
+        }
+        await mongodb_client.insert_comando(command)
+        self._active[imei].append(command)
+        self._by_id[command['_id']] = command
+        await self._send(command, outbound)
+
+    async def deliver(self, imei: str, outbound: OutboundWriter):
+        """
+        Envia os comandos do IMEI que não estão aguardando +ACK (chamado a cada mensagem).
+        Na primeira mensagem da conexão carrega os ativos do MongoDB: comandos sem +ACK de uma
+        conexão anterior ou de antes de um reinício são reenviados.
+        """
+        await self.load(imei)
+        commands = self._active.get(imei)
+        if not commands:
+            return
+        for command in list(commands):
+            if command['_id'] not in self._awaiting_ack:
+                await self._send(command, outbound)
+
+    async def _send(self, command: dict, outbound: OutboundWriter):
+        command_id = command['_id']
+        if command_id in self._sending or outbound.closing:
+            return
+        if command['tentativas'] >= self.settings.command_max_attempts:
+            await self._fail(command)
+            return
+
+        self._sending.add(command_id)
+        try:
+            now = datetime.utcnow()
+            claimed = await mongodb_client.claim_comando_envio(
+                command_id, command['tentativas'], {'status': 'enviado', 'enviado_em': now, 'atualizado_em': now}
+            )
+            if claimed is None:
+                # Confirmado, cancelado ou reenviado por outro worker desde a leitura
+                logger.debug(f"Comando {command['serial']} de {command['IMEI']} não está mais ativo aqui")
+                self._remove(command)
+                return
+            command.update(claimed)
+            if outbound.closing:
+                return  # Tentativa contada; reenviado na reconexão
+
+            outbound.send(command['texto'].encode('utf-8'))
+            self._awaiting_ack.add(command_id)
+            timeout = min(
+                self.settings.command_timeout * self.settings.command_retry_backoff ** (command['tentativas'] - 1),
+                self.settings.command_timeout * 10
+            )
+            self.retry_wheel.schedule(command_id, time.monotonic() + timeout)
+            COMMANDS_SENT.inc(command['tipo'])
+            event_bus.publish('command', command['IMEI'], command=command['tipo'], status='enviado',
+                              serial=command['serial'], attempt=command['tentativas'])
+            logger.info(
+                f"Comando {command['tipo']} enviado para {command['IMEI']} "
+                f"(serial {command['serial']}, tentativa {command['tentativas']})"
+            )
+        except Exception as e:
+            logger.error(f"Erro ao enviar comando {command['serial']} para {command['IMEI']}: {e}")
+        finally:
+            self._sending.discard(command_id)
+
+    async def _fail(self, command: dict):
+        self._remove(command)
+        await mongodb_client.finish_comando(command['_id'], 'falhou')
+        COMMANDS_FAILED.inc(command['tipo'])
+        event_bus.publish('command', command['IMEI'], command=command['tipo'], status='falhou', serial=command['serial'])
+        logger.error(
+            f"Comando {command['tipo']} para {command['IMEI']} sem confirmação após "
+            f"{command['tentativas']} tentativas (serial {command['serial']})"
+        )
+
+    def _on_ack_timeout(self, command_id: ObjectId):
+        """Prazo do +ACK vencido: reenviar agora se o dispositivo está conectado aqui."""
+        self._awaiting_ack.discard(command_id)
+        command = self._by_id.get(command_id)
+        if command is None:
+            return
+        outbound = self.lookup_outbound(command['IMEI'])
+        if outbound is None or outbound.closing:
+            return  # Reenviado pelo deliver() quando o dispositivo voltar
+        task = asyncio.create_task(self._send(command, outbound))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def confirm(self, parsed: GV50Message):
+        """Trata um +ACK do dispositivo: confirma o comando com o mesmo serial."""
+        imei = parsed.imei
+        await self.load(imei)
+        command = next(
+            (command for command in self._active.get(imei, ())
+             if command['comando'] == parsed.command_type and command['serial'] == parsed.serial),
+            None
+        )
+        if command is None:
+            logger.info(f"+ACK:{parsed.command_type} de {imei} sem comando pendente (serial {parsed.serial})")
+            return
+
+        self._remove(command)
+        now = datetime.utcnow()
+        if not await mongodb_client.finish_comando(command['_id'], 'confirmado', {'confirmado_em': now}):
+            logger.info(f"Comando {command['serial']} de {imei} já estava encerrado")
+            return
+        COMMANDS_CONFIRMED.inc(command['tipo'])
+        event_bus.publish('command', imei, command=command['tipo'], status='confirmado', serial=command['serial'])
+        logger.info(f"✅ Comando {command['tipo']} confirmado por {imei} (serial {command['serial']})")
+        await self.on_confirmed(command)
@@ -1,9 +1,11 @@
 import os
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from pydantic import Field
 from pydantic_settings import BaseSettings
-from dotenv import load_dotenv
+from dotenv import dotenv_values, load_dotenv
 
+# Variáveis definidas pelo ambiente do processo têm prioridade sobre o .env (também no reload)
+_process_env = frozenset(os.environ)
 load_dotenv()
 
 class Config(BaseSettings):
@@ -12,22 +14,80 @@ class Config(BaseSettings):
     # MongoDB Configuration
     mongodb_url: str = Field(default="mongodb://localhost:27017")
     mongodb_database: str = Field(default="gps_tracking_service")
+    auto_create_indexes: bool = Field(default=True)  # Criar índices ausentes na conexão (False = apenas reportar)
+    dados_retention_days: int = Field(default=0)  # TTL de dados_veiculo em dias (0 = sem expiração)
+    dados_storage_mode: str = Field(default="regular")  # regular ou timeseries (coleção time-series do MongoDB 5.0+)
+    raw_storage_mode: str = Field(default="inline")  # mensagem_raw: inline, compressed (mensagem_raw_z) ou archive (dados_veiculo_raw)
+    raw_compression: str = Field(default="zlib")  # zlib ou zstd (requer o pacote zstandard) no modo compressed
+    raw_dictionary_file: str = Field(default="")  # Dicionário treinado (python raw_storage.py train-dict); vazio = embutido
+    raw_archive_retention_days: int = Field(default=0)  # TTL de dados_veiculo_raw em dias (0 = sem expiração)
+    timeseries_granularity: str = Field(default="seconds")  # seconds, minutes ou hours (intervalo típico entre relatórios)
     
     # TCP Server Configuration
     tcp_host: str = Field(default="0.0.0.0")
     tcp_port: int = Field(default=8000)
     
     # Logging Configuration
-    log_level: str = Field(default="DEBUG")
+    log_level: str = Field(default="INFO")
     log_file: str = Field(default="logs/gps_service.log")
+    log_rotation: str = Field(default="size")  # size, time ou none
+    log_max_bytes: int = Field(default=50 * 1024 * 1024)  # Rotação por tamanho
+    log_rotation_when: str = Field(default="midnight")  # Rotação por tempo (TimedRotatingFileHandler)
+    log_backup_count: int = Field(default=10)
+    log_queue_size: int = Field(default=10000)  # Registros pendentes antes de descartar
+    log_sample_rate: int = Field(default=1)  # Logar 1 a cada N mensagens por IMEI (1 = todas)
+    
+    # Métricas (formato Prometheus)
+    metrics_host: str = Field(default="0.0.0.0")
+    metrics_port: int = Field(default=0)  # Porta HTTP de /metrics (0 = desativado); o worker N usa metrics_port + N - 1
+    # GET /posicoes traz IMEI e posição de toda a frota: porta própria, só local por padrão
+    posicoes_host: str = Field(default="127.0.0.1")
+    posicoes_port: int = Field(default=0)  # Porta HTTP de /posicoes (0 = desativado); o worker N usa posicoes_port + N - 1
+    events_socket: str = Field(default="logs/gps_events.sock")  # Socket Unix de eventos para o monitor ("" = desativado)
     
     # Service Configuration - Long Connection Mode
-    max_connections: int = Field(default=1000)
-    command_timeout: int = Field(default=30)
+    max_connections: int = Field(default=1000)  # Conexões simultâneas por processo worker
+    max_connections_per_ip: int = Field(default=0)  # Limite por IP de origem (0 = sem limite; CGNAT compartilha IPs)
+    connection_policy: str = Field(default="reject")  # Acima do limite: reject (recusar) ou queue (aguardar vaga)
+    admission_queue_size: int = Field(default=1000)  # Conexões aguardando vaga na política queue
+    admission_queue_timeout: float = Field(default=10.0)  # Segundos aguardando vaga antes de recusar
+    timer_resolution: float = Field(default=1.0)  # Resolução (s) da roda de prazos de inatividade
+    command_timeout: int = Field(default=30)  # Segundos aguardando +ACK de um comando (e fechamento de conexão)
+    command_max_attempts: int = Field(default=5)  # Envios de um comando sem +ACK antes de marcá-lo como falhou
+    command_retry_backoff: float = Field(default=2.0)  # Multiplicador do prazo do +ACK a cada reenvio
     device_timeout: int = Field(default=1800)  # 30 min para long-connection
     heartbeat_interval: int = Field(default=300)  # 5 min heartbeat  
     keep_alive_timeout: int = Field(default=600)  # 10 min keep-alive
     connection_mode: str = Field(default="long-connection")  # Modo de conexão GV50
+    workers: int = Field(default=1)  # Processos worker com SO_REUSEPORT (1 = processo único)
+    worker_shutdown_timeout: int = Field(default=30)  # Segundos para os workers encerrarem no SIGTERM
+    connection_drain_timeout: int = Field(default=10)  # Segundos aguardando as conexões terminarem no encerramento
+    read_chunk_size: int = Field(default=4096)  # Bytes por leitura do socket
+    max_frame_size: int = Field(default=16384)  # Limite do buffer de frame incompleto por conexão
+    outbound_high_water: int = Field(default=64 * 1024)  # Bytes pendentes de envio que pausam a leitura da conexão
+    outbound_low_water: int = Field(default=16 * 1024)  # Leitura retomada quando o envio pendente cai abaixo disto
+    ack_after_durable: bool = Field(default=False)  # Enviar +SACK só após o lote ser gravado no MongoDB
+    
+    # Persistência em lote (write-behind) de dados_veiculo
+    dados_legacy_string_fields: bool = Field(default=False)  # Gravar longitude/latitude/altidude/speed/dataDevice como texto (formato antigo)
+    insert_batch_size: int = Field(default=500)  # Documentos por insert_many
+    insert_flush_interval: float = Field(default=0.5)  # Segundos máximos antes de gravar um lote parcial
+    insert_queue_size: int = Field(default=20000)  # Limite da fila em memória (backpressure)
+    insert_max_retries: int = Field(default=5)  # Tentativas por lote antes de descartar
+    insert_drain_timeout: int = Field(default=30)  # Segundos para esvaziar a fila no shutdown
+    spool_dir: str = Field(default="spool")  # Spool em disco para lotes que o MongoDB não aceitou ("" desativa)
+    spool_segment_size: int = Field(default=64 * 1024 * 1024)  # Bytes por segmento do spool
+    
+    # Captura de tráfego bruto (replay_capture.py)
+    capture_dir: str = Field(default="")  # Diretório dos arquivos .gv50cap.gz ("" desativa; SIGHUP liga/desliga)
+    capture_max_bytes: int = Field(default=64 * 1024 * 1024)  # Bytes (antes da compressão) por arquivo de captura
+    capture_max_files: int = Field(default=48)  # Arquivos de captura mantidos por worker (0 = sem limite)
+    
+    # Cache de estado dos veículos
+    veiculo_flush_interval: float = Field(default=1.0)  # Segundos para agrupar $set de campos alterados
+    posicao_flush_interval: float = Field(default=1.0)  # Segundos para agrupar a gravação de posicao_atual
+    viagem_inatividade: int = Field(default=600)  # Segundos sem relatório que fecham a viagem em andamento
+    command_poll_interval: int = Field(default=5)  # Poll de comandos pendentes quando não há change stream
     
     # IP Configuration for devices
     new_server_ip: str = Field(default="")
@@ -37,8 +97,52 @@ class Config(BaseSettings):
     
     class Config:
         env_file = ".env"
+        frozen = True
+
+# Parâmetros aplicados em execução pelo SIGHUP; os demais exigem reinício
+RELOADABLE_FIELDS = frozenset({
+    'command_timeout', 'command_max_attempts', 'command_retry_backoff', 'device_timeout', 'heartbeat_interval', 'keep_alive_timeout',
+    'max_connections', 'max_connections_per_ip', 'connection_policy',
+    'admission_queue_size', 'admission_queue_timeout', 'read_chunk_size', 'max_frame_size',
+    'new_server_ip', 'new_server_port', 'backup_server_ip', 'backup_server_port',
+    'insert_batch_size', 'insert_flush_interval', 'insert_max_retries', 'insert_drain_timeout',
+    'veiculo_flush_interval', 'posicao_flush_interval', 'viagem_inatividade', 'command_poll_interval', 'dados_legacy_string_fields',
+    'log_level', 'log_sample_rate', 'worker_shutdown_timeout', 'connection_drain_timeout', 'ack_after_durable',
+    'capture_dir', 'capture_max_bytes', 'capture_max_files',
+    'raw_storage_mode', 'raw_compression', 'raw_dictionary_file',
+})
+
+_settings: Optional[Config] = None
+
+def get_settings() -> Config:
+    """Configuração validada e imutável, carregada uma única vez por processo."""
+    global _settings
+    if _settings is None:
+        _settings = Config()
+    return _settings
+
+def reload_settings() -> Dict[str, Tuple[object, object]]:
+    """
+    Relê o .env e o ambiente e troca atomicamente a configuração, aplicando apenas
+    os campos de RELOADABLE_FIELDS. Retorna {campo: (atual, novo)} de todos os
+    campos alterados (inclusive os que exigem reinício). Levanta ValidationError
+    se a nova configuração for inválida, mantendo a atual.
+    """
+    global _settings
+    for key, value in dotenv_values(".env").items():
+        if key not in _process_env and value is not None:
+            os.environ[key] = value
 
-def get_settings():
-    return Config()
+    current = get_settings()
+    fresh = Config()
+    changes = {
+        name: (getattr(current, name), getattr(fresh, name))
+        for name in Config.model_fields
+        if getattr(current, name) != getattr(fresh, name)
+    }
+    hot = {name: new for name, (_, new) in changes.items() if name in RELOADABLE_FIELDS}
+    if hot:
+        _settings = current.model_copy(update=hot)
+    return changes
 
 config = get_settings()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Controle de conexões long-connection
+Admissão (limite global e por IP) e detecção de inatividade com uma roda de prazos compartilhada
+"""
+
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_connection_ids = itertools.count(1)
+
+class OutboundWriter:
+    """
+    Saída de uma conexão: ACKs e comandos acumulados viram uma única escrita.
+
+    Enquanto a conexão processa os frames de uma leitura o writer fica "tampado"
+    (cork) e tudo é enviado junto no uncork(); fora disso (comandos do dispatcher,
+    heartbeat) a escrita sai no próximo ciclo do event loop. Não há drain por
+    mensagem: os watermarks do transporte definem quando o loop de leitura espera.
+    """
+
+    __slots__ = ('writer', '_pending', '_corked', '_scheduled')
+
+    def __init__(self, writer: asyncio.StreamWriter, high_water: int, low_water: int):
+        self.writer = writer
+        self._pending: List[bytes] = []
+        self._corked = False
+        self._scheduled = False
+        writer.transport.set_write_buffer_limits(high=high_water, low=low_water)
+
+    @property
+    def closing(self) -> bool:
+        return self.writer.is_closing()
+
+    def send(self, data: bytes):
+        """Enfileira bytes para a próxima escrita da conexão."""
+        self._pending.append(data)
+        if not self._corked and not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def cork(self):
+        self._corked = True
+
+    def uncork(self):
+        self._corked = False
+        self.flush()
+
+    def flush(self):
+        """Escreve tudo o que está pendente numa só chamada ao transporte."""
+        self._scheduled = False
+        if not self._pending:
+            return
+        data = self._pending[0] if len(self._pending) == 1 else b"".join(self._pending)
+        self._pending.clear()
+        if self.writer.is_closing():
+            logger.debug(f"{len(data)} bytes descartados: conexão encerrada")
+            return
+        self.writer.write(data)
+
+    async def wait_writable(self):
+        """Backpressure: só suspende se o buffer do transporte passou do high watermark."""
+        await self.writer.drain()
+
+class DeviceConnection:
+    """Estado de uma conexão TCP de dispositivo."""
+
+    __slots__ = ('id', 'reader', 'writer', 'outbound', 'client_ip', 'imei', 'connected_at', 'last_seen', 'closed')
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client_ip: str,
+                 outbound: OutboundWriter):
+        self.id = next(_connection_ids)  # Sequencial no processo (captura de frames)
+        self.reader = reader
+        self.writer = writer
+        self.outbound = outbound
+        self.client_ip = client_ip
+        self.imei: Optional[str] = None  # Definido no primeiro frame válido
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at  # Última leitura com dados (time.monotonic)
+        self.closed = False
+
+    def __repr__(self) -> str:
+        return f"DeviceConnection({self.client_ip}, imei={self.imei})"
+
+class DeadlineWheel:
+    """
+    Roda de prazos (timing wheel) com reagendamento preguiçoso.
+
+    Um único tick a cada `resolution` segundos substitui um timer por conexão.
+    touch() apenas grava o novo prazo (O(1), sem criar/cancelar timers); a
+    entrada continua no slot antigo e, quando ele vence, é reinserida no slot
+    do prazo atual ou expirada. Cada tick custa O(entradas no slot).
+    """
+
+    def __init__(self, resolution: float, on_expire: Callable[[Any], None], name: str = "deadline"):
+        self.resolution = resolution
+        self.on_expire = on_expire
+        self.name = name
+        self._deadlines: Dict[Any, float] = {}  # entrada -> prazo (time.monotonic)
+        self._scheduled: Dict[Any, int] = {}  # entrada -> tick do slot onde está
+        self._slots: Dict[int, Set[Any]] = {}  # tick -> entradas
+        self._last_tick = self._tick(time.monotonic())
+        self.task: Optional[asyncio.Task] = None
+        self.expired_count = 0
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def entries(self) -> List[Any]:
+        """Entradas agendadas no momento (cópia, pode ser alterada durante a iteração)."""
+        return list(self._deadlines)
+
+    def _tick(self, deadline: float) -> int:
+        return int(deadline / self.resolution)
+
+    def _place(self, entry: Any, deadline: float):
+        # Prazos no passado vão para o próximo tick
+        tick = max(self._tick(deadline), self._last_tick + 1)
+        self._slots.setdefault(tick, set()).add(entry)
+        self._scheduled[entry] = tick
+
+    def schedule(self, entry: Any, deadline: float):
+        """Agenda (ou adia/antecipa) o prazo de uma entrada."""
+        self._deadlines[entry] = deadline
+        tick = self._scheduled.get(entry)
+        if tick is None:
+            self._place(entry, deadline)
+        elif self._tick(deadline) < tick:
+            # Prazo antecipado: mover para o slot anterior
+            self._slots[tick].discard(entry)
+            self._place(entry, deadline)
+
+    def touch(self, entry: Any, deadline: float):
+        """Adia o prazo de uma entrada já agendada (caminho quente, por leitura)."""
+        if entry in self._deadlines:
+            self._deadlines[entry] = deadline
+        else:
+            self.schedule(entry, deadline)
+
+    def cancel(self, entry: Any):
+        """Remove a entrada da roda."""
+        self._deadlines.pop(entry, None)
+        tick = self._scheduled.pop(entry, None)
+        if tick is not None:
+            slot = self._slots.get(tick)
+            if slot is not None:
+                slot.discard(entry)
+
+    def advance(self, now: float):
+        """Processa os slots vencidos até `now`."""
+        current = self._tick(now)
+        for tick in range(self._last_tick + 1, current + 1):
+            self._last_tick = tick
+            slot = self._slots.pop(tick, None)
+            if not slot:
+                continue
+            for entry in slot:
+                del self._scheduled[entry]
+                deadline = self._deadlines.get(entry)
+                if deadline is None:
+                    continue
+                if deadline > now:
+                    self._place(entry, deadline)  # Foi adiado por touch(): reinserir
+                    continue
+                del self._deadlines[entry]
+                self.expired_count += 1
+                try:
+                    self.on_expire(entry)
+                except Exception as e:
+                    logger.error(f"Erro ao expirar {entry} na roda {self.name}: {e}")
+
+    async def start(self):
+        """Inicia o tick da roda."""
+        self._last_tick = self._tick(time.monotonic())
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Para o tick da roda."""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.resolution)
+            self.advance(time.monotonic())
+
+class AdmissionController:
+    """
+    Limita conexões simultâneas (MAX_CONNECTIONS) e por IP de origem.
+
+    Política 'reject' recusa conexões acima do limite; 'queue' mantém o socket
+    aberto sem ler até uma vaga liberar (FIFO), por até `queue_timeout` segundos.
+    """
+
+    def __init__(self, max_connections: int, max_per_ip: int = 0, policy: str = "reject",
+                 queue_size: int = 1000, queue_timeout: float = 10.0):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip  # 0 = sem limite (dispositivos atrás de CGNAT compartilham IP)
+        self.policy = policy
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.per_ip: Dict[str, int] = {}  # Conexões admitidas ou na fila, por IP
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.rejected_count = 0
+
+    def _release_ip(self, client_ip: str):
+        count = self.per_ip.get(client_ip, 0) - 1
+        if count > 0:
+            self.per_ip[client_ip] = count
+        else:
+            self.per_ip.pop(client_ip, None)
+
+    def _reject(self, client_ip: str, reason: str) -> bool:
+        self.rejected_count += 1
+        # Em tempestade de reconexão, registrar só a cada 100 recusas
+        if self.rejected_count % 100 == 1:
+            logger.warning(f"Conexão de {client_ip} recusada ({reason}); {self.rejected_count} recusas no total")
+        return False
+
+    async def admit(self, client_ip: str) -> bool:
+        """Reserva uma vaga para a conexão; False se ela deve ser recusada."""
+        if self.max_per_ip and self.per_ip.get(client_ip, 0) >= self.max_per_ip:
+            return self._reject(client_ip, f"limite de {self.max_per_ip} por IP")
+        # A vaga do IP é reservada antes de qualquer espera: conexões na fila também contam no limite
+        self.per_ip[client_ip] = self.per_ip.get(client_ip, 0) + 1
+
+        if self.active < self.max_connections and not self._waiters:
+            self.active += 1
+            return True
+
+        if self.policy != "queue" or len(self._waiters) >= self.queue_size:
+            self._release_ip(client_ip)
+            return self._reject(client_ip, f"limite de {self.max_connections} conexões")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            granted = await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            self._release_ip(client_ip)
+            if waiter.done():
+                # A vaga chegou junto com o timeout/cancelamento: devolvê-la
+                # (False é a recusa de close(), que não reservou vaga)
+                if waiter.result():
+                    self._release_slot()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return self._reject(client_ip, f"fila de admissão excedeu {self.queue_timeout}s")
+
+        if not granted:
+            self._release_ip(client_ip)
+            return self._reject(client_ip, "fila de admissão esvaziada")
+        # A vaga foi repassada por release() já contabilizada em active
+        return True
+
+    def _release_slot(self):
+        # Repassar a vaga ao próximo da fila sem decrementar active
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def release(self, client_ip: str):
+        """Libera a vaga de uma conexão encerrada."""
+        self._release_ip(client_ip)
+        self._release_slot()
+
+    def apply_limits(self):
+        """
+        Aplica limites alterados no reload: repassa às conexões na fila as vagas abertas
+        por um MAX_CONNECTIONS maior e, se a política deixou de ser 'queue', recusa as demais.
+        """
+        while self._waiters and self.active < self.max_connections:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(True)
+        if self.policy != "queue":
+            self.close()
+
+    def close(self):
+        """Recusa as conexões que aguardam na fila (encerramento do servidor ou fim da política 'queue')."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(False)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
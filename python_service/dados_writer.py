@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Gravação em lote (write-behind) da coleção dados_veiculo
+Os relatórios entram numa fila em memória e uma task agrupa os inserts.
+Com spool ativo, lotes que o MongoDB não aceita vão para o disco e são regravados depois.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+from models import DadosVeiculo
+from mongodb_client import mongodb_client
+from spool import SPOOL_REPLAYED, DadosSpool
+from metrics import DADOS_DROPPED, MONGO_INSERT_BATCH, MONGO_INSERT_FAILURES, MONGO_INSERT_SECONDS
+from config import get_settings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+class DadosVeiculoWriter:
+    """Fila limitada + task de flush que grava DadosVeiculo com insert_many."""
+
+    @property
+    def settings(self):
+        return get_settings()
+
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.flush_task: Optional[asyncio.Task] = None
+        self.inserted_count = 0
+        self.dropped_count = 0
+        # Sequência dos documentos: enfileirados e já processados (gravados ou descartados)
+        self.enqueued = 0
+        self.completed = 0
+        self._durable_waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+        self._dropped_ranges: Deque[Tuple[int, int]] = deque(maxlen=100)
+        self.spool: Optional[DadosSpool] = None
+        self.replay_task: Optional[asyncio.Task] = None
+
+    async def start(self, spool_dir: str = ""):
+        """Cria a fila e inicia a task de flush (e o spool em disco, se configurado)."""
+        self.queue = asyncio.Queue(maxsize=self.settings.insert_queue_size)
+        if spool_dir:
+            self.spool = DadosSpool(spool_dir, self.settings.spool_segment_size)
+            await self.spool.open()
+            self.replay_task = asyncio.create_task(self._replay_loop())
+        self.flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(
+            f"Gravação em lote iniciada: lote={self.settings.insert_batch_size}, "
+            f"intervalo={self.settings.insert_flush_interval}s, fila={self.settings.insert_queue_size}"
+        )
+
+    async def enqueue(self, dados: DadosVeiculo) -> int:
+        """
+        Enfileira um relatório para gravação e retorna sua sequência (ver wait_durable).
+
+        Bloqueia quando a fila está cheia (MongoDB atrasado), o que interrompe a
+        leitura da conexão e propaga backpressure até o dispositivo.
+        """
+        await self.queue.put(mongodb_client.dados_to_document(dados))
+        self.enqueued += 1
+        return self.enqueued
+
+    async def enqueue_many(self, dados_list: List[DadosVeiculo]) -> int:
+        """
+        Enfileira um backlog em sequência. Enquanto a fila tem espaço nenhum put suspende,
+        então a task de flush encontra o lote inteiro para um único insert_many.
+        """
+        for dados in dados_list:
+            await self.queue.put(mongodb_client.dados_to_document(dados))
+            self.enqueued += 1
+        return self.enqueued
+
+    def _was_dropped(self, sequence: int) -> bool:
+        return any(first <= sequence <= last for first, last in self._dropped_ranges)
+
+    async def wait_durable(self, sequence: int) -> bool:
+        """Aguarda o lote que contém `sequence` ser gravado; False se ele foi descartado."""
+        if sequence <= self.completed:
+            return not self._was_dropped(sequence)
+        future = asyncio.get_running_loop().create_future()
+        self._durable_waiters.append((sequence, future))
+        return await future
+
+    def _complete(self, count: int, written: bool):
+        """Avança a sequência processada e libera quem aguarda esses documentos."""
+        first = self.completed + 1
+        self.completed += count
+        if not written:
+            self._dropped_ranges.append((first, self.completed))
+        while self._durable_waiters and self._durable_waiters[0][0] <= self.completed:
+            _, future = self._durable_waiters.popleft()
+            if not future.done():
+                future.set_result(written)
+
+    async def stop(self):
+        """Esvazia a fila gravando os lotes restantes e encerra a task de flush."""
+        if not self.flush_task:
+            return
+        try:
+            await asyncio.wait_for(self.queue.put(None), timeout=self.settings.insert_drain_timeout)
+            await asyncio.wait_for(self.flush_task, timeout=self.settings.insert_drain_timeout)
+            logger.info(f"Fila de dados_veiculo esvaziada ({self.inserted_count} documentos gravados)")
+        except asyncio.TimeoutError:
+            pending = self.queue.qsize()
+            self.flush_task.cancel()
+            logger.error(f"Timeout ao esvaziar fila de dados_veiculo, {pending} documentos perdidos")
+        finally:
+            self.flush_task = None
+            while self._durable_waiters:
+                _, future = self._durable_waiters.popleft()
+                if not future.done():
+                    future.set_result(False)
+            if self.replay_task:
+                self.replay_task.cancel()
+                self.replay_task = None
+            if self.spool:
+                if not self.spool.empty:
+                    logger.warning(f"Spool com {self.spool.pending_bytes} bytes será regravado no próximo início")
+                await self.spool.close()
+                self.spool = None
+
+    async def _flush_loop(self):
+        """Agrupa documentos por tamanho de lote ou prazo e grava no MongoDB."""
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            document = await self.queue.get()
+            if document is None:
+                break
+            batch = [document]
+            deadline = loop.time() + self.settings.insert_flush_interval
+
+            while len(batch) < self.settings.insert_batch_size:
+                try:
+                    document = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        document = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if document is None:
+                    closing = True
+                    break
+                batch.append(document)
+
+            self._complete(len(batch), await self._write_batch(batch))
+
+    async def _write_batch(self, batch: List[dict]) -> bool:
+        """
+        Grava um lote. Com spool, uma tentativa no MongoDB e, se falhar (ou se o spool ainda
+        tem lotes anteriores), o lote vai para o disco sem segurar a fila. Sem spool, ou se o
+        disco também falhar, retentativas enquanto a fila segura os produtores.
+        """
+        if self.spool:
+            if self.spool.empty and await self._insert(batch):
+                return True
+            try:
+                was_empty = self.spool.empty
+                await self.spool.append(batch)
+                if was_empty:
+                    logger.warning(f"MongoDB indisponível: lotes de dados_veiculo indo para o spool em {self.spool.directory}")
+                return True
+            except Exception as e:
+                logger.error(f"Erro ao gravar lote de {len(batch)} documentos no spool: {e}")
+        
+        delay = 0.5
+        for attempt in range(1, self.settings.insert_max_retries + 1):
+            try:
+                started = time.perf_counter()
+                if attempt == 1:
+                    inserted = await mongodb_client.insert_dados_veiculo_batch(batch)
+                else:
+                    # A tentativa anterior pode ter gravado parte do lote antes de falhar
+                    inserted = await mongodb_client.insert_dados_veiculo_retry(batch)
+                MONGO_INSERT_SECONDS.observe(time.perf_counter() - started)
+                MONGO_INSERT_BATCH.observe(len(batch))
+                self.inserted_count += inserted
+                logger.debug(f"Lote inserido em dados_veiculo: {inserted} documentos")
+                return True
+            except Exception as e:
+                MONGO_INSERT_FAILURES.inc()
+                logger.warning(f"Falha ao gravar lote de {len(batch)} documentos (tentativa {attempt}): {e}")
+                if attempt < self.settings.insert_max_retries:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 10)
+
+        self.dropped_count += len(batch)
+        DADOS_DROPPED.inc(amount=len(batch))
+        logger.error(f"Lote de {len(batch)} documentos descartado após {self.settings.insert_max_retries} tentativas")
+        return False
+
+    async def _insert(self, batch: List[dict], replay: bool = False) -> bool:
+        """Uma tentativa de insert_many, sem esperar para repetir (replay: lote que pode já estar gravado)."""
+        try:
+            started = time.perf_counter()
+            if replay:
+                inserted = await mongodb_client.insert_dados_veiculo_retry(batch)
+            else:
+                inserted = await mongodb_client.insert_dados_veiculo_batch(batch)
+            MONGO_INSERT_SECONDS.observe(time.perf_counter() - started)
+            MONGO_INSERT_BATCH.observe(len(batch))
+            self.inserted_count += inserted
+            return True
+        except Exception as e:
+            MONGO_INSERT_FAILURES.inc()
+            logger.warning(f"Falha ao gravar lote de {len(batch)} documentos: {e}")
+            return False
+
+    async def _replay_loop(self):
+        """Regrava no MongoDB o que está no spool, em lotes, avançando o checkpoint."""
+        delay = 0.5
+        while True:
+            await self.spool.wait_data()
+            try:
+                documents, position, consumed = self.spool.read_batch(self.settings.insert_batch_size)
+            except Exception as e:
+                logger.error(f"Erro ao ler spool de dados_veiculo: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            if documents and not await self._insert(documents, replay=True):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            delay = 0.5
+            if documents or consumed:
+                self.spool.commit(position, consumed)
+                SPOOL_REPLAYED.inc(amount=len(documents))
+                if self.spool.empty:
+                    logger.info("Spool de dados_veiculo regravado no MongoDB")
+
+# Instância global
+dados_writer = DadosVeiculoWriter()
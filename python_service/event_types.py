@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+"""
+Tipos de evento publicados pelo barramento (events.py)
+Módulo sem dependências: o monitor em tempo real importa daqui sem configurar
+o logging nem as métricas do servidor.
+"""
+
+EVENT_TYPES = ('status', 'connect', 'frame', 'parse_error', 'save', 'command', 'trip', 'disconnect')
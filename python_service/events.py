@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Barramento de eventos do servidor (connect, frame, save, command, disconnect)
+Publica JSON por linha num socket Unix local para o monitor em tempo real, com
+filtro por IMEI e tipo de evento aplicado no servidor. Sem assinantes, publish()
+retorna imediatamente; um assinante lento perde eventos em vez de atrasar o loop.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+from event_types import EVENT_TYPES
+from logger import get_logger
+from metrics import Counter
+
+logger = get_logger(__name__)
+
+MAX_SUBSCRIBER_BUFFER = 1024 * 1024  # Bytes pendentes por assinante antes de descartar eventos
+
+EVENTS_DROPPED = Counter("gv50_events_dropped_total", "Eventos descartados por assinante lento do monitor")
+
+def events_socket_path(path: str, worker_id: int = 0) -> str:
+    """Socket próprio de cada worker (gps_events.sock -> gps_events.worker2.sock)."""
+    if not worker_id:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{worker_id}{ext}"
+
+class Subscriber:
+    """Assinante do barramento: filtros e destino (socket ou callback no processo)."""
+
+    __slots__ = ('imeis', 'events', 'writer', 'callback', 'dropped')
+
+    def __init__(self, imeis: Optional[Iterable[str]] = None, events: Optional[Iterable[str]] = None,
+                 writer: Optional[asyncio.StreamWriter] = None,
+                 callback: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.imeis: Optional[Set[str]] = set(imeis) if imeis else None  # None = todos
+        self.events: Optional[Set[str]] = set(events) if events else None
+        self.writer = writer
+        self.callback = callback
+        self.dropped = 0
+
+    def matches(self, event: str, imei: Optional[str]) -> bool:
+        if self.events is not None and event not in self.events:
+            return False
+        return self.imeis is None or imei in self.imeis
+
+class EventBus:
+    """Pub/sub de eventos do servidor com assinantes locais via socket Unix."""
+
+    def __init__(self):
+        self.subscribers: Set[Subscriber] = set()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.path: Optional[str] = None
+        self.status_provider: Optional[Callable[[], Dict[str, Any]]] = None  # Enviado a cada novo assinante
+
+    async def start(self, path: str):
+        """Abre o socket Unix de assinatura."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.server = await asyncio.start_unix_server(self._handle_subscriber, path)
+        os.chmod(path, 0o660)  # Eventos trazem IMEI e posição
+        self.path = path
+        logger.info(f"Eventos em tempo real publicados em {path}")
+
+    async def stop(self):
+        """Fecha o socket e desconecta os assinantes."""
+        if self.server:
+            self.server.close()
+        for subscriber in list(self.subscribers):
+            if subscriber.writer:
+                subscriber.writer.close()
+        self.subscribers.clear()
+        if self.server:
+            await self.server.wait_closed()
+            self.server = None
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None], imeis: Optional[Iterable[str]] = None,
+                  events: Optional[Iterable[str]] = None) -> Subscriber:
+        """Assinatura dentro do processo; o callback roda no event loop e não deve bloquear."""
+        subscriber = Subscriber(imeis, events, callback=callback)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: str, imei: Optional[str] = None, **fields: Any):
+        """Entrega o evento aos assinantes cujo filtro aceita (event, imei)."""
+        if not self.subscribers:
+            return
+        targets = [subscriber for subscriber in self.subscribers if subscriber.matches(event, imei)]
+        if not targets:
+            return
+        payload = {'ts': time.time(), 'event': event, 'imei': imei, 'pid': os.getpid(), **fields}
+        line = None
+        for subscriber in targets:
+            if subscriber.callback is not None:
+                try:
+                    subscriber.callback(payload)
+                except Exception as e:
+                    logger.error(f"Erro em assinante de eventos: {e}")
+                continue
+            if line is None:
+                line = (json.dumps(payload, default=str, ensure_ascii=False) + "\n").encode('utf-8')
+            self._send(subscriber, line)
+
+    def _send(self, subscriber: Subscriber, line: bytes):
+        writer = subscriber.writer
+        if writer.is_closing():
+            self.subscribers.discard(subscriber)
+            return
+        if writer.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+            subscriber.dropped += 1
+            EVENTS_DROPPED.inc()
+            if subscriber.dropped % 1000 == 1:
+                logger.warning(f"Assinante de eventos lento: {subscriber.dropped} eventos descartados")
+            return
+        writer.write(line)
+
+    async def _handle_subscriber(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Protocolo: o cliente envia uma linha JSON {"imei": [...], "events": [...]}
+        (ou linha vazia para tudo) e passa a receber um evento JSON por linha.
+        """
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            filters = json.loads(request) if request.strip() else {}
+            events = filters.get('events')
+            if isinstance(events, str):
+                events = [events]
+            unknown = set(events or ()) - set(EVENT_TYPES)
+            if unknown:
+                raise ValueError(f"tipos de evento desconhecidos: {', '.join(sorted(unknown))}")
+        except (asyncio.TimeoutError, ValueError, AttributeError) as e:
+            writer.write((json.dumps({'event': 'error', 'error': str(e)}) + "\n").encode('utf-8'))
+            writer.close()
+            return
+
+        imeis = filters.get('imei')
+        if isinstance(imeis, str):
+            imeis = [imeis]
+        subscriber = Subscriber(imeis, events, writer=writer)
+        if self.status_provider and (subscriber.events is None or 'status' in subscriber.events):
+            status = {'ts': time.time(), 'event': 'status', 'imei': None, 'pid': os.getpid(), **self.status_provider()}
+            writer.write((json.dumps(status, default=str) + "\n").encode('utf-8'))
+        self.subscribers.add(subscriber)
+        logger.info(f"Monitor de eventos conectado ({len(self.subscribers)} assinantes)")
+        try:
+            # O cliente não envia mais nada; EOF indica que ele saiu
+            while await reader.read(1024):
+                pass
+        except (ConnectionResetError, BrokenPipeError, OSError):
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            writer.close()
+
+# Instância global
+event_bus = EventBus()
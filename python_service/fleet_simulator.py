@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Simulador de frota GV50 para medir throughput e latência do servidor TCP
+Abre N long-connections, envia relatórios +RESP (GTFRI/GTIGN/GTIGF/GTIGL) na taxa
+configurada, rajadas +BUFF na conexão e confere cada +SACK recebido.
+
+Uso:
+  python fleet_simulator.py --devices 500 --rate 1 --duration 30
+      Sobe o serviço num processo filho com MongoDB em memória (mongomock-motor)
+  python fleet_simulator.py --host 10.0.0.5 --port 8000 --server-pid 1234 --devices 2000
+      Contra um servidor já em execução (CPU/memória medidos se --server-pid for informado)
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import signal
+import socket
+import time
+from typing import Dict, List, Optional
+import gv50_samples
+
+BUILDERS = {
+    'fri': gv50_samples.gtfri,
+    'ign': gv50_samples.gtign,
+    'igf': gv50_samples.gtigf,
+    'igl': gv50_samples.gtigl,
+}
+
+class FleetStats:
+    """Contadores e latências de ACK agregados de todos os dispositivos."""
+
+    def __init__(self):
+        self.connected = 0
+        self.connect_errors = 0
+        self.sent = 0
+        self.acked = 0
+        self.unexpected_acks = 0
+        self.other_messages = 0
+        self.disconnects = 0
+        self.latencies: List[float] = []
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """'fri=90,ign=4' -> {'fri': 90.0, 'ign': 4.0}."""
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name not in BUILDERS:
+            raise ValueError(f"Tipo desconhecido no --mix: {name} (use {', '.join(BUILDERS)})")
+        weights[name] = float(weight)
+    return weights
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def process_cpu_seconds(pid: int) -> float:
+    """CPU (usuário + sistema) consumida pelo processo, via /proc."""
+    with open(f'/proc/{pid}/stat') as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def process_rss_kb(pid: int) -> int:
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+def install_mongo_stand_in():
+    """Troca a conexão do mongodb_client por um MongoDB em memória (mongomock-motor)."""
+    from mongomock_motor import AsyncMongoMockClient
+    from pymongo.errors import OperationFailure
+    from mongodb_client import mongodb_client
+
+    async def connect():
+        mongodb_client.client = AsyncMongoMockClient()
+        mongodb_client.database = mongodb_client.client[mongodb_client.settings.mongodb_database]
+
+    def watch_comandos_veiculo(resume_after=None):
+        # Sem change streams em memória: o CommandDispatcher passa para o poll
+        raise OperationFailure("change streams indisponíveis no MongoDB em memória", code=40573)
+
+    mongodb_client.connect = connect
+    mongodb_client.watch_comandos_veiculo = watch_comandos_veiculo
+
+def run_stand_in_server(port: int, log_level: str):
+    """Processo filho: serviço completo (main.main) com MongoDB em memória."""
+    os.environ['TCP_PORT'] = str(port)
+    os.environ['LOG_LEVEL'] = log_level
+    os.environ['WORKERS'] = '1'
+    os.environ.setdefault('MAX_CONNECTIONS', '100000')
+    raise_fd_limit()
+    install_mongo_stand_in()
+    import main
+    asyncio.run(main.main())
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def wait_for_server(host: str, port: int, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+class SimulatedDevice:
+    """Um GV50 com long-connection: envia relatórios e casa cada +SACK pelo contador."""
+
+    def __init__(self, index: int, args, stats: FleetStats, kinds: List[str], weights: List[float]):
+        self.imei = f"86{index:013d}"
+        self.args = args
+        self.stats = stats
+        self.kinds = kinds
+        self.weights = weights
+        self.counter = random.randrange(0x10000)
+        self.pending: Dict[str, float] = {}  # contador -> instante do envio
+        self.longitude = -46.633308 + random.uniform(-0.2, 0.2)
+        self.latitude = -23.550520 + random.uniform(-0.2, 0.2)
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self, semaphore: asyncio.Semaphore) -> bool:
+        async with semaphore:
+            try:
+                self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+            except OSError:
+                self.stats.connect_errors += 1
+                return False
+        self.stats.connected += 1
+        return True
+
+    def next_frame(self, kind: str, message_type: str = "+RESP") -> str:
+        self.counter = (self.counter + 1) & 0xFFFF
+        number = gv50_samples.count_number(self.counter)
+        self.longitude += random.uniform(-0.0005, 0.0005)
+        self.latitude += random.uniform(-0.0005, 0.0005)
+        builder = BUILDERS[kind]
+        if kind == 'fri':
+            frame = builder(self.imei, number, self.longitude, self.latitude,
+                            speed=random.uniform(0, 90), message_type=message_type)
+        else:
+            frame = builder(self.imei, number, longitude=self.longitude, latitude=self.latitude,
+                            message_type=message_type)
+        self.pending[number] = time.perf_counter()
+        return frame
+
+    async def read_acks(self):
+        buffer = b""
+        while True:
+            data = await self.reader.read(4096)
+            if not data:
+                self.stats.disconnects += 1
+                return
+            received = time.perf_counter()
+            buffer += data
+            *frames, buffer = buffer.split(b"$")
+            for frame in frames:
+                text = frame.decode('utf-8', errors='replace')
+                if not text.startswith("+SACK:"):
+                    self.stats.other_messages += 1  # Heartbeat ou comando do servidor
+                    continue
+                number = text.rsplit(',', 1)[-1]
+                sent_at = self.pending.pop(number, None)
+                if sent_at is None:
+                    self.stats.unexpected_acks += 1
+                else:
+                    self.stats.acked += 1
+                    self.stats.latencies.append(received - sent_at)
+
+    async def run(self, start: asyncio.Event, stop_at: float):
+        ack_task = asyncio.create_task(self.read_acks())
+        await start.wait()
+        try:
+            # Dispositivo que acabou de reconectar descarrega o buffer (+BUFF) de uma vez
+            if self.args.buff_burst:
+                burst = [self.next_frame('fri', "+BUFF") for _ in range(self.args.buff_burst)]
+                self.writer.write("".join(burst).encode())
+                self.stats.sent += len(burst)
+
+            interval = 1.0 / self.args.rate
+            next_at = time.monotonic() + random.uniform(0, interval)  # Dessincronizar a frota
+            while next_at < stop_at:
+                await asyncio.sleep(max(0, next_at - time.monotonic()))
+                kind = random.choices(self.kinds, self.weights)[0]
+                self.writer.write(self.next_frame(kind).encode())
+                self.stats.sent += 1
+                next_at += interval
+                if self.writer.transport.get_write_buffer_size() > 65536:
+                    await self.writer.drain()
+
+            # Aguardar os ACKs que faltam
+            deadline = time.monotonic() + self.args.ack_timeout
+            while self.pending and time.monotonic() < deadline and not ack_task.done():
+                await asyncio.sleep(0.05)
+        except (ConnectionResetError, BrokenPipeError, OSError):
+            self.stats.disconnects += 1
+        finally:
+            ack_task.cancel()
+            self.writer.close()
+
+async def simulate(args) -> FleetStats:
+    stats = FleetStats()
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    devices = [SimulatedDevice(index, args, stats, kinds, weights) for index in range(args.devices)]
+
+    semaphore = asyncio.Semaphore(200)
+    connected = await asyncio.gather(*(device.connect(semaphore) for device in devices))
+    devices = [device for device, ok in zip(devices, connected) if ok]
+    await asyncio.sleep(1)  # Servidor terminar de aceitar as conexões
+
+    rss_connected = process_rss_kb(args.server_pid) if args.server_pid else None
+    cpu_start = process_cpu_seconds(args.server_pid) if args.server_pid else None
+    client_cpu_start = time.process_time()
+
+    start = asyncio.Event()
+    started = time.monotonic()
+    stop_at = started + args.duration
+    tasks = [asyncio.create_task(device.run(start, stop_at)) for device in devices]
+    start.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.monotonic() - started
+
+    print(f"\n=== Frota simulada: {stats.connected} dispositivos, {args.rate}/s cada, {args.duration:.0f}s ===")
+    if stats.connect_errors:
+        print(f"Falhas de conexão:        {stats.connect_errors}")
+    print(f"Mensagens enviadas:       {stats.sent} (rajada +BUFF de {args.buff_burst} por conexão)")
+    print(f"ACKs corretos:            {stats.acked}")
+    print(f"Sem ACK:                  {stats.sent - stats.acked}")
+    print(f"ACKs inesperados:         {stats.unexpected_acks}")
+    print(f"Outras mensagens:         {stats.other_messages}")
+    print(f"Desconexões:              {stats.disconnects}")
+    print(f"Throughput:               {stats.acked / elapsed:.0f} msg/s")
+    print(
+        f"Latência do ACK:          p50={percentile(stats.latencies, 0.5) * 1000:.2f}ms "
+        f"p99={percentile(stats.latencies, 0.99) * 1000:.2f}ms "
+        f"máx={max(stats.latencies, default=0) * 1000:.2f}ms"
+    )
+    if args.server_pid:
+        cpu = process_cpu_seconds(args.server_pid) - cpu_start
+        per_connection = (rss_connected - args.rss_baseline) * 1024 / max(stats.connected, 1)
+        print(f"CPU do servidor:          {cpu * 1e6 / max(stats.acked, 1):.0f} µs/mensagem ({cpu / elapsed * 100:.0f}% de um núcleo)")
+        print(f"Memória por conexão:      {per_connection:.0f} bytes (RSS {rss_connected / 1024:.1f} MB)")
+    client_cpu = time.process_time() - client_cpu_start
+    print(f"CPU do simulador:         {client_cpu / elapsed * 100:.0f}% de um núcleo")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador de frota GV50 (throughput e latência de ACK)")
+    parser.add_argument("--devices", type=int, default=500, help="Long-connections simultâneas")
+    parser.add_argument("--rate", type=float, default=1.0, help="Relatórios por segundo por dispositivo")
+    parser.add_argument("--duration", type=float, default=30, help="Segundos de envio")
+    parser.add_argument("--buff-burst", type=int, default=0, help="Relatórios +BUFF enviados de uma vez ao conectar")
+    parser.add_argument("--mix", default="fri=90,ign=4,igf=4,igl=2", help="Pesos dos tipos de relatório")
+    parser.add_argument("--ack-timeout", type=float, default=5, help="Segundos aguardando ACKs pendentes no fim")
+    parser.add_argument("--host", default=None, help="Servidor externo (sem isso, sobe um com MongoDB em memória)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--server-pid", type=int, default=None, help="PID do servidor externo para medir CPU/memória")
+    parser.add_argument("--log-level", default="WARNING", help="Nível de log do servidor em memória")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    raise_fd_limit()
+    server = None
+    if args.host is None:
+        try:
+            import mongomock_motor  # noqa: F401
+        except ImportError:
+            parser.error("o servidor em memória requer mongomock-motor (pip install mongomock-motor) ou use --host")
+        args.host, args.port = '127.0.0.1', free_port()
+        server = multiprocessing.get_context('fork').Process(
+            target=run_stand_in_server, args=(args.port, args.log_level), name="gps-stand-in"
+        )
+        server.start()
+        args.server_pid = server.pid
+
+    try:
+        asyncio.run(wait_for_server(args.host, args.port))
+        args.rss_baseline = process_rss_kb(args.server_pid) if args.server_pid else 0
+        asyncio.run(simulate(args))
+    finally:
+        if server:
+            os.kill(server.pid, signal.SIGTERM)
+            server.join(30)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Captura de frames brutos recebidos dos dispositivos
+Cada frame vira um registro <horário f64><conexão u32><tamanho u32><bytes> em arquivos
+gzip com rotação por tamanho. No caminho por frame só há um append num buffer em
+memória; compressão e escrita acontecem numa thread a cada segundo.
+Os arquivos são lidos por read_capture() e reproduzidos com replay_capture.py.
+"""
+
+import asyncio
+import glob
+import gzip
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+from metrics import Counter
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+CAPTURE_MAGIC = b"GV50CAP1"
+CAPTURE_SUFFIX = ".gv50cap.gz"
+RECORD_HEADER = struct.Struct("<dII")  # Horário (epoch), conexão, tamanho do frame
+FLUSH_THRESHOLD = 256 * 1024  # Bytes no buffer que antecipam a escrita
+MAX_BUFFER = 16 * 1024 * 1024  # Acima disso (disco lento) os frames deixam de ser capturados
+
+CAPTURE_FRAMES = Counter("gv50_capture_frames_total", "Frames gravados na captura bruta")
+CAPTURE_DROPPED = Counter("gv50_capture_dropped_total", "Frames não capturados por buffer de captura cheio")
+
+class FrameCapture:
+    """Grava os frames recebidos em arquivos .gv50cap.gz rotativos."""
+
+    def __init__(self, directory: str, prefix: str, max_bytes: int, max_files: int, flush_interval: float = 1.0):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes  # Bytes (antes da compressão) por arquivo
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self._buffer = bytearray()
+        self._flush_requested = asyncio.Event()
+        self._file = None
+        self._written = 0
+        self._sequence = 0
+        self._lock = threading.Lock()  # _write roda em thread do executor
+        self.flush_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(f"Captura de frames brutos ativa em {self.directory}")
+
+    async def stop(self):
+        """Grava o que está no buffer e fecha o arquivo atual."""
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+        logger.info(f"Captura de frames brutos encerrada em {self.directory}")
+
+    def record(self, connection_id: int, frame: memoryview):
+        """Chamado a cada frame recebido (inclusive os que o parser rejeita)."""
+        buffer = self._buffer
+        if len(buffer) > MAX_BUFFER:
+            CAPTURE_DROPPED.inc()
+            return
+        buffer += RECORD_HEADER.pack(time.time(), connection_id, len(frame))
+        buffer += frame
+        CAPTURE_FRAMES.inc()
+        if len(buffer) >= FLUSH_THRESHOLD:
+            self._flush_requested.set()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        data, self._buffer = self._buffer, bytearray()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        except Exception as e:
+            logger.error(f"Erro ao gravar captura de frames: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    def _write(self, data: bytearray):
+        with self._lock:
+            if self._file is None or self._written >= self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._written += len(data)
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+        self._sequence += 1
+        name = f"{self.prefix}-{datetime.utcnow():%Y%m%d-%H%M%S}-{self._sequence:04d}{CAPTURE_SUFFIX}"
+        self._file = gzip.open(os.path.join(self.directory, name), "wb", compresslevel=6)
+        self._file.write(CAPTURE_MAGIC)
+        self._written = 0
+
+        # Manter só os max_files mais recentes deste prefixo
+        files = sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}-*{CAPTURE_SUFFIX}")))
+        for old in files[:-self.max_files] if self.max_files > 0 else ():
+            try:
+                os.unlink(old)
+            except OSError as e:
+                logger.error(f"Erro ao remover captura antiga {old}: {e}")
+
+def capture_prefix(worker_id: int = 0) -> str:
+    """Prefixo dos arquivos de cada worker (capture-w2-...)."""
+    return f"capture-w{worker_id}" if worker_id else "capture"
+
+def read_capture(path: str) -> Iterator[Tuple[float, int, bytes]]:
+    """(horário, conexão, frame) de cada registro; um final truncado (sem fechamento) é ignorado."""
+    with gzip.open(path, "rb") as file:
+        if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} não é um arquivo de captura GV50")
+        try:
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                timestamp, connection_id, length = RECORD_HEADER.unpack(header)
+                frame = file.read(length)
+                if len(frame) < length:
+                    return
+                yield timestamp, connection_id, frame
+        except (EOFError, gzip.BadGzipFile):
+            logger.warning(f"Captura {path} termina truncada (serviço encerrado sem fechar o arquivo)")
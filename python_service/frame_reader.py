@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Enquadramento de mensagens GV50 sobre TCP
+Separa o fluxo de bytes em frames delimitados por '$'
+"""
+
+from typing import Iterator
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+FRAME_DELIMITER = ord('$')
+
+class FrameBuffer:
+    """Buffer reutilizável por conexão que extrai frames completos terminados em '$'.
+
+    Uma única leitura pode trazer vários relatórios (+RESP/+BUFF em rajada) ou
+    apenas parte de um; o restante incompleto fica no buffer até a próxima leitura.
+    """
+
+    def __init__(self, max_size: int = 16384):
+        self.max_size = max_size
+        self.overflows = 0  # Quantas vezes o buffer foi descartado por exceder max_size
+        self._buffer = bytearray()
+        self._scan_from = 0  # Posição a partir da qual ainda não há '$'
+        self._discarding = False  # Após overflow: descartar o resto do frame grande até o próximo '$'
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> Iterator[memoryview]:
+        """
+        Acrescenta bytes recebidos e gera cada frame completo como memoryview.
+
+        As views apontam para o buffer interno (sem cópia) e só são válidas até
+        o gerador avançar; quem precisar guardar o conteúdo deve copiá-lo.
+        """
+        if self._discarding:
+            end = data.find(FRAME_DELIMITER)
+            if end == -1:
+                return
+            data = data[end + 1:]
+            self._discarding = False
+
+        buffer = self._buffer
+        buffer += data
+
+        start = 0
+        try:
+            with memoryview(buffer) as view:
+                while True:
+                    end = buffer.find(FRAME_DELIMITER, max(start, self._scan_from))
+                    if end == -1:
+                        break
+                    frame = view[start:end + 1]
+                    try:
+                        yield frame
+                    finally:
+                        frame.release()
+                    start = end + 1
+                    self._scan_from = start
+        finally:
+            self._compact(start)
+
+    def _compact(self, consumed: int):
+        """Remove os frames já consumidos e limita o tamanho do resto incompleto."""
+        if consumed:
+            try:
+                del self._buffer[:consumed]
+            except BufferError:
+                # Alguma view ainda exportada pelo consumidor - recomeçar num buffer novo
+                self._buffer = bytearray(self._buffer[consumed:])
+        self._scan_from = len(self._buffer)
+
+        if len(self._buffer) > self.max_size:
+            self.overflows += 1
+            logger.warning(
+                f"Frame sem delimitador excedeu {self.max_size} bytes, "
+                f"descartando {len(self._buffer)} bytes do buffer"
+            )
+            self.clear()
+            self._discarding = True
+
+    def clear(self):
+        """Descarta qualquer dado pendente no buffer."""
+        try:
+            self._buffer.clear()
+        except BufferError:
+            self._buffer = bytearray()
+        self._scan_from = 0
+        self._discarding = False
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Frames GV50 de exemplo para simulação, benchmarks e testes de carga
+Os campos seguem as posições lidas por protocol_parser
+"""
+
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+PROTOCOL_VERSION = "060100"
+
+def count_number(n: int) -> str:
+    """Contador da mensagem (último campo) em hexadecimal de 4 dígitos, como o dispositivo envia."""
+    return f"{n & 0xFFFF:04X}"
+
+def device_time(when: Optional[datetime] = None) -> str:
+    """Horário no formato YYYYMMDDhhmmss (UTC)."""
+    return (when or datetime.utcnow()).strftime("%Y%m%d%H%M%S")
+
+def _frame(parts: List[str]) -> str:
+    return ",".join(parts) + "$"
+
+def gtfri(imei: str, number: str, longitude: float = -46.633308, latitude: float = -23.550520,
+          speed: float = 12.5, altitude: float = 850.0, ignition: bool = True,
+          when: Optional[datetime] = None, message_type: str = "+RESP") -> str:
+    """Relatório de posição (GTFRI)."""
+    timestamp = device_time(when)
+    return _frame([
+        f"{message_type}:GTFRI", PROTOCOL_VERSION, imei, "", "12.4", "10",
+        "1" if ignition else "0",  # [6] ignição
+        "1",
+        f"{speed:.1f}",            # [8] velocidade
+        "90",
+        f"{altitude:.1f}",         # [10] altitude
+        f"{longitude:.6f}",        # [11] longitude
+        f"{latitude:.6f}",         # [12] latitude
+        timestamp,                 # [13] horário GPS
+        "0724", "0000", "18d8", "6141", "00", "2000.0", "00010:00:00", "", "", "220100", "", "", "",
+        timestamp, number,
+    ])
+
+def _ignition_event(command_type: str, imei: str, number: str, longitude: float, latitude: float,
+                    altitude: float, when: Optional[datetime], message_type: str,
+                    duration: str = "", accuracy: str = "1") -> str:
+    timestamp = device_time(when)
+    return _frame([
+        f"{message_type}:{command_type}", PROTOCOL_VERSION, imei, "",
+        duration,                  # [4] duração do estado anterior (GTIGN/GTIGF)
+        accuracy,                  # [5] precisão GPS / voltagem (GTIGL)
+        "0.0", "0", "0",
+        f"{altitude:.1f}",         # [9] altitude
+        f"{longitude:.6f}",        # [10] longitude
+        f"{latitude:.6f}",         # [11] latitude
+        timestamp,                 # [12] horário GPS
+        "0724", "0000", "18d8", "6141", "00", "00010:00:00", "2000.0",
+        timestamp, number,
+    ])
+
+def gtign(imei: str, number: str, longitude: float = -46.633308, latitude: float = -23.550520,
+          altitude: float = 850.0, when: Optional[datetime] = None, message_type: str = "+RESP") -> str:
+    """Evento de ignição ligada (GTIGN)."""
+    return _ignition_event("GTIGN", imei, number, longitude, latitude, altitude, when, message_type, duration="120")
+
+def gtigf(imei: str, number: str, longitude: float = -46.633308, latitude: float = -23.550520,
+          altitude: float = 850.0, when: Optional[datetime] = None, message_type: str = "+RESP") -> str:
+    """Evento de ignição desligada (GTIGF)."""
+    return _ignition_event("GTIGF", imei, number, longitude, latitude, altitude, when, message_type, duration="3600")
+
+def gtigl(imei: str, number: str, voltage: float = 11.2, longitude: float = -46.633308,
+          latitude: float = -23.550520, altitude: float = 850.0, when: Optional[datetime] = None,
+          message_type: str = "+RESP") -> str:
+    """Alerta de bateria externa baixa (GTIGL)."""
+    return _ignition_event("GTIGL", imei, number, longitude, latitude, altitude, when, message_type,
+                           accuracy=f"{voltage:.1f}")
+
+def corpus() -> List[Tuple[str, bytes]]:
+    """Frames de referência por tipo de mensagem, incluindo malformados, para benchmarks."""
+    imei = "862170013556541"
+    when = datetime(2025, 1, 1, 12, 0, 0)
+    fri = gtfri(imei, "0001", when=when)
+    return [
+        ("GTFRI", fri.encode()),
+        ("GTFRI+BUFF", gtfri(imei, "0002", when=when, message_type="+BUFF").encode()),
+        ("GTFRI-sem-fix", fri.replace("-46.633308", "").replace("-23.550520", "").encode()),
+        ("GTIGN", gtign(imei, "0003", when=when).encode()),
+        ("GTIGF", gtigf(imei, "0004", when=when).encode()),
+        ("GTIGL", gtigl(imei, "0005", when=when).encode()),
+        ("ACK-GTOUT", f"+ACK:GTOUT,{PROTOCOL_VERSION},{imei},,FFFF,{device_time(when)},0006$".encode()),
+        # Malformados: o parser deve recusá-los sem exceção
+        ("invalido-truncado", fri[:60].encode()),
+        ("invalido-comando", f"+RESP:GTXXX,{PROTOCOL_VERSION},{imei},,0007$".encode()),
+        ("invalido-sem-prefixo", b"AT+GTHBD=gv50$"),
+        ("invalido-utf8", b"+RESP:GTFRI," + bytes([0xff, 0xfe]) + b",0008$"),
+        ("invalido-numeros", fri.replace("12.5", "abc").replace("20250101120000", "2025XX").encode()),
+    ]
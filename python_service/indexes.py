@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Gerenciamento declarativo das coleções e índices do MongoDB
+Cria (de forma idempotente) os índices usados nos caminhos quentes e reporta divergências
+"""
+
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE
+from pymongo.errors import OperationFailure
+from config import get_settings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Opções que tornam dois índices com as mesmas chaves diferentes entre si
+_COMPARED_OPTIONS = ('unique', 'partialFilterExpression', 'expireAfterSeconds')
+
+def index_specs(dados_timeseries: bool = False) -> Dict[str, List[dict]]:
+    """Índices esperados por coleção: {'keys': [...], ...opções do createIndex}."""
+    settings = get_settings()
+    specs = {
+        'veiculo': [
+            # find_one/update_one({"IMEI": ...}) em cada mensagem
+            {'keys': [('IMEI', ASCENDING)], 'unique': True},
+            # get_veiculos_com_comando_pendente: só documentos com comando entram no índice
+            {'keys': [('comandoBloqueo', ASCENDING)],
+             'partialFilterExpression': {'comandoBloqueo': {'$type': 'bool'}}},
+            {'keys': [('comandoTrocarIP', ASCENDING)],
+             'partialFilterExpression': {'comandoTrocarIP': True}},
+        ],
+        'comandos': [
+            # get_comandos_ativos na primeira mensagem de cada conexão
+            {'keys': [('IMEI', ASCENDING), ('status', ASCENDING), ('criado_em', ASCENDING)]},
+        ],
+        'dados_veiculo': [
+            # Histórico/trajeto por veículo ordenado por data
+            {'keys': [('IMEI', ASCENDING), ('data', DESCENDING)]},
+            {'keys': [('location', GEOSPHERE)]},
+        ],
+        'posicao_atual': [
+            # Lida pelo _id (IMEI); veículos dentro de uma área do mapa
+            {'keys': [('location', GEOSPHERE)]},
+        ],
+        'viagens': [
+            # Viagens de um veículo por período
+            {'keys': [('IMEI', ASCENDING), ('inicio', DESCENDING)]},
+        ],
+    }
+    # Em time-series a retenção é uma opção da coleção (expireAfterSeconds), não um índice TTL
+    if settings.dados_retention_days > 0 and not dados_timeseries:
+        specs['dados_veiculo'].append(
+            {'keys': [('data', ASCENDING)], 'expireAfterSeconds': settings.dados_retention_days * 86400}
+        )
+    # Arquivo de mensagem_raw: lido só pelo _id; a retenção pode ser menor que a de dados_veiculo
+    if settings.raw_storage_mode == 'archive' and settings.raw_archive_retention_days > 0:
+        specs['dados_veiculo_raw'] = [
+            {'keys': [('data', ASCENDING)], 'expireAfterSeconds': settings.raw_archive_retention_days * 86400}
+        ]
+    return specs
+
+def timeseries_options() -> dict:
+    """Opções do createCollection de dados_veiculo em modo time-series."""
+    settings = get_settings()
+    options = {
+        'timeseries': {
+            'timeField': 'data',
+            'metaField': 'IMEI',
+            'granularity': settings.timeseries_granularity,
+        }
+    }
+    if settings.dados_retention_days > 0:
+        options['expireAfterSeconds'] = settings.dados_retention_days * 86400
+    return options
+
+async def collection_info(database, name: str) -> Optional[dict]:
+    """Retorna a entrada de listCollections da coleção (None se não existir)."""
+    cursor = await database.list_collections(filter={'name': name})
+    async for info in cursor:
+        return info
+    return None
+
+async def create_timeseries_collection(database, name: str):
+    """Cria a coleção time-series de dados_veiculo (timeField=data, metaField=IMEI)."""
+    options = timeseries_options()
+    await database.create_collection(name, **options)
+    logger.info(f"Coleção time-series criada: {name} (granularidade {options['timeseries']['granularity']})")
+
+async def ensure_dados_collection(database) -> bool:
+    """
+    Garante o modo de armazenamento de dados_veiculo configurado em DADOS_STORAGE_MODE.
+    Retorna True se dados_veiculo for uma coleção time-series.
+    """
+    settings = get_settings()
+    info = await collection_info(database, 'dados_veiculo')
+    is_timeseries = info is not None and info.get('type') == 'timeseries'
+
+    if settings.dados_storage_mode != 'timeseries':
+        if is_timeseries:
+            logger.warning("dados_veiculo é time-series mas DADOS_STORAGE_MODE=regular")
+        return is_timeseries
+
+    if info is None:
+        await create_timeseries_collection(database, 'dados_veiculo')
+        return True
+    if not is_timeseries:
+        logger.warning(
+            "DADOS_STORAGE_MODE=timeseries mas dados_veiculo é uma coleção regular; "
+            "execute 'python migrations.py timeseries' para convertê-la"
+        )
+        return False
+
+    # Sincronizar retenção e granularidade com a configuração atual
+    current = info.get('options', {})
+    expected = timeseries_options()
+    expire = expected.get('expireAfterSeconds')
+    if current.get('expireAfterSeconds') != expire:
+        await database.command('collMod', 'dados_veiculo', expireAfterSeconds=expire or 'off')
+        logger.info(f"Retenção de dados_veiculo ajustada para {expire or 'sem expiração'}")
+
+    granularity = expected['timeseries']['granularity']
+    if current.get('timeseries', {}).get('granularity') != granularity:
+        try:
+            await database.command('collMod', 'dados_veiculo', timeseries={'granularity': granularity})
+            logger.info(f"Granularidade de dados_veiculo ajustada para {granularity}")
+        except OperationFailure as e:
+            # O MongoDB só permite aumentar a granularidade (seconds -> minutes -> hours)
+            logger.error(f"Não foi possível alterar a granularidade de dados_veiculo para {granularity}: {e}")
+    return True
+
+async def ensure_raw_archive_collection(database):
+    """Cria dados_veiculo_raw com compressão de bloco zstd (dados frios, lidos raramente)."""
+    if get_settings().raw_storage_mode != 'archive':
+        return
+    if await collection_info(database, 'dados_veiculo_raw') is not None:
+        return
+    try:
+        await database.create_collection(
+            'dados_veiculo_raw', storageEngine={'wiredTiger': {'configString': 'block_compressor=zstd'}}
+        )
+        logger.info("Coleção dados_veiculo_raw criada (block_compressor=zstd)")
+    except OperationFailure as e:
+        logger.warning(f"dados_veiculo_raw será criada com a compressão padrão: {e}")
+
+def _key_pattern(keys) -> tuple:
+    return tuple((field, direction) for field, direction in keys)
+
+def _options(index: dict) -> dict:
+    return {option: index[option] for option in _COMPARED_OPTIONS if option in index}
+
+async def ensure_indexes(database) -> Dict[str, List[str]]:
+    """
+    Cria dados_veiculo no modo de armazenamento configurado, cria os índices
+    declarados que ainda não existem e reporta os ausentes, divergentes e sem uso.
+    Retorna {'missing': [...], 'mismatched': [...], 'unused': [...]}.
+    """
+    settings = get_settings()
+    report = {'missing': [], 'mismatched': [], 'unused': []}
+    created = set()
+    all_specs = index_specs(await ensure_dados_collection(database))
+    await ensure_raw_archive_collection(database)
+
+    for collection_name, specs in all_specs.items():
+        collection = database[collection_name]
+        existing = {}
+        async for index in collection.list_indexes():
+            existing[_key_pattern(index['key'].items())] = index
+
+        for spec in specs:
+            keys = spec['keys']
+            options = {option: value for option, value in spec.items() if option != 'keys'}
+            description = f"{collection_name}{dict(keys)}"
+            current = existing.get(_key_pattern(keys))
+
+            if current is not None:
+                if _options(current) == options:
+                    continue
+                if set(_options(current)) == {'expireAfterSeconds'} == set(options):
+                    # Retenção alterada: ajustar o TTL no lugar, sem recriar o índice
+                    await database.command('collMod', collection_name, index={
+                        'name': current['name'], 'expireAfterSeconds': options['expireAfterSeconds']
+                    })
+                    logger.info(f"TTL de {description} ajustado para {options['expireAfterSeconds']}s")
+                    continue
+                report['mismatched'].append(description)
+                logger.warning(
+                    f"Índice {current['name']} em {collection_name} tem opções {_options(current)}, "
+                    f"esperado {options}; remova-o para que seja recriado"
+                )
+                continue
+
+            if not settings.auto_create_indexes:
+                report['missing'].append(description)
+                continue
+            try:
+                name = await collection.create_index(keys, **options)
+                created.add(f"{collection_name}.{name}")
+                logger.info(f"Índice criado: {collection_name}.{name}")
+            except OperationFailure as e:
+                report['missing'].append(description)
+                logger.error(f"Não foi possível criar índice {description}: {e}")
+
+    for description in report['missing']:
+        logger.warning(f"Índice ausente: {description}")
+
+    report['unused'] = await _unused_indexes(database, all_specs, created)
+    return report
+
+async def _unused_indexes(database, all_specs: Dict[str, List[dict]], created: set) -> List[str]:
+    """Lista índices fora da especificação ou sem uso desde o último restart do mongod."""
+    unused = []
+    for collection_name, specs in all_specs.items():
+        declared = {_key_pattern(spec['keys']) for spec in specs}
+        try:
+            async for stats in database[collection_name].aggregate([{'$indexStats': {}}]):
+                if stats['name'] == '_id_':
+                    continue
+                key = _key_pattern(stats['key'].items())
+                description = f"{collection_name}.{stats['name']}"
+                if key not in declared:
+                    unused.append(description)
+                    logger.info(f"Índice não declarado: {description} ({stats['accesses']['ops']} usos)")
+                elif stats['accesses']['ops'] == 0 and description not in created:
+                    unused.append(description)
+                    logger.info(f"Índice sem uso desde {stats['accesses']['since']}: {description}")
+        except OperationFailure as e:
+            logger.debug(f"$indexStats indisponível para {collection_name}: {e}")
+    return unused
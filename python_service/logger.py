@@ -1,32 +1,156 @@
+import atexit
 import logging
+import logging.handlers
 import os
-from datetime import datetime
+import queue
+from typing import Dict, Optional, Tuple
 from config import config
 
-def setup_logging():
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+MAX_SAMPLING_KEYS = 100000  # Contadores de amostragem mantidos antes de recomeçar do zero
+
+_listener: Optional["LogQueueListener"] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+_sampling_filter: Optional["ImeiSamplingFilter"] = None
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta registros quando a fila está cheia em vez de bloquear o event loop."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._reported = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        # Avisar no próprio log quantos registros foram perdidos, assim que houver espaço
+        if self.dropped > self._reported:
+            lost = self.dropped - self._reported
+            self._reported = self.dropped
+            warning = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                f"Fila de log cheia: {lost} mensagens descartadas", None, None
+            )
+            try:
+                self.queue.put_nowait(warning)
+            except queue.Full:
+                pass
+
+class LogQueueListener(logging.handlers.QueueListener):
+    """QueueListener cujo sinal de parada aguarda espaço na fila limitada."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+class ImeiSamplingFilter(logging.Filter):
+    """
+    Registra apenas 1 a cada N mensagens de cada linha de log por IMEI (registros com
+    extra={'imei': ...}). O contador é por linha: um frame gera sempre a mesma sequência
+    de mensagens, e um contador único por IMEI descartaria sempre as mesmas.
+    """
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self._counters: Dict[Tuple[str, str, int], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        imei = getattr(record, 'imei', None)
+        if imei is None or self.rate <= 1 or record.levelno > logging.INFO:
+            return True
+        key = (imei, record.name, record.lineno)
+        counters = self._counters
+        count = counters.get(key)
+        if count is None:
+            count = 0
+            if len(counters) >= MAX_SAMPLING_KEYS:
+                counters.clear()  # Limita a memória com IMEIs que não voltam mais
+        counters[key] = count + 1
+        return count % self.rate == 0
+
+def _create_file_handler(log_file: str) -> logging.Handler:
+    """Cria o handler de arquivo com rotação por tamanho ou por tempo."""
+    if config.log_rotation == 'time':
+        return logging.handlers.TimedRotatingFileHandler(
+            log_file,
+            when=config.log_rotation_when,
+            backupCount=config.log_backup_count,
+            encoding='utf-8'
+        )
+    if config.log_rotation == 'size':
+        return logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=config.log_max_bytes,
+            backupCount=config.log_backup_count,
+            encoding='utf-8'
+        )
+    return logging.FileHandler(log_file, encoding='utf-8')
+
+def worker_log_file(worker_id: int) -> str:
+    """Arquivo de log próprio de um processo worker (rotação não é segura entre processos)."""
+    root, ext = os.path.splitext(config.log_file)
+    return f"{root}.worker{worker_id}{ext}"
+
+def setup_logging(log_file: Optional[str] = None):
     """Setup application logging."""
+    global _listener, _queue_handler, _sampling_filter
+    log_file = log_file or config.log_file
+
     # Create logs directory if it doesn't exist
-    log_dir = os.path.dirname(config.log_file)
+    log_dir = os.path.dirname(log_file)
     if log_dir and not os.path.exists(log_dir):
         os.makedirs(log_dir)
-    
+
+    # Escrita em disco/console numa thread separada, fora do event loop
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [_create_file_handler(log_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=config.log_queue_size)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _sampling_filter = ImeiSamplingFilter(config.log_sample_rate)
+    _queue_handler.addFilter(_sampling_filter)
+    _listener = LogQueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
     # Configure root logger
-    logging.basicConfig(
-        level=getattr(logging, config.log_level.upper()),
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(config.log_file),
-            logging.StreamHandler()
-        ]
-    )
-    
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, config.log_level.upper()))
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+
     # Set specific logger levels
     logging.getLogger('asyncio').setLevel(logging.WARNING)
     logging.getLogger('motor').setLevel(logging.INFO)
 
+def apply_log_settings(settings):
+    """Aplica nível e amostragem de log alterados em execução (reload por SIGHUP)."""
+    logging.getLogger().setLevel(getattr(logging, settings.log_level.upper()))
+    if _sampling_filter:
+        _sampling_filter.rate = settings.log_sample_rate
+
+def shutdown_logging():
+    """Esvazia a fila de log e para a thread de escrita."""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+def get_dropped_count() -> int:
+    """Quantidade de registros descartados por fila de log cheia."""
+    return _queue_handler.dropped if _queue_handler else 0
+
 def get_logger(name: str) -> logging.Logger:
     """Get logger instance."""
     return logging.getLogger(name)
 
 # Initialize logging on import
 setup_logging()
+atexit.register(shutdown_logging)
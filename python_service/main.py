@@ -5,10 +5,15 @@ Sistema simplificado com apenas 2 tabelas: DadosVeiculo e Veiculo
 """
 
 import asyncio
+import multiprocessing
+import multiprocessing.connection
+import os
 import signal
-import sys
+import time
+from typing import Dict
 from tcp_server import tcp_server
-from logger import get_logger
+from config import get_settings, reload_settings
+from logger import get_logger, setup_logging, shutdown_logging, worker_log_file
 
 logger = get_logger(__name__)
 
@@ -42,20 +47,152 @@ class GPSService:
             await tcp_server.stop_server()
             self.running = False
 
-def signal_handler(signum, frame):
+class WorkerSupervisor:
+    """Mantém N processos worker escutando a mesma porta (SO_REUSEPORT) e reinicia os que caírem."""
+
+    MIN_UPTIME = 10  # Worker que cai antes disso é reiniciado com backoff
+
+    @property
+    def settings(self):
+        return get_settings()
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.context = multiprocessing.get_context('fork')
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.started_at: Dict[int, float] = {}
+        self.restart_delay: Dict[int, float] = {}
+        self.restart_at: Dict[int, float] = {}
+        self.stopping = False
+        self.stop_signal = None
+        self.reload_requested = False
+
+    def start_worker(self, worker_id: int):
+        """Cria o processo de um worker."""
+        process = self.context.Process(target=run_worker, args=(worker_id,), name=f"gps-worker-{worker_id}")
+        process.start()
+        self.processes[worker_id] = process
+        self.started_at[worker_id] = time.monotonic()
+        logger.info(f"Worker {worker_id} iniciado (pid={process.pid})")
+
+    def handle_signal(self, signum, frame):
+        """SIGTERM/SIGINT: encerrar os workers de forma ordenada (o loop principal faz o shutdown)."""
+        self.stop_signal = signum
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        """SIGHUP: repassado aos workers pelo loop principal."""
+        self.reload_requested = True
+
+    def forward_reload(self):
+        """Relê a configuração do supervisor e repassa o SIGHUP para cada worker recarregar a sua."""
+        self.reload_requested = False
+        try:
+            reload_settings()
+        except Exception as e:
+            logger.error(f"Configuração inválida no reload do supervisor: {e}")
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+        logger.info(f"SIGHUP repassado para {len(self.processes)} workers")
+
+    def run(self):
+        """Loop do supervisor: inicia, monitora e reinicia workers."""
+        signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+
+        logger.info(f"=== SUPERVISOR: {self.workers} workers na porta {self.settings.tcp_port} (SO_REUSEPORT) ===")
+        for worker_id in range(1, self.workers + 1):
+            self.start_worker(worker_id)
+
+        while not self.stopping:
+            sentinels = [process.sentinel for process in self.processes.values()]
+            multiprocessing.connection.wait(sentinels, timeout=1)
+            now = time.monotonic()
+            if self.reload_requested and not self.stopping:
+                self.forward_reload()
+
+            for worker_id, process in list(self.processes.items()):
+                if process.is_alive() or self.stopping:
+                    continue
+                del self.processes[worker_id]
+                process.join()
+
+                # Backoff para não entrar em loop de reinício se o worker cai ao iniciar
+                uptime = now - self.started_at[worker_id]
+                if uptime < self.MIN_UPTIME:
+                    delay = min(self.restart_delay.get(worker_id, 0.5) * 2, 30)
+                else:
+                    delay = 1
+                self.restart_delay[worker_id] = delay
+                self.restart_at[worker_id] = now + delay
+                logger.error(f"Worker {worker_id} terminou (exitcode={process.exitcode}), reiniciando em {delay:.0f}s")
+
+            for worker_id, restart_at in list(self.restart_at.items()):
+                if now >= restart_at and not self.stopping:
+                    del self.restart_at[worker_id]
+                    self.start_worker(worker_id)
+
+        logger.info(f"Supervisor recebeu sinal {self.stop_signal}, encerrando {len(self.processes)} workers")
+        self.shutdown()
+
+    def shutdown(self):
+        """Envia SIGTERM para todos os workers e força o término de quem não sair a tempo."""
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.monotonic() + self.settings.worker_shutdown_timeout
+        for worker_id, process in self.processes.items():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {worker_id} não encerrou em {self.settings.worker_shutdown_timeout}s, forçando")
+                process.kill()
+                process.join()
+        logger.info("=== SUPERVISOR PARADO ===")
+
+def run_worker(worker_id: int):
+    """Ponto de entrada de um processo worker."""
+    # A thread de log do supervisor não existe no processo filho
+    setup_logging(worker_log_file(worker_id))
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)  # Até o event loop instalar o handler de reload
+    tcp_server.worker_id = worker_id
+    try:
+        asyncio.run(main())
+    finally:
+        shutdown_logging()
+
+def signal_handler(signum, main_task: asyncio.Task):
     """Handler para sinais de sistema."""
     logger.info(f"Recebido sinal {signum}")
-    sys.exit(0)
+    main_task.cancel()
 
 async def main():
     """Função principal."""
-    # Configurar handlers de sinal
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
+    # Configurar handlers de sinal (cancelar a task principal executa o shutdown ordenado)
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, signal_handler, signum, main_task)
+    # SIGHUP recarrega a configuração ajustável sem derrubar conexões
+    loop.add_signal_handler(signal.SIGHUP, tcp_server.reload)
+
     # Iniciar serviço
     service = GPSService()
-    await service.start()
+    try:
+        await service.start()
+    except asyncio.CancelledError:
+        logger.info("Serviço encerrado por sinal")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        workers = get_settings().workers
+        if workers > 1:
+            WorkerSupervisor(workers).run()
+        else:
+            asyncio.run(main())
+    finally:
+        shutdown_logging()
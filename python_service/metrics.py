@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Métricas operacionais no formato texto do Prometheus
+Contadores, gauges e histogramas por processo worker, expostos em GET /metrics.
+Todo acesso acontece na thread do event loop, então registrar uma amostra é só
+uma soma em dict/lista, sem locks.
+"""
+
+import asyncio
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+_registry: List["Metric"] = []
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[object]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    """Base das métricas: nome, descrição, rótulos e registro global."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function  # Valor lido no momento do scrape (estado que já existe em outro objeto)
+        _registry.append(self)
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """(sufixo, rótulos formatados, valor) de cada série."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    """Contador monotônico, opcionalmente com rótulos (inc('GTFRI'))."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames, function)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        if self.function is not None:
+            return self.function()
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        if self.function is not None or not self.labelnames:
+            yield "", "", self.value()
+            return
+        for labels, value in self._values.items():
+            yield "", _format_labels(self.labelnames, labels), value
+
+class Gauge(Counter):
+    """Valor instantâneo (set/inc/dec ou função lida no scrape)."""
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(Metric):
+    """Distribuição em faixas fixas (sem rótulos); observe() é uma busca binária e três somas."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # Último = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self._counts):
+            cumulative += count
+            yield "_bucket", f'{{le="{_format_value(bound)}"}}', cumulative
+        yield "_sum", "", self.sum
+        yield "_count", "", self.count
+
+def render() -> str:
+    """Todas as métricas registradas no formato de exposição do Prometheus."""
+    lines: List[str] = []
+    for metric in _registry:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            logger.error(f"Erro ao coletar métrica {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+# Caminho por frame
+FRAMES = Counter("gv50_frames_total", "Frames GV50 reconhecidos por tipo de mensagem e comando",
+                 ("message_type", "command_type"))
+PARSE_FAILURES = Counter("gv50_parse_failures_total", "Frames descartados pelo parser (malformados ou sem IMEI)")
+ACK_LATENCY = Histogram("gv50_ack_latency_seconds", "Tempo entre o frame completo e o ACK escrito no socket")
+COMMANDS_SENT = Counter("gv50_commands_sent_total", "Comandos enviados aos dispositivos (cada tentativa)", ("command",))
+COMMANDS_CONFIRMED = Counter("gv50_commands_confirmed_total", "Comandos confirmados por +ACK do dispositivo", ("command",))
+COMMANDS_FAILED = Counter("gv50_commands_failed_total", "Comandos sem +ACK após todas as tentativas", ("command",))
+COMMANDS_IN_FLIGHT = Gauge("gv50_commands_in_flight", "Comandos enviados aguardando +ACK")
+
+# MongoDB
+MONGO_INSERT_SECONDS = Histogram("gv50_mongo_insert_seconds", "Duração de cada insert_many em dados_veiculo")
+MONGO_INSERT_BATCH = Histogram("gv50_mongo_insert_batch_size", "Documentos por lote gravado em dados_veiculo",
+                               buckets=BATCH_BUCKETS)
+MONGO_INSERT_FAILURES = Counter("gv50_mongo_insert_failures_total", "Tentativas de gravar lote de dados_veiculo que falharam")
+DADOS_DROPPED = Counter("gv50_dados_dropped_total", "Documentos de dados_veiculo descartados após esgotar as tentativas")
+MONGO_UPDATE_SECONDS = Histogram("gv50_mongo_update_seconds", "Duração de cada bulk_write de campos da coleção veiculo")
+MONGO_UPDATE_BATCH = Histogram("gv50_mongo_update_batch_size", "Veículos por bulk_write na coleção veiculo",
+                               buckets=BATCH_BUCKETS)
+
+# Conexões e filas (lidos no scrape a partir do estado do servidor)
+CONNECTIONS_ACTIVE = Gauge("gv50_connections_active", "Long-connections admitidas neste worker")
+DEVICES_CONNECTED = Gauge("gv50_devices_connected", "Conexões com IMEI já identificado neste worker")
+ADMISSION_QUEUED = Gauge("gv50_admission_queued", "Conexões aguardando vaga (política queue)")
+CONNECTIONS_REJECTED = Counter("gv50_connections_rejected_total", "Conexões recusadas pela admissão")
+DADOS_QUEUE_DEPTH = Gauge("gv50_dados_queue_depth", "Documentos aguardando gravação em lote")
+VEICULO_PENDING = Gauge("gv50_veiculo_pending_updates", "Veículos com campos aguardando o flush")
+LOG_DROPPED = Counter("gv50_log_dropped_total", "Registros de log descartados por fila cheia")
+
+# Event loop
+LOOP_LAG = Histogram("gv50_event_loop_lag_seconds", "Atraso do event loop sobre um sleep periódico",
+                     buckets=LAG_BUCKETS)
+
+# Rota HTTP: recebe a query string e retorna (status, content-type, corpo)
+Route = Callable[[Dict[str, str]], Tuple[str, str, bytes]]
+
+def _metrics_route(query: Dict[str, str]) -> Tuple[str, str, bytes]:
+    return "200 OK", CONTENT_TYPE, render().encode("utf-8")
+
+class HttpEndpoint:
+    """Servidor HTTP mínimo (GET/HEAD, uma requisição por conexão) para as rotas registradas."""
+
+    def __init__(self, host: str, port: int, name: str = "http"):
+        self.host = host
+        self.port = port
+        self.name = name
+        self.routes: Dict[str, Route] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    def add_route(self, path: str, route: Route):
+        self.routes[path] = route
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        paths = ", ".join(path for path in self.routes if path != "/")
+        logger.info(f"Endpoint {self.name} em http://{self.host}:{self.port} ({paths})")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Descartar os cabeçalhos até a linha em branco
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request.decode("latin-1").split()
+            method = parts[0] if parts else ""
+            path, _, query = parts[1].partition("?") if len(parts) > 1 else ("", "", "")
+            if method in ("GET", "HEAD") and path in self.routes:
+                status, content_type, body = self.routes[path](dict(parse_qsl(query)))
+            else:
+                usage = " ou ".join(f"GET {route}" for route in self.routes if route != "/")
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", f"Use {usage}\n".encode("utf-8")
+            head = (
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            )
+            writer.write(head.encode("latin-1") + (body if method != "HEAD" else b""))
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionResetError, BrokenPipeError, OSError):
+            pass
+        except Exception as e:
+            logger.error(f"Erro ao responder requisição do endpoint {self.name}: {e}")
+        finally:
+            writer.close()
+
+class MetricsServer(HttpEndpoint):
+    """Endpoint GET /metrics e medição periódica do atraso do event loop."""
+
+    def __init__(self, host: str, port: int, lag_interval: float = 0.5):
+        super().__init__(host, port, name="métricas")
+        self.lag_interval = lag_interval
+        self.lag_task: Optional[asyncio.Task] = None
+        self.add_route("/", _metrics_route)
+        self.add_route("/metrics", _metrics_route)
+
+    async def start(self):
+        await super().start()
+        self.lag_task = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self):
+        if self.lag_task:
+            self.lag_task.cancel()
+            self.lag_task = None
+        await super().stop()
+
+    async def _measure_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            LOOP_LAG.observe(max(loop.time() - start - self.lag_interval, 0.0))
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Migrações de dados do serviço GPS GV50
+Uso: python migrations.py typed-fields [--batch-size N] [--dry-run]
+     python migrations.py timeseries [--batch-size N] [--dry-run] [--legacy-name NOME]
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+from typing import Optional
+from pymongo import UpdateOne
+from mongodb_client import mongodb_client
+from indexes import collection_info, create_timeseries_collection
+from models import DEVICE_TIME_FORMAT, geo_point
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+def _to_float(value) -> Optional[float]:
+    """Converte o valor texto antigo em float (vazio/inválido vira None)."""
+    if value is None or isinstance(value, float):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_device_time(value) -> Optional[datetime]:
+    """Converte o dataDevice texto (YYYYMMDDhhmmss) em datetime."""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(value, DEVICE_TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+def typed_fields_update(document: dict) -> dict:
+    """Monta o $set/$unset que converte um documento antigo de dados_veiculo para campos tipados."""
+    set_fields = {}
+    unset_fields = {}
+    for field in ('longitude', 'latitude', 'altidude', 'speed'):
+        if field in document:
+            value = _to_float(document[field])
+            if value is None:
+                unset_fields[field] = ""
+            else:
+                set_fields[field] = value
+
+    if 'dataDevice' in document:
+        device_time = _to_device_time(document['dataDevice'])
+        if device_time is None:
+            unset_fields['dataDevice'] = ""
+        else:
+            set_fields['dataDevice'] = device_time
+
+    location = geo_point(set_fields.get('longitude'), set_fields.get('latitude'))
+    if location:
+        set_fields['location'] = location
+
+    update = {}
+    if set_fields:
+        update['$set'] = set_fields
+    if unset_fields:
+        update['$unset'] = unset_fields
+    return update
+
+async def migrate_typed_fields(batch_size: int, dry_run: bool):
+    """Converte em lotes os documentos de dados_veiculo que ainda têm campos em texto."""
+    collection = mongodb_client.database.dados_veiculo
+    query = {"$or": [
+        {"longitude": {"$type": "string"}},
+        {"dataDevice": {"$type": "string"}},
+    ]}
+    projection = {'longitude': 1, 'latitude': 1, 'altidude': 1, 'speed': 1, 'dataDevice': 1}
+
+    total = await collection.count_documents(query)
+    logger.info(f"{total} documentos de dados_veiculo com campos em texto")
+    if dry_run or not total:
+        return
+
+    if mongodb_client.settings.dados_legacy_string_fields:
+        logger.warning("DADOS_LEGACY_STRING_FIELDS está ativo: novos documentos continuarão sendo gravados como texto")
+
+    # Paginação por _id para não depender de um cursor aberto durante as atualizações
+    migrated = 0
+    last_id = None
+    while True:
+        page_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+        cursor = collection.find(page_query, projection).sort("_id", 1).limit(batch_size)
+        documents = await cursor.to_list(length=batch_size)
+        if not documents:
+            break
+
+        operations = []
+        for document in documents:
+            update = typed_fields_update(document)
+            if update:
+                operations.append(UpdateOne({"_id": document['_id']}, update))
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            migrated += result.modified_count
+
+        last_id = documents[-1]['_id']
+        logger.info(f"Migrados {migrated}/{total} documentos")
+
+    logger.info(f"✅ Migração typed-fields concluída: {migrated} documentos convertidos")
+
+def _apply_update(document: dict, update: dict) -> dict:
+    """Aplica em memória o $set/$unset de typed_fields_update."""
+    document.update(update.get('$set', {}))
+    for field in update.get('$unset', {}):
+        document.pop(field, None)
+    return document
+
+async def migrate_timeseries(batch_size: int, dry_run: bool, legacy_name: str):
+    """
+    Converte dados_veiculo em coleção time-series.
+
+    O MongoDB não converte nem renomeia coleções time-series, então a coleção
+    regular é renomeada para legacy_name, dados_veiculo é recriada como
+    time-series e o histórico é copiado em lotes (já com campos tipados).
+    Pare o serviço antes de executar; depois de "Coleção time-series criada"
+    ele pode voltar com DADOS_STORAGE_MODE=timeseries enquanto a cópia continua.
+    O progresso fica em migracoes, então a cópia pode ser retomada; uma
+    interrupção no meio de um lote pode duplicar no máximo esse lote.
+    """
+    database = mongodb_client.database
+    info = await collection_info(database, 'dados_veiculo')
+    legacy = await collection_info(database, legacy_name)
+    is_timeseries = info is not None and info.get('type') == 'timeseries'
+
+    if is_timeseries and legacy is None:
+        logger.info("dados_veiculo já é uma coleção time-series")
+        return
+    if info is not None and not is_timeseries and legacy is not None:
+        logger.error(f"{legacy_name} já existe; remova-a ou use outro --legacy-name")
+        return
+
+    source_name = legacy_name if legacy is not None else 'dados_veiculo'
+    total = await database[source_name].count_documents({})
+    logger.info(f"{total} documentos em {source_name} a copiar para dados_veiculo time-series")
+    if dry_run:
+        return
+
+    if info is not None and not is_timeseries:
+        await database.dados_veiculo.rename(legacy_name)
+        logger.info(f"dados_veiculo renomeada para {legacy_name}")
+        info = None
+    if info is None:
+        await create_timeseries_collection(database, 'dados_veiculo')
+
+    source = database[legacy_name]
+    target = database.dados_veiculo
+    state_id = f"timeseries:{legacy_name}"
+    state = await database.migracoes.find_one({"_id": state_id})
+    last_id = state['last_id'] if state else None
+    copied = state['copied'] if state else 0
+    skipped = 0
+
+    while True:
+        page_query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        cursor = source.find(page_query).sort("_id", 1).limit(batch_size)
+        documents = await cursor.to_list(length=batch_size)
+        if not documents:
+            break
+
+        batch = []
+        for document in documents:
+            # timeField obrigatório: documentos sem data válida não entram na coleção time-series
+            if not isinstance(document.get('data'), datetime) or not document.get('IMEI'):
+                skipped += 1
+                continue
+            batch.append(_apply_update(document, typed_fields_update(document)))
+        if batch:
+            await target.insert_many(batch, ordered=False)
+            copied += len(batch)
+
+        last_id = documents[-1]['_id']
+        await database.migracoes.update_one(
+            {"_id": state_id}, {"$set": {"last_id": last_id, "copied": copied}}, upsert=True
+        )
+        logger.info(f"Copiados {copied}/{total} documentos")
+
+    if skipped:
+        logger.warning(f"{skipped} documentos sem data/IMEI válidos não foram copiados")
+    logger.info(
+        f"✅ Migração timeseries concluída: {copied} documentos copiados; "
+        f"após validar, remova a coleção antiga com db.{legacy_name}.drop()"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description="Migrações de dados do serviço GPS GV50")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    typed = subparsers.add_parser("typed-fields", help="Converte campos texto de dados_veiculo em float/datetime/GeoJSON")
+    typed.add_argument("--batch-size", type=int, default=1000)
+    typed.add_argument("--dry-run", action="store_true", help="Apenas conta os documentos a migrar")
+
+    timeseries = subparsers.add_parser("timeseries", help="Converte dados_veiculo em coleção time-series (data/IMEI)")
+    timeseries.add_argument("--batch-size", type=int, default=1000)
+    timeseries.add_argument("--dry-run", action="store_true", help="Apenas conta os documentos a copiar")
+    timeseries.add_argument("--legacy-name", default="dados_veiculo_regular", help="Nome para a coleção regular antiga")
+
+    args = parser.parse_args()
+
+    await mongodb_client.connect()
+    try:
+        if args.command == "typed-fields":
+            await migrate_typed_fields(args.batch_size, args.dry_run)
+        elif args.command == "timeseries":
+            await migrate_timeseries(args.batch_size, args.dry_run, args.legacy_name)
+    finally:
+        await mongodb_client.disconnect()
+
+if __name__ == "__main__":
+    asyncio.run(main())
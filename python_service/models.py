@@ -2,19 +2,60 @@ from datetime import datetime
 from typing import Optional
 from pydantic import BaseModel, Field
 
+DEVICE_TIME_FORMAT = "%Y%m%d%H%M%S"  # Formato do horário enviado pelo GV50
+COMANDO_ATIVO = ('pendente', 'enviado')  # Status da coleção comandos ainda sem +ACK do dispositivo
+
+def geo_point(longitude: Optional[float], latitude: Optional[float]) -> Optional[dict]:
+    """Monta um GeoJSON Point (indexável com 2dsphere); None se a coordenada for inválida."""
+    if longitude is None or latitude is None:
+        return None
+    if not (-180.0 <= longitude <= 180.0 and -90.0 <= latitude <= 90.0):
+        return None
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
 class DadosVeiculo(BaseModel):
-    """Dados de rastreamento do veículo - igual ao C#."""
+    """Dados de rastreamento do veículo - igual ao C#, com campos numéricos tipados."""
     _id: Optional[str] = None
     IMEI: str
-    longitude: str
-    latitude: str
-    altidude: str  # mantendo mesmo nome que no C#
-    speed: str
+    longitude: Optional[float] = None
+    latitude: Optional[float] = None
+    altidude: Optional[float] = None  # mantendo mesmo nome que no C#
+    speed: Optional[float] = None
     ignicao: Optional[bool] = None
     data: Optional[datetime] = None
-    dataDevice: str
+    dataDevice: Optional[datetime] = None  # Horário GPS do dispositivo (UTC)
+    location: Optional[dict] = None  # GeoJSON Point para consultas geográficas
     mensagem_raw: Optional[str] = None  # Mensagem original completa recebida do GPS
 
+def dados_from_message(parsed) -> DadosVeiculo:
+    """Documento de dados_veiculo de um relatório (GV50Message) - caminho por frame da ingestão."""
+    return DadosVeiculo(
+        IMEI=parsed.imei,
+        longitude=parsed.longitude,
+        latitude=parsed.latitude,
+        altidude=parsed.altitude,
+        speed=parsed.speed,
+        ignicao=parsed.ignition,
+        dataDevice=parsed.device_time,
+        location=geo_point(parsed.longitude, parsed.latitude),
+        data=datetime.utcnow(),  # Momento do recebimento, não da gravação do lote
+        mensagem_raw=parsed.raw_message  # Mensagem completa original
+    )
+
+def legacy_number(value: Optional[float]) -> str:
+    """Formata número no formato texto antigo de dados_veiculo ('0' quando ausente)."""
+    if value is None:
+        return '0'
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def to_legacy_fields(document: dict) -> dict:
+    """Converte os campos tipados de dados_veiculo para o formato texto usado pelos consumidores antigos."""
+    for field in ('longitude', 'latitude', 'altidude', 'speed'):
+        document[field] = legacy_number(document.get(field))
+    device_time = document.get('dataDevice')
+    document['dataDevice'] = device_time.strftime(DEVICE_TIME_FORMAT) if device_time else ''
+    return document
+
 class Veiculo(BaseModel):
     """Informações do veículo - simplificado para clean code."""
     _id: Optional[str] = None
@@ -25,6 +66,7 @@ class Veiculo(BaseModel):
     bloqueado: Optional[bool] = False  # Status atual de bloqueio
     comandoTrocarIP: Optional[bool] = None  # True = comando para trocar IP pendente
     ignicao: bool = False  # Status da ignição
+    dataDevice: Optional[datetime] = None  # Horário do dispositivo do relatório que definiu o estado atual
     # Campos para monitoramento de bateria
     bateria_voltagem: Optional[float] = None  # Voltagem atual da bateria
     bateria_baixa: Optional[bool] = False  # True se bateria estiver baixa
@@ -5,9 +5,13 @@ Cliente MongoDB simplificado para apenas 2 tabelas: DadosVeiculo e Veiculo
 
 import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from datetime import datetime
-from typing import Optional, List
-from models import DadosVeiculo, Veiculo
+from typing import Dict, Optional, List
+from models import COMANDO_ATIVO, DadosVeiculo, Veiculo, to_legacy_fields
+from indexes import collection_info, ensure_indexes
+from raw_storage import ARCHIVE_COLLECTION, raw_storage
 from config import get_settings
 from logger import get_logger
 
@@ -16,10 +20,14 @@ logger = get_logger(__name__)
 class MongoDBClient:
     """Cliente MongoDB para gerenciar apenas DadosVeiculo e Veiculo."""
     
+    @property
+    def settings(self):
+        return get_settings()
+    
     def __init__(self):
         self.client: Optional[AsyncIOMotorClient] = None
         self.database = None
-        self.settings = get_settings()
+        self.dados_timeseries = False  # dados_veiculo time-series: _id não é único
         
     async def connect(self):
         """Conecta ao MongoDB."""
@@ -31,6 +39,17 @@ class MongoDBClient:
             await self.client.admin.command('ping')
             logger.info(f"Conectado ao MongoDB: {self.settings.mongodb_database}")
             
+            # Garantir modo de armazenamento de dados_veiculo e índices (idempotente)
+            try:
+                await ensure_indexes(self.database)
+            except Exception as e:
+                logger.error(f"Erro ao verificar índices: {e}")
+            try:
+                info = await collection_info(self.database, 'dados_veiculo')
+                self.dados_timeseries = info is not None and info.get('type') == 'timeseries'
+            except Exception as e:
+                logger.error(f"Erro ao verificar o tipo de dados_veiculo: {e}")
+            
         except Exception as e:
             logger.error(f"Erro ao conectar MongoDB: {e}")
             raise
@@ -41,12 +60,20 @@ class MongoDBClient:
             self.client.close()
             logger.info("Desconectado do MongoDB")
             
+    def dados_to_document(self, dados: DadosVeiculo) -> dict:
+        """Converte DadosVeiculo no documento gravado em dados_veiculo."""
+        dados_dict = dados.model_dump(exclude={'_id'}, exclude_none=True)
+        if not dados_dict.get('data'):
+            dados_dict['data'] = datetime.utcnow()
+        if self.settings.dados_legacy_string_fields:
+            to_legacy_fields(dados_dict)
+        return dados_dict
+            
     async def insert_dados_veiculo(self, dados: DadosVeiculo) -> str:
         """Insere dados GPS do veículo."""
         try:
             collection = self.database.dados_veiculo
-            dados_dict = dados.model_dump(exclude={'_id'})
-            dados_dict['data'] = datetime.utcnow()
+            dados_dict = self.dados_to_document(dados)
             
             # Debug log para verificar mensagem_raw
             logger.debug(f"Inserindo dados: IMEI={dados.IMEI}, mensagem_raw='{dados_dict.get('mensagem_raw', 'MISSING')}'")
@@ -59,6 +86,72 @@ class MongoDBClient:
             logger.error(f"Erro ao inserir dados do veículo: {e}")
             raise
             
+    async def insert_dados_veiculo_batch(self, documents: List[dict]) -> int:
+        """Insere um lote em dados_veiculo sem ordem garantida (mensagem_raw conforme RAW_STORAGE_MODE)."""
+        documents, archived = await raw_storage.prepare_batch(self.database, documents)
+        inserted = await self._insert_unordered(self.database.dados_veiculo, documents)
+        if archived:
+            await self._insert_unordered(self.database[ARCHIVE_COLLECTION], archived)
+        return inserted
+    
+    async def insert_dados_veiculo_retry(self, documents: List[dict]) -> int:
+        """
+        Regrava um lote que pode já ter sido gravado (replay do spool, retentativa após timeout).
+        Em coleção regular o _id repetido é recusado pelo índice único. Time-series não tem
+        índice único em _id, então antes os _id já presentes são buscados no intervalo de `data`
+        do lote (consulta que usa os buckets por IMEI e horário) e ficam de fora. Um insert
+        anterior que ainda esteja rodando no servidor não aparece nessa busca e pode duplicar.
+        O arquivo (dados_veiculo_raw) é sempre regravado ignorando _id repetido: a tentativa
+        anterior pode ter gravado o documento quente e falhado no arquivo.
+        """
+        documents, archived = await raw_storage.prepare_batch(self.database, documents)
+        if self.dados_timeseries:
+            documents = await self._without_existing_dados(documents)
+        inserted = await self._insert_unordered(self.database.dados_veiculo, documents, ignore_duplicates=True)
+        if archived:
+            await self._insert_unordered(self.database[ARCHIVE_COLLECTION], archived, ignore_duplicates=True)
+        return inserted
+    
+    async def _without_existing_dados(self, documents: List[dict]) -> List[dict]:
+        """Documentos do lote cujo _id ainda não está em dados_veiculo (time-series)."""
+        ids = [document['_id'] for document in documents if '_id' in document]
+        times = [document['data'] for document in documents if document.get('data')]
+        if not ids or not times:
+            return documents
+        query = {
+            'IMEI': {'$in': list({document['IMEI'] for document in documents})},
+            'data': {'$gte': min(times), '$lte': max(times)},
+            '_id': {'$in': ids},
+        }
+        existing = {document['_id'] async for document in self.database.dados_veiculo.find(query, {'_id': 1})}
+        if not existing:
+            return documents
+        logger.info(f"{len(existing)} documentos do lote já estavam em dados_veiculo (time-series)")
+        return [document for document in documents if document.get('_id') not in existing]
+    
+    async def _insert_unordered(self, collection, documents: List[dict], ignore_duplicates: bool = False) -> int:
+        if not documents:
+            return 0
+        try:
+            result = await collection.insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Com ordered=False os documentos válidos são gravados mesmo com erros em outros
+            inserted = e.details.get('nInserted', 0)
+            errors = e.details.get('writeErrors', [])
+            if ignore_duplicates:
+                errors = [error for error in errors if error.get('code') != 11000]
+            if errors:
+                logger.error(
+                    f"Lote {collection.name} com {len(errors)} erros "
+                    f"({inserted}/{len(documents)} inseridos)"
+                )
+            return inserted
+    
+    async def get_mensagem_raw(self, document: dict) -> Optional[str]:
+        """Frame original de um documento de dados_veiculo (inline, comprimido ou arquivado)."""
+        return await raw_storage.mensagem_raw(self.database, document)
+            
     async def get_veiculo_by_imei(self, imei: str) -> Optional[Veiculo]:
         """Busca veículo por IMEI."""
         try:
@@ -94,6 +187,91 @@ class MongoDBClient:
             logger.error(f"Erro ao atualizar veículo {veiculo.IMEI}: {e}")
             return False
             
+    async def get_veiculos_by_imeis(self, imeis: List[str], projection: Optional[dict] = None) -> List[dict]:
+        """Busca vários veículos de uma vez (documentos crus, sem validação)."""
+        collection = self.database.veiculo
+        cursor = collection.find({"IMEI": {"$in": imeis}}, projection)
+        return await cursor.to_list(length=None)
+            
+    async def update_veiculos_fields(self, updates: Dict[str, dict]) -> bool:
+        """Aplica $set apenas dos campos alterados de vários veículos num único bulk_write."""
+        if not updates:
+            return True
+        try:
+            collection = self.database.veiculo
+            now = datetime.utcnow()
+            operations = [
+                UpdateOne({"IMEI": imei}, {"$set": {**fields, "ts_user_manu": now}}, upsert=True)
+                for imei, fields in updates.items()
+            ]
+            await collection.bulk_write(operations, ordered=False)
+            logger.debug(f"{len(operations)} veículos atualizados em lote")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Erro ao atualizar lote de {len(updates)} veículos: {e}")
+            return False
+            
+    async def update_posicoes_atuais(self, positions: Dict[str, dict]) -> bool:
+        """
+        Grava a última posição de vários IMEIs num único bulk_write (posicao_atual, _id = IMEI),
+        só onde dataDevice é mais novo que o gravado. Se o gravado for mais novo o filtro não
+        casa e o upsert tenta inserir o mesmo _id: a chave duplicada é esperada e ignorada.
+        """
+        if not positions:
+            return True
+        operations = [
+            UpdateOne(
+                # $not/$gte também casa documento sem dataDevice
+                {"_id": imei, "dataDevice": {"$not": {"$gte": position["dataDevice"]}}},
+                {"$set": position},
+                upsert=True
+            )
+            for imei, position in positions.items()
+        ]
+        try:
+            await self.database.posicao_atual.bulk_write(operations, ordered=False)
+            return True
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != 11000]
+            if not errors:
+                return True
+            logger.error(f"Erro ao gravar {len(errors)} de {len(positions)} posições atuais: {errors[0].get('errmsg')}")
+            return False
+        except Exception as e:
+            logger.error(f"Erro ao gravar lote de {len(positions)} posições atuais: {e}")
+            return False
+
+    async def insert_viagens(self, documents: List[dict]) -> bool:
+        """Grava viagens fechadas; _id repetido (lote regravado após falha) não é erro."""
+        try:
+            await self.database.viagens.insert_many(documents, ordered=False)
+            return True
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != 11000]
+            if not errors:
+                return True
+            logger.error(f"Erro ao gravar {len(errors)} de {len(documents)} viagens: {errors[0].get('errmsg')}")
+            return False
+        except Exception as e:
+            logger.error(f"Erro ao gravar lote de {len(documents)} viagens: {e}")
+            return False
+
+    async def get_posicoes_atuais(self, imeis: Optional[List[str]] = None) -> List[dict]:
+        """Última posição de cada IMEI (todos, ou só os informados) lida de posicao_atual pelo _id."""
+        query = {"_id": {"$in": imeis}} if imeis is not None else {}
+        cursor = self.database.posicao_atual.find(query)
+        return await cursor.to_list(length=None)
+            
+    def watch_comandos_veiculo(self, resume_after: Optional[dict] = None):
+        """Change stream de alterações nos campos de comando da coleção veiculo."""
+        pipeline = [{"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "replace"]}},
+            {"updateDescription.updatedFields.comandoBloqueo": {"$exists": True}},
+            {"updateDescription.updatedFields.comandoTrocarIP": {"$exists": True}},
+        ]}}]
+        return self.database.veiculo.watch(pipeline, full_document="updateLookup", resume_after=resume_after)
+            
     async def set_comando_bloqueio(self, imei: str, bloquear: bool) -> bool:
         """Define comando de bloqueio/desbloqueio para o veículo."""
         try:
@@ -141,13 +319,17 @@ class MongoDBClient:
             logger.error(f"Erro ao definir comando trocar IP para {imei}: {e}")
             return False
             
-    async def clear_comando_bloqueio(self, imei: str) -> bool:
-        """Limpa comando de bloqueio após envio."""
+    async def clear_comando_bloqueio(self, imei: str, comando: Optional[bool] = None) -> bool:
+        """Limpa comando de bloqueio após envio (só se ainda for o comando enviado, quando informado)."""
         try:
             collection = self.database.veiculo
             
+            query = {"IMEI": imei}
+            if comando is not None:
+                query["comandoBloqueo"] = comando
+            
             result = await collection.update_one(
-                {"IMEI": imei},
+                query,
                 {"$set": {
                     "comandoBloqueo": None,
                     "ts_user_manu": datetime.utcnow()
@@ -180,6 +362,64 @@ class MongoDBClient:
         except Exception as e:
             logger.error(f"Erro ao limpar comando trocar IP para {imei}: {e}")
             return False
+    
+    async def claim_comando_veiculo(self, imei: str, field: str):
+        """
+        Consome atomicamente o pedido de comando do veículo (comandoBloqueo ou comandoTrocarIP):
+        retorna o valor pedido e limpa o campo, ou None se outro fluxo (poll, change stream,
+        outro worker) já o consumiu.
+        """
+        pending = {"comandoBloqueo": {"$type": "bool"}, "comandoTrocarIP": True}[field]
+        document = await self.database.veiculo.find_one_and_update(
+            {"IMEI": imei, field: pending},
+            {"$set": {field: None, "ts_user_manu": datetime.utcnow()}},
+            projection={field: 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        return document.get(field) if document else None
+    
+    async def restore_comando_veiculo(self, imei: str, field: str, value):
+        """Devolve um pedido consumido que não chegou à fila de comandos (se o operador não pediu outro)."""
+        await self.database.veiculo.update_one({"IMEI": imei, field: None}, {"$set": {field: value}})
+    
+    async def insert_comando(self, document: dict):
+        """Grava um comando na fila de saída (coleção comandos) e preenche o _id."""
+        result = await self.database.comandos.insert_one(document)
+        document['_id'] = result.inserted_id
+        
+    async def get_comandos_ativos(self, imei: str) -> List[dict]:
+        """Comandos do veículo ainda sem confirmação do dispositivo, do mais antigo ao mais novo."""
+        cursor = self.database.comandos.find(
+            {"IMEI": imei, "status": {"$in": list(COMANDO_ATIVO)}}
+        ).sort("criado_em", ASCENDING)
+        return await cursor.to_list(length=None)
+        
+    async def cancel_comandos(self, imei: str, comando: str) -> int:
+        """Cancela comandos ativos do mesmo tipo (um novo GTOUT substitui o anterior)."""
+        result = await self.database.comandos.update_many(
+            {"IMEI": imei, "comando": comando, "status": {"$in": list(COMANDO_ATIVO)}},
+            {"$set": {"status": "cancelado", "atualizado_em": datetime.utcnow()}}
+        )
+        return result.modified_count
+        
+    async def claim_comando_envio(self, comando_id, tentativas: int, fields: dict) -> Optional[dict]:
+        """
+        Registra uma tentativa de envio só se o comando continua ativo e ninguém o
+        reenviou desde a leitura (outro worker); retorna o documento atualizado ou None.
+        """
+        return await self.database.comandos.find_one_and_update(
+            {"_id": comando_id, "status": {"$in": list(COMANDO_ATIVO)}, "tentativas": tentativas},
+            {"$set": fields, "$inc": {"tentativas": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        
+    async def finish_comando(self, comando_id, status: str, fields: Optional[dict] = None) -> bool:
+        """Encerra um comando ativo (confirmado/falhou); False se já estava encerrado."""
+        result = await self.database.comandos.update_one(
+            {"_id": comando_id, "status": {"$in": list(COMANDO_ATIVO)}},
+            {"$set": {"status": status, "atualizado_em": datetime.utcnow(), **(fields or {})}}
+        )
+        return result.modified_count > 0
             
     async def get_veiculos_com_comando_pendente(self) -> List[Veiculo]:
         """Busca veículos com comandos pendentes (bloqueio ou trocar IP)."""
@@ -187,17 +427,17 @@ class MongoDBClient:
             collection = self.database.veiculo
             cursor = collection.find({
                 "$or": [
-                    {"comandoBloqueo": {"$ne": None}},
-                    {"comandoTrocarIP": {"$ne": None}}
+                    {"comandoBloqueo": {"$type": "bool"}},
+                    {"comandoTrocarIP": True}
                 ]
-            })
+            }, batch_size=1000)
             
             veiculos = []
             async for doc in cursor:
                 doc['_id'] = str(doc['_id'])
                 veiculos.append(Veiculo(**doc))
                 
-            logger.info(f"Encontrados {len(veiculos)} veículos com comandos pendentes")
+            logger.debug(f"Encontrados {len(veiculos)} veículos com comandos pendentes")
             return veiculos
             
         except Exception as e:
@@ -1,143 +1,149 @@
 #!/usr/bin/env python3
 """
 Monitor em tempo real para conexões GPS
-Mostra logs de dispositivos conectando em tempo real
+Assina os eventos publicados pelo servidor no socket Unix (EVENTS_SOCKET) em vez de ler o log
+
+Uso: python monitor_real_time.py [--imei IMEI ...] [--event frame --event save ...] [--socket caminho]
 """
 
+import argparse
 import asyncio
-import subprocess
-import time
+import glob
+import json
+import os
 from datetime import datetime
+from typing import List, Optional
+from config import get_settings
+from event_types import EVENT_TYPES
 
 class RealTimeMonitor:
-    def __init__(self):
-        self.log_file = "logs/gps_service.log"
-        self.last_position = 0
-        
-    def get_timestamp(self):
-        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
+    def __init__(self, sockets: List[str], imeis: Optional[List[str]] = None, events: Optional[List[str]] = None):
+        self.sockets = sockets
+        self.filters = {'imei': imeis or None, 'events': events or None}
+
+    def get_timestamp(self, ts: Optional[float] = None):
+        moment = datetime.fromtimestamp(ts) if ts else datetime.now()
+        return moment.strftime("%Y-%m-%d %H:%M:%S")
+
     async def monitor_connections(self):
-        """Monitora conexões em tempo real"""
+        """Monitora conexões em tempo real (um assinante por socket de worker)"""
         print(f"🔍 [{self.get_timestamp()}] Iniciando monitor de conexões GPS...")
+        if self.filters['imei'] or self.filters['events']:
+            print(f"   Filtros: IMEI={self.filters['imei'] or 'todos'}, eventos={self.filters['events'] or 'todos'}")
         print("=" * 60)
-        
-        try:
-            # Obtém posição atual do arquivo de log
-            with open(self.log_file, 'r') as f:
-                f.seek(0, 2)  # Vai para o final do arquivo
-                self.last_position = f.tell()
-                
-            while True:
-                await self.check_new_logs()
-                await asyncio.sleep(1)  # Verifica a cada segundo
-                
-        except KeyboardInterrupt:
-            print(f"\n🛑 [{self.get_timestamp()}] Monitor interrompido pelo usuário")
-        except Exception as e:
-            print(f"❌ [{self.get_timestamp()}] Erro no monitor: {e}")
-    
-    async def check_new_logs(self):
-        """Verifica se há novos logs"""
-        try:
-            with open(self.log_file, 'r') as f:
-                f.seek(self.last_position)
-                new_lines = f.readlines()
-                self.last_position = f.tell()
-                
-                for line in new_lines:
-                    self.process_log_line(line.strip())
-                    
-        except FileNotFoundError:
-            pass  # Log file não existe ainda
-    
-    def process_log_line(self, line):
-        """Processa cada linha de log relevante"""
-        if not line:
-            return
-            
-        # Conexões
-        if "Nova conexão GPS" in line:
-            print(f"🔌 [{self.get_timestamp()}] {line}")
-            
-        # Mensagens recebidas
-        elif "Recebido de" in line and "RESP:" in line:
-            # Extrai apenas o tipo de mensagem
-            if "GTFRI" in line:
-                print(f"📍 [{self.get_timestamp()}] GPS Data recebido (GTFRI)")
-            elif "GTIGN" in line:
-                print(f"🔑 [{self.get_timestamp()}] Ignição LIGADA (GTIGN)")
-            elif "GTIGF" in line:
-                print(f"🔒 [{self.get_timestamp()}] Ignição DESLIGADA (GTIGF)")
-            elif "BUFF:" in line:
-                print(f"📦 [{self.get_timestamp()}] Mensagem BUFF recebida")
-            else:
-                print(f"📨 [{self.get_timestamp()}] Mensagem GPS recebida")
-                
-        # Dados salvos
-        elif "Dados inseridos para IMEI" in line:
-            # Extrai IMEI da linha
-            imei_start = line.find("IMEI ") + 5
-            imei_end = line.find(":", imei_start)
-            imei = line[imei_start:imei_end] if imei_end > imei_start else "Unknown"
-            print(f"💾 [{self.get_timestamp()}] Dados salvos no MongoDB - IMEI: {imei}")
-            
-        # Comandos enviados
-        elif "Enviando comando" in line:
-            if "DESBLOQUEIO" in line:
-                print(f"🔓 [{self.get_timestamp()}] Comando DESBLOQUEIO enviado")
-            elif "BLOQUEIO" in line:
-                print(f"🔒 [{self.get_timestamp()}] Comando BLOQUEIO enviado")
-            elif "IP" in line:
-                print(f"🌐 [{self.get_timestamp()}] Comando troca de IP enviado")
-                
-        # Erros importantes
-        elif "ERROR" in line or "Erro" in line:
-            print(f"❌ [{self.get_timestamp()}] ERRO: {line}")
-            
-        # Desconexões
-        elif "desconectou" in line or "Connection reset" in line:
-            print(f"📴 [{self.get_timestamp()}] Dispositivo desconectado")
-
-    def show_current_status(self):
-        """Mostra status atual do sistema"""
-        print("📊 STATUS DO SISTEMA GPS GV50")
-        print("=" * 40)
-        
-        # Verifica se servidor está rodando
-        try:
-            result = subprocess.run(['pgrep', '-f', 'main.py'], 
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                print("✅ Servidor TCP: RODANDO")
+        await asyncio.gather(*(self.subscribe(path) for path in self.sockets))
+
+    async def subscribe(self, path: str):
+        """Assina os eventos de um socket, reconectando quando o servidor reinicia"""
+        announced = False
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not announced:
+                    print(f"⏳ [{self.get_timestamp()}] Aguardando servidor em {path}")
+                    announced = True
+                await asyncio.sleep(2)
+                continue
+
+            announced = False
+            writer.write((json.dumps(self.filters) + "\n").encode('utf-8'))
+            await writer.drain()
+            try:
+                async for line in reader:
+                    self.process_event(json.loads(line))
+            except (ConnectionResetError, json.JSONDecodeError) as e:
+                print(f"❌ [{self.get_timestamp()}] Erro no stream de {path}: {e}")
+            finally:
+                writer.close()
+            print(f"📴 [{self.get_timestamp()}] Servidor encerrou o stream de {path}")
+            await asyncio.sleep(2)
+
+    def process_event(self, event: dict):
+        """Exibe cada evento recebido do servidor"""
+        kind = event.get('event')
+        timestamp = self.get_timestamp(event.get('ts'))
+        imei = event.get('imei') or '-'
+
+        if kind == 'status':
+            print(f"✅ [{timestamp}] Servidor TCP: RODANDO (worker {event.get('worker') or 'único'}, "
+                  f"{event.get('connections')} conexões, {event.get('devices')} dispositivos, "
+                  f"uptime {event.get('uptime')}s)")
+
+        elif kind == 'connect':
+            print(f"🔌 [{timestamp}] Nova conexão de {event.get('ip')}")
+
+        elif kind == 'frame':
+            command_type = event.get('command_type')
+            if event.get('message_type') == '+BUFF':
+                print(f"📦 [{timestamp}] Mensagem BUFF recebida ({command_type}) - IMEI: {imei}")
+            elif command_type == 'GTFRI':
+                print(f"📍 [{timestamp}] GPS Data recebido (GTFRI) - IMEI: {imei}")
+            elif command_type == 'GTIGN':
+                print(f"🔑 [{timestamp}] Ignição LIGADA (GTIGN) - IMEI: {imei}")
+            elif command_type == 'GTIGF':
+                print(f"🔒 [{timestamp}] Ignição DESLIGADA (GTIGF) - IMEI: {imei}")
             else:
-                print("❌ Servidor TCP: PARADO")
-        except:
-            print("❓ Servidor TCP: Status desconhecido")
-            
-        # Últimos logs
-        try:
-            with open(self.log_file, 'r') as f:
-                lines = f.readlines()
-                if lines:
-                    last_log = lines[-1].strip()
-                    print(f"🕐 Último log: {last_log}")
-                else:
-                    print("📄 Nenhum log encontrado")
-        except:
-            print("📄 Arquivo de log não encontrado")
-            
-        print("=" * 40)
+                print(f"📨 [{timestamp}] Mensagem {event.get('message_type')}:{command_type} - IMEI: {imei}")
+
+        elif kind == 'parse_error':
+            print(f"❌ [{timestamp}] Frame inválido de {event.get('ip')}: {event.get('message')}")
+
+        elif kind == 'save':
+            battery = event.get('battery_voltage')
+            detail = f", bateria {battery}V" if battery is not None else ""
+            print(f"💾 [{timestamp}] Dados salvos no MongoDB - IMEI: {imei} "
+                  f"({event.get('latitude')}, {event.get('longitude')}, {event.get('speed')} km/h{detail})")
+
+        elif kind == 'command':
+            command = event.get('command')
+            status = event.get('status', 'enviado')
+            serial = f" serial {event['serial']}" if event.get('serial') else ""
+            if status == 'confirmado':
+                print(f"✅ [{timestamp}] Comando {command.upper()} confirmado pelo dispositivo{serial} - IMEI: {imei}")
+            elif status == 'falhou':
+                print(f"❌ [{timestamp}] Comando {command.upper()} sem confirmação{serial} - IMEI: {imei}")
+            elif command == 'desbloqueio':
+                print(f"🔓 [{timestamp}] Comando DESBLOQUEIO enviado (tentativa {event.get('attempt', 1)}{serial}) - IMEI: {imei}")
+            elif command == 'bloqueio':
+                print(f"🔒 [{timestamp}] Comando BLOQUEIO enviado (tentativa {event.get('attempt', 1)}{serial}) - IMEI: {imei}")
+            elif command == 'trocar_ip':
+                print(f"🌐 [{timestamp}] Comando troca de IP enviado (tentativa {event.get('attempt', 1)}{serial}) - IMEI: {imei}")
+
+        elif kind == 'trip':
+            reasons = {'ignicao_desligada': 'ignição desligada', 'inatividade': 'inatividade', 'encerramento': 'serviço encerrado'}
+            print(f"🚗 [{timestamp}] Viagem fechada ({reasons.get(event.get('reason'), event.get('reason'))}) - IMEI: {imei} "
+                  f"({event.get('start')} a {event.get('end')}, {(event.get('distance') or 0) / 1000:.1f} km, "
+                  f"máx {event.get('max_speed')} km/h)")
+
+        elif kind == 'disconnect':
+            print(f"📴 [{timestamp}] Dispositivo desconectado - IMEI: {imei} ({event.get('ip')}, {event.get('duration')}s)")
+
+        elif kind == 'error':
+            print(f"❌ [{timestamp}] Assinatura recusada pelo servidor: {event.get('error')}")
+
+def default_sockets() -> List[str]:
+    """Socket do processo único ou de cada worker (gps_events.workerN.sock)"""
+    path = get_settings().events_socket
+    root, ext = os.path.splitext(path)
+    worker_sockets = sorted(glob.glob(f"{root}.worker*{ext}"))
+    return worker_sockets or [path]
 
 async def main():
-    monitor = RealTimeMonitor()
-    
-    # Mostra status inicial
-    monitor.show_current_status()
-    print()
-    
-    # Inicia monitoramento
-    await monitor.monitor_connections()
+    parser = argparse.ArgumentParser(description="Monitor em tempo real de dispositivos GV50")
+    parser.add_argument("--imei", action="append", help="Mostrar apenas este IMEI (pode repetir)")
+    parser.add_argument("--event", action="append", choices=EVENT_TYPES, help="Mostrar apenas este tipo de evento (pode repetir)")
+    parser.add_argument("--socket", action="append", help="Socket de eventos (padrão: EVENTS_SOCKET e sockets dos workers)")
+    args = parser.parse_args()
+
+    monitor = RealTimeMonitor(args.socket or default_sockets(), imeis=args.imei, events=args.event)
+    try:
+        await monitor.monitor_connections()
+    except asyncio.CancelledError:
+        pass
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n🛑 Monitor interrompido pelo usuário")
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Última posição conhecida de cada IMEI (coleção posicao_atual, _id = IMEI)
+O mapa em memória responde na hora às consultas deste processo (GET /posicoes,
+POSICOES_PORT) e os relatórios mais novos são gravados com $set condicional
+em lote: um documento só é alterado se o horário do dispositivo for posterior ao
+gravado, então backlog +BUFF atrasado ou outro worker nunca fazem a posição voltar.
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from protocol_parser import GV50Message
+from models import geo_point
+from mongodb_client import mongodb_client
+from metrics import Counter, Histogram, BATCH_BUCKETS
+from config import get_settings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+POSICAO_UPDATES = Counter("gv50_posicao_updates_total", "Relatórios que mudaram a última posição conhecida")
+POSICAO_STALE = Counter("gv50_posicao_stale_total", "Relatórios ignorados por serem anteriores à última posição")
+POSICAO_WRITE_BATCH = Histogram("gv50_posicao_write_batch_size", "IMEIs por bulk_write em posicao_atual",
+                                buckets=BATCH_BUCKETS)
+
+class PosicaoAtualCache:
+    """IMEI -> documento de posicao_atual, com gravação coalescida dos que mudaram."""
+
+    @property
+    def settings(self):
+        return get_settings()
+
+    def __init__(self):
+        self._positions: Dict[str, dict] = {}
+        self._dirty: Dict[str, dict] = {}  # IMEI -> posição ainda não gravada
+        self.flush_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    async def start(self):
+        self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+
+    def get(self, imei: str) -> Optional[dict]:
+        """Última posição recebida por este processo (None se o IMEI não reportou aqui)."""
+        return self._positions.get(imei)
+
+    def update(self, parsed: GV50Message) -> bool:
+        """
+        Aplica o relatório se for mais novo que a posição atual. Relatórios sem horário
+        do dispositivo ou sem coordenada válida não entram (não dá para ordenar/plotar).
+        """
+        location = geo_point(parsed.longitude, parsed.latitude)
+        if parsed.device_time is None or location is None:
+            return False
+        imei = parsed.imei
+        current = self._positions.get(imei)
+        if current is not None and parsed.device_time <= current['dataDevice']:
+            POSICAO_STALE.inc()
+            return False
+        position = {
+            'IMEI': imei,
+            'location': location,
+            'longitude': parsed.longitude,
+            'latitude': parsed.latitude,
+            'altidude': parsed.altitude,  # Mesmo nome de dados_veiculo
+            'speed': parsed.speed,
+            'ignicao': parsed.ignition,
+            'tipo': parsed.command_type,  # GTFRI, GTIGN, ...
+            'dataDevice': parsed.device_time,
+            'data': datetime.utcnow(),
+        }
+        self._positions[imei] = position
+        self._dirty[imei] = position
+        POSICAO_UPDATES.inc()
+        return True
+
+    async def flush(self):
+        """Grava de uma vez as posições alteradas desde o último flush."""
+        if not self._dirty:
+            return
+        updates, self._dirty = self._dirty, {}
+        if await mongodb_client.update_posicoes_atuais(updates):
+            POSICAO_WRITE_BATCH.observe(len(updates))
+        else:
+            # Devolver para a próxima tentativa, sem passar por cima de uma posição mais nova
+            for imei, position in updates.items():
+                newer = self._dirty.get(imei)
+                if newer is None or newer['dataDevice'] < position['dataDevice']:
+                    self._dirty[imei] = position
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.settings.posicao_flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Erro ao gravar posições atuais: {e}")
+
+    def http_response(self, query: Dict[str, str]) -> Tuple[str, str, bytes]:
+        """
+        GET /posicoes: todas as posições deste processo; ?imei=... para uma só;
+        ?desde=<epoch> só as recebidas depois desse instante (polling incremental).
+        """
+        if 'imei' in query:
+            position = self._positions.get(query['imei'])
+            if position is None:
+                return "404 Not Found", "application/json", b'{"erro": "IMEI sem posicao neste processo"}\n'
+            body = position
+        else:
+            positions = self._positions.values()
+            if 'desde' in query:
+                try:
+                    since = datetime.utcfromtimestamp(float(query['desde']))
+                except (ValueError, OverflowError, OSError):
+                    return "400 Bad Request", "application/json", b'{"erro": "desde deve ser epoch em segundos"}\n'
+                positions = [position for position in positions if position['data'] > since]
+            body = {'gerado_em': time.time(), 'posicoes': list(positions)}
+        return "200 OK", "application/json", (json.dumps(body, default=str) + "\n").encode("utf-8")
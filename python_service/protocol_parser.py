@@ -3,127 +3,177 @@
 Parser simples para protocolo GPS GV50
 """
 
-import re
-from typing import Dict, Optional
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from logger import get_logger
 
 logger = get_logger(__name__)
 
-def parse_gv50_message(raw_message: str) -> Optional[Dict]:
+class GV50Message:
+    """Mensagem GV50 analisada - registro compacto com __slots__ em vez de dict."""
+
+    __slots__ = (
+        'message_type', 'command_type', 'imei', 'number', 'raw_message',
+        'longitude', 'latitude', 'altitude', 'speed', 'device_time',
+        'ignition', 'ignition_event', 'battery_voltage', 'battery_low', 'serial',
+    )
+
+    def __init__(self, message_type: str, command_type: str, imei: str, number: str, raw_message: str):
+        self.message_type = message_type  # +RESP, +BUFF ou +ACK
+        self.command_type = command_type  # GTFRI, GTIGN, ...
+        self.imei = imei
+        self.number = number  # Contador da mensagem (último campo), usado no +SACK
+        self.raw_message = raw_message  # Frame original completo (mensagem_raw)
+        self.longitude: Optional[float] = None
+        self.latitude: Optional[float] = None
+        self.altitude: Optional[float] = None
+        self.speed: Optional[float] = None
+        self.device_time: Optional[datetime] = None  # Horário GPS do dispositivo (UTC)
+        self.ignition = False
+        self.ignition_event = False
+        self.battery_voltage: Optional[float] = None
+        self.battery_low = False
+        self.serial: Optional[str] = None  # Serial do comando confirmado (+ACK)
+
+    def __repr__(self) -> str:
+        return f"GV50Message({self.message_type}:{self.command_type}, imei={self.imei}, number={self.number})"
+
+def parse_float(value: str) -> Optional[float]:
+    """Converte campo numérico do GV50; campo vazio (sem fix GPS) vira None."""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def parse_device_time(value: str) -> Optional[datetime]:
+    """Converte o horário YYYYMMDDhhmmss do GV50 em datetime (mais rápido que strptime)."""
+    if len(value) != 14 or not value.isdigit():
+        return None
+    try:
+        return datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                        int(value[8:10]), int(value[10:12]), int(value[12:14]))
+    except ValueError:
+        return None
+
+def _extract_fri(message: GV50Message, parts: List[str]):
+    """GTFRI - Mensagem de dados GPS fixos."""
+    if len(parts) >= 14:
+        message.longitude = parse_float(parts[11])
+        message.latitude = parse_float(parts[12])
+        message.device_time = parse_device_time(parts[13])
+        message.speed = parse_float(parts[8])
+        message.altitude = parse_float(parts[10])
+        message.ignition = parts[6] == '1'
+
+def _extract_ignition(message: GV50Message, parts: List[str]):
+    """GTIGN/GTIGF - Eventos de ignição (ON/OFF)."""
+    ignition_state = message.command_type == 'GTIGN'  # True se ligada, False se desligada
+
+    if len(parts) >= 13:
+        message.ignition = ignition_state
+        message.ignition_event = True  # Marca como evento de ignição
+        message.longitude = parse_float(parts[10])
+        message.latitude = parse_float(parts[11])
+        message.device_time = parse_device_time(parts[12])
+        message.speed = 0.0  # Eventos de ignição geralmente são com veículo parado
+        message.altitude = parse_float(parts[9])
+    logger.info(f"Evento de ignição detectado: IMEI={message.imei}, Estado={'LIGADA' if ignition_state else 'DESLIGADA'}")
+
+def _extract_low_power(message: GV50Message, parts: List[str]):
+    """GTIGL - Evento de bateria baixa (Low External Power)."""
+    if len(parts) >= 13:
+        message.battery_voltage = parse_float(parts[5])  # Voltagem da bateria
+        message.battery_low = True  # Marca que bateria está baixa
+        message.longitude = parse_float(parts[10])
+        message.latitude = parse_float(parts[11])
+        message.device_time = parse_device_time(parts[12])
+        message.speed = 0.0  # Geralmente parado quando bateria baixa
+        message.altitude = parse_float(parts[9])
+        message.ignition = False  # Provavelmente desligado se bateria baixa
+    logger.warning(f"🔋 ALERTA BATERIA BAIXA: IMEI={message.imei}, Voltagem={message.battery_voltage or 'N/A'}V")
+
+def _extract_command_reply(message: GV50Message, parts: List[str]):
+    """Outros tipos (GTOUT, GTSRI, GTBSI) - respostas de comando sem posição."""
+    # +ACK:GTOUT,versão,IMEI,nome,serial,horário,contador$ - serial do AT+GTOUT confirmado
+    if message.message_type == '+ACK' and len(parts) >= 5:
+        message.serial = parts[4].upper()
+    logger.debug(f"Mensagem de comando/resposta: {message.command_type}")
+
+Extractor = Callable[[GV50Message, List[str]], None]
+
+_EXTRACTORS: Dict[str, Extractor] = {
+    'GTFRI': _extract_fri,
+    'GTIGN': _extract_ignition,
+    'GTIGF': _extract_ignition,
+    'GTIGL': _extract_low_power,
+    'GTOUT': _extract_command_reply,
+    'GTSRI': _extract_command_reply,
+    'GTBSI': _extract_command_reply,
+}
+
+# Tabela de despacho pelo cabeçalho, ex: '+RESP:GTFRI' -> ('+RESP', 'GTFRI', extrator)
+_DISPATCH: Dict[str, Tuple[str, str, Extractor]] = {
+    f"{message_type}:{command_type}": (message_type, command_type, extractor)
+    for message_type in ('+RESP', '+BUFF', '+ACK')
+    for command_type, extractor in _EXTRACTORS.items()
+}
+
+def parse_gv50_message(raw_message: Union[bytes, bytearray, memoryview, str]) -> Optional[GV50Message]:
     """
     Analisa mensagem do protocolo GV50.
     Suporta múltiplos tipos: GTFRI, GTIGN, GTIGF, GTIGL, GTOUT, GTSRI, GTBSI
+
+    Aceita o frame em bytes/memoryview (direto do FrameBuffer, decodificado uma
+    única vez) ou str.
     """
     try:
-        if not raw_message or not raw_message.startswith('+'):
+        if isinstance(raw_message, str):
+            message_text = raw_message.strip()
+        else:
+            message_text = str(raw_message, 'utf-8').strip()
+
+        if not message_text or message_text[0] != '+':
             return None
-        
-        # Remover $ do final se existir
-        message = raw_message.rstrip('$')
-        
-        # Dividir por virgulas
-        parts = message.split(',')
-        
+
+        # Remover $ do final e dividir por virgulas
+        parts = message_text.rstrip('$').split(',')
+
         if len(parts) < 3:
             return None
-        
-        # Extrair tipo de comando da primeira parte
-        message_header = parts[0]  # Ex: +RESP:GTFRI ou +RESP:GTIGN
-        
-        # Identificar tipo de mensagem
-        command_type = None
-        for cmd in ['GTFRI', 'GTIGN', 'GTIGF', 'GTIGL', 'GTOUT', 'GTSRI', 'GTBSI']:
-            if cmd in message_header:
-                command_type = cmd
-                break
-                
-        if not command_type:
-            logger.debug(f"Tipo de comando não reconhecido: {message_header}")
+
+        # Identificar tipo de mensagem pelo cabeçalho (ex: +RESP:GTFRI ou +BUFF:GTIGN)
+        entry = _DISPATCH.get(parts[0])
+        if entry is None:
+            logger.debug(f"Tipo de comando não reconhecido: {parts[0]}")
             return None
-        
-        # Identificar tipo de mensagem (+RESP, +BUFF, +ACK)
-        message_type = '+RESP'  # Default
-        if '+BUFF:' in message_header:
-            message_type = '+BUFF'
-        elif '+ACK:' in message_header:
-            message_type = '+ACK'
-        elif '+RESP:' in message_header:
-            message_type = '+RESP'
-        
-        # Estrutura básica para todos os tipos
-        parsed = {
-            'message_type': message_type,
-            'command_type': command_type,
-            'imei': parts[2] if len(parts) > 2 else '',
-            'number': parts[-1] if len(parts) > 0 else '0000',
-            'raw_message': raw_message
-        }
-        
-        # Processar diferentes tipos de mensagem
-        if command_type == 'GTFRI':
-            # Mensagem de dados GPS fixos
-            if len(parts) >= 14:
-                parsed['longitude'] = parts[11]
-                parsed['latitude'] = parts[12]
-                parsed['device_time'] = parts[13]
-                parsed['speed'] = parts[8]
-                parsed['altitude'] = parts[10]
-                parsed['ignition'] = 'true' if (len(parts) > 6 and parts[6] == '1') else 'false'
-                
-        elif command_type in ['GTIGN', 'GTIGF']:
-            # Eventos de ignição (ON/OFF)
-            ignition_state = command_type == 'GTIGN'  # True se ligada, False se desligada
-            
-            if len(parts) >= 13:
-                parsed['ignition'] = 'true' if ignition_state else 'false'
-                parsed['ignition_event'] = 'true'  # Marca como evento de ignição
-                parsed['longitude'] = parts[10] if len(parts) > 10 else '0'
-                parsed['latitude'] = parts[11] if len(parts) > 11 else '0'
-                parsed['device_time'] = parts[12] if len(parts) > 12 else ''
-                parsed['speed'] = '0'  # Eventos de ignição geralmente são com veículo parado
-                parsed['altitude'] = parts[9] if len(parts) > 9 else '0'
-            logger.info(f"Evento de ignição detectado: IMEI={parsed['imei']}, Estado={'LIGADA' if ignition_state else 'DESLIGADA'}")
-                
-        elif command_type == 'GTIGL':
-            # Evento de bateria baixa (Low External Power)
-            if len(parts) >= 13:
-                # GTIGL: Protocolo para bateria baixa do veículo
-                parsed['battery_voltage'] = parts[5] if len(parts) > 5 else '0'  # Voltagem da bateria
-                parsed['battery_low'] = 'true'  # Marca que bateria está baixa
-                parsed['longitude'] = parts[10] if len(parts) > 10 else '0'
-                parsed['latitude'] = parts[11] if len(parts) > 11 else '0'
-                parsed['device_time'] = parts[12] if len(parts) > 12 else ''
-                parsed['speed'] = '0'  # Geralmente parado quando bateria baixa
-                parsed['altitude'] = parts[9] if len(parts) > 9 else '0'
-                parsed['ignition'] = 'false'  # Provavelmente desligado se bateria baixa
-            logger.warning(f"🔋 ALERTA BATERIA BAIXA: IMEI={parsed['imei']}, Voltagem={parsed.get('battery_voltage', 'N/A')}V")
-            
-        else:
-            # Outros tipos (GTOUT, GTSRI, GTBSI)
-            logger.debug(f"Mensagem de comando/resposta: {command_type}")
-            
-        logger.debug(f"Mensagem analisada: Tipo={command_type}, IMEI={parsed['imei']}")
-        return parsed
-        
+
+        message_type, command_type, extractor = entry
+        message = GV50Message(message_type, command_type, parts[2], parts[-1], message_text)
+        extractor(message, parts)
+        return message
+
+    except UnicodeDecodeError:
+        logger.warning(f"Dados inválidos recebidos, ignorando mensagem: {bytes(raw_message)!r}")
+        return None
     except Exception as e:
-        logger.error(f"Erro ao analisar mensagem {raw_message}: {e}")
+        logger.error(f"Erro ao analisar mensagem {raw_message!r}: {e}")
         return None
 
 def create_ack_message(number: str, command_type: str = "GTFRI") -> str:
     """Cria mensagem de ACK para o dispositivo baseada no tipo de comando."""
     return f"+SACK:{command_type},{number}$"
 
-def create_block_command(password: str = "gv50") -> str:
-    """Cria comando para bloquear dispositivo."""
-    return f"AT+GTOUT={password},1,0,,,,,,FFFF$"
+def create_block_command(password: str = "gv50", serial: str = "FFFF") -> str:
+    """Cria comando para bloquear dispositivo (o serial volta no +ACK:GTOUT)."""
+    return f"AT+GTOUT={password},1,0,,,,,,{serial}$"
 
-def create_unblock_command(password: str = "gv50") -> str:
-    """Cria comando para desbloquear dispositivo."""
-    return f"AT+GTOUT={password},0,0,,,,,,FFFF$"
+def create_unblock_command(password: str = "gv50", serial: str = "FFFF") -> str:
+    """Cria comando para desbloquear dispositivo (o serial volta no +ACK:GTOUT)."""
+    return f"AT+GTOUT={password},0,0,,,,,,{serial}$"
 
 def create_ip_config_command(password: str, server_ip: str, server_port: int, 
-                           backup_ip: str = "", backup_port: int = 8000) -> str:
-    """Cria comando para configurar IP do servidor."""
+                           backup_ip: str = "", backup_port: int = 8000, serial: str = "FFFF") -> str:
+    """Cria comando para configurar IP do servidor (o serial volta no +ACK:GTSRI)."""
     return (f"AT+GTSRI={password},123456,0,"
             f"{server_ip},{server_port},0,"
-            f"{backup_ip or server_ip},{backup_port},,,,FFFF$")
\ No newline at end of file
+            f"{backup_ip or server_ip},{backup_port},,,,{serial}$")
\ No newline at end of file
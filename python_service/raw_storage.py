@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Armazenamento de mensagem_raw de dados_veiculo (RAW_STORAGE_MODE)
+  inline      texto em dados_veiculo.mensagem_raw (formato original)
+  compressed  binário em dados_veiculo.mensagem_raw_z, zlib ou zstd com dicionário compartilhado
+  archive     texto na coleção dados_veiculo_raw, com o mesmo _id do documento de dados_veiculo
+A conversão acontece na gravação do lote, fora do caminho por frame. Os dicionários
+usados ficam na coleção raw_dicionarios, então documentos antigos continuam legíveis
+mesmo depois de trocar o dicionário.
+
+Treinar um dicionário com tráfego capturado (CAPTURE_DIR):
+  python raw_storage.py train-dict capturas/*.gv50cap.gz --output gv50_raw.dict [--codec zstd]
+"""
+
+import argparse
+import struct
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from bson import Binary, ObjectId
+from config import get_settings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+RAW_MODES = ('inline', 'compressed', 'archive')
+CODECS = {'zlib': 1, 'zstd': 2}
+RAW_HEADER = struct.Struct("<BI")  # Codec, id do dicionário (crc32)
+ZLIB_WBITS = -11  # Deflate sem cabeçalho, janela de 2KB (frames têm ~150 bytes)
+DICTIONARY_SIZE = 2048  # Só os últimos 2^11 bytes do dicionário alcançam a janela do zlib
+ARCHIVE_COLLECTION = 'dados_veiculo_raw'
+DICTIONARY_COLLECTION = 'raw_dicionarios'
+
+def default_dictionary() -> bytes:
+    """Dicionário embutido: um frame de referência de cada tipo (gv50_samples)."""
+    import gv50_samples
+    frames = [frame for name, frame in gv50_samples.corpus() if not name.startswith("invalido")]
+    return b"".join(frames)[-DICTIONARY_SIZE:]
+
+def build_dictionary(frames: List[bytes], codec: str = 'zlib', size: int = DICTIONARY_SIZE) -> bytes:
+    """
+    Dicionário a partir de frames reais. zstd usa o treinamento do próprio zstandard;
+    para zlib, um frame recente de cada tipo, com os tipos mais frequentes no final
+    (distâncias menores na janela).
+    """
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.train_dictionary(size, frames).as_bytes()
+    latest: Dict[bytes, bytes] = {}
+    counts: Counter = Counter()
+    for frame in frames:
+        kind = frame.split(b",", 1)[0]
+        latest[kind] = frame
+        counts[kind] += 1
+    ordered = sorted(latest, key=lambda kind: counts[kind])
+    return b"".join(latest[kind] for kind in ordered)[-size:]
+
+class RawCodec:
+    """Compressão de um frame com dicionário pré-carregado (um compressor por frame, sem estado)."""
+
+    def __init__(self, codec: str, dictionary: bytes):
+        self.codec = codec
+        self.dictionary = dictionary
+        self.dictionary_id = zlib.crc32(dictionary)
+        self.header = RAW_HEADER.pack(CODECS[codec], self.dictionary_id)
+        self._zstd = None
+        if codec == 'zstd':
+            import zstandard
+            zstd_dictionary = zstandard.ZstdCompressionDict(dictionary)
+            self._zstd = zstandard.ZstdCompressor(level=3, dict_data=zstd_dictionary, write_dict_id=False)
+
+    def compress(self, text: str) -> bytes:
+        data = text.encode('utf-8')
+        if self._zstd is not None:
+            return self.header + self._zstd.compress(data)
+        # memLevel=1: o estado do deflate é alocado a cada frame, e com ~150 bytes isso domina o custo
+        compressor = zlib.compressobj(6, zlib.DEFLATED, ZLIB_WBITS, 1, zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+        return self.header + compressor.compress(data) + compressor.flush()
+
+def decompress_raw(blob: bytes, dictionaries: Dict[int, bytes]) -> str:
+    """Texto original de um mensagem_raw_z; `dictionaries` é {id: bytes} (ver RawStorage.load_dictionary)."""
+    codec, dictionary_id = RAW_HEADER.unpack_from(blob)
+    body = bytes(blob[RAW_HEADER.size:])
+    dictionary = dictionaries[dictionary_id]
+    if codec == CODECS['zstd']:
+        import zstandard
+        decompressor = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(dictionary))
+        return decompressor.decompress(body).decode('utf-8')
+    decompressor = zlib.decompressobj(ZLIB_WBITS, zdict=dictionary)
+    return (decompressor.decompress(body) + decompressor.flush()).decode('utf-8')
+
+class RawStorage:
+    """Aplica o modo de armazenamento de mensagem_raw aos lotes gravados em dados_veiculo."""
+
+    @property
+    def settings(self):
+        return get_settings()
+
+    def __init__(self):
+        self._codec: Optional[RawCodec] = None
+        self._codec_key: Optional[Tuple[str, str]] = None
+        self._registered: set = set()  # Dicionários já gravados em raw_dicionarios
+        self._dictionaries: Dict[int, bytes] = {}
+
+    def codec(self) -> RawCodec:
+        """Codec da configuração atual (recriado quando RAW_COMPRESSION ou RAW_DICTIONARY_FILE mudam)."""
+        key = (self.settings.raw_compression, self.settings.raw_dictionary_file)
+        if self._codec is None or self._codec_key != key:
+            name, path = key
+            if name == 'zstd':
+                try:
+                    import zstandard  # noqa: F401
+                except ImportError:
+                    logger.error("RAW_COMPRESSION=zstd requer o pacote zstandard (pip install zstandard); usando zlib")
+                    name = 'zlib'
+            dictionary = default_dictionary()
+            if path:
+                try:
+                    with open(path, 'rb') as file:
+                        dictionary = file.read()
+                except OSError as e:
+                    logger.error(f"Dicionário {path} indisponível, usando o embutido: {e}")
+            self._codec = RawCodec(name, dictionary)
+            self._codec_key = key
+            self._dictionaries[self._codec.dictionary_id] = dictionary
+            logger.info(f"mensagem_raw comprimida com {name} (dicionário {self._codec.dictionary_id:08x}, {len(dictionary)} bytes)")
+        return self._codec
+
+    async def prepare_batch(self, database, documents: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """
+        Documentos para dados_veiculo e para dados_veiculo_raw. Os originais não são
+        alterados (além do _id), então um lote que falhar pode ir para o spool como está.
+        """
+        mode = self.settings.raw_storage_mode
+        if mode not in ('compressed', 'archive'):
+            return documents, []
+
+        codec = None
+        if mode == 'compressed':
+            codec = self.codec()
+            if codec.dictionary_id not in self._registered:
+                await self._register_dictionary(database, codec)
+
+        hot: List[dict] = []
+        archived: List[dict] = []
+        for document in documents:
+            text = document.get('mensagem_raw')
+            if text is None:
+                hot.append(document)
+                continue
+            document.setdefault('_id', ObjectId())  # Mesmo _id nas duas coleções e em regravações
+            slim = {field: value for field, value in document.items() if field != 'mensagem_raw'}
+            if codec is not None:
+                slim['mensagem_raw_z'] = Binary(codec.compress(text))
+            else:
+                archived.append({
+                    '_id': document['_id'],
+                    'IMEI': document.get('IMEI'),
+                    'data': document.get('data'),
+                    'mensagem_raw': text,
+                })
+            hot.append(slim)
+        return hot, archived
+
+    async def _register_dictionary(self, database, codec: RawCodec):
+        await database[DICTIONARY_COLLECTION].update_one(
+            {'_id': codec.dictionary_id},
+            {'$setOnInsert': {'codec': codec.codec, 'data': Binary(codec.dictionary)}},
+            upsert=True
+        )
+        self._registered.add(codec.dictionary_id)
+
+    async def load_dictionary(self, database, dictionary_id: int) -> bytes:
+        dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            stored = await database[DICTIONARY_COLLECTION].find_one({'_id': dictionary_id})
+            if stored is None:
+                raise KeyError(f"dicionário {dictionary_id:08x} não encontrado em {DICTIONARY_COLLECTION}")
+            dictionary = self._dictionaries[dictionary_id] = bytes(stored['data'])
+        return dictionary
+
+    async def mensagem_raw(self, database, document: dict) -> Optional[str]:
+        """Frame original de um documento de dados_veiculo em qualquer um dos modos."""
+        if document.get('mensagem_raw') is not None:
+            return document['mensagem_raw']
+        blob = document.get('mensagem_raw_z')
+        if blob is not None:
+            dictionary_id = RAW_HEADER.unpack_from(blob)[1]
+            dictionary = await self.load_dictionary(database, dictionary_id)
+            return decompress_raw(blob, {dictionary_id: dictionary})
+        if '_id' in document:
+            archived = await database[ARCHIVE_COLLECTION].find_one({'_id': document['_id']})
+            if archived:
+                return archived.get('mensagem_raw')
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Dicionário de compressão de mensagem_raw")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser("train-dict", help="Treinar dicionário com arquivos de captura")
+    train.add_argument("files", nargs="+", help="Arquivos .gv50cap.gz (CAPTURE_DIR)")
+    train.add_argument("--output", required=True, help="Arquivo do dicionário (RAW_DICTIONARY_FILE)")
+    train.add_argument("--codec", choices=tuple(CODECS), default="zlib")
+    train.add_argument("--size", type=int, default=None, help="Bytes do dicionário (padrão: 2048 zlib, 16384 zstd)")
+    train.add_argument("--limit", type=int, default=100000, help="Frames usados no treinamento")
+    args = parser.parse_args()
+
+    from frame_capture import read_capture
+    frames: List[bytes] = []
+    for path in args.files:
+        for _, _, frame in read_capture(path):
+            frames.append(frame)
+            if len(frames) >= args.limit:
+                break
+        if len(frames) >= args.limit:
+            break
+    size = args.size or (16384 if args.codec == 'zstd' else DICTIONARY_SIZE)
+    dictionary = build_dictionary(frames, args.codec, size)
+    with open(args.output, 'wb') as file:
+        file.write(dictionary)
+
+    codec = RawCodec(args.codec, dictionary)
+    sample = frames[-1000:]
+    raw = sum(len(frame) for frame in sample)
+    compressed = sum(len(codec.compress(frame.decode('utf-8', errors='replace'))) for frame in sample)
+    print(f"Dicionário {codec.dictionary_id:08x} ({len(dictionary)} bytes) gravado em {args.output}")
+    print(f"Amostra de {len(sample)} frames: {raw} -> {compressed} bytes ({compressed / max(raw, 1) * 100:.0f}%)")
+
+# Instância global
+raw_storage = RawStorage()
+
+if __name__ == "__main__":
+    main()
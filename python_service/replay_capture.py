@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Reprodução de tráfego capturado (CAPTURE_DIR) contra o servidor TCP
+Lê os arquivos .gv50cap.gz em ordem de horário e reenvia cada frame pela conexão
+simulada correspondente, passando pelo parser, pela gravação em lote e pelos ACKs
+como no tráfego real. Confere os +SACK e mede throughput e latência.
+
+Uso:
+  python replay_capture.py capturas/*.gv50cap.gz
+      Servidor em memória (mongomock-motor), no ritmo original
+  python replay_capture.py --speed 20 capturas/*.gv50cap.gz
+      20x mais rápido que o original
+  python replay_capture.py --speed 0 --connections 500 capturas/*.gv50cap.gz
+      O mais rápido possível, conexões originais distribuídas em 500 sockets
+  python replay_capture.py --host 10.0.0.5 --port 8000 --server-pid 1234 capturas/*.gv50cap.gz
+      Contra um servidor já em execução (cuidado: grava no MongoDB dele)
+  python replay_capture.py --parse-only capturas/*.gv50cap.gz
+      Apenas parse_gv50_message, sem rede nem MongoDB
+"""
+
+import argparse
+import asyncio
+import heapq
+import multiprocessing
+import os
+import signal
+import time
+from collections import Counter, defaultdict, deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from fleet_simulator import (free_port, percentile, process_cpu_seconds, raise_fd_limit,
+                             run_stand_in_server, wait_for_server)
+
+class ReplayStats:
+    """Contadores e latências de ACK de todas as conexões simuladas."""
+
+    def __init__(self):
+        self.connections = 0
+        self.sent = 0
+        self.expecting_ack = 0
+        self.acked = 0
+        self.unexpected_acks = 0
+        self.other_messages = 0
+        self.disconnects = 0
+        self.latencies: List[float] = []
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+
+def records(paths: List[str]) -> Iterator[Tuple[float, int, bytes]]:
+    """Registros de todos os arquivos intercalados por horário (cada arquivo já está em ordem)."""
+    # Importado só aqui: o logger inicia uma thread e o servidor em memória nasce de um fork
+    from frame_capture import read_capture
+    return heapq.merge(*(read_capture(path) for path in sorted(paths)), key=lambda record: record[0])
+
+def ack_key(frame: bytes) -> Optional[bytes]:
+    """Contador do relatório que volta no +SACK; None para frames que não recebem ACK."""
+    if not frame.startswith((b"+RESP:", b"+BUFF:")):
+        return None
+    return frame.rstrip(b"$\r\n ").rsplit(b",", 1)[-1]
+
+class ReplayConnection:
+    """Um socket da reprodução: recebe os frames de uma ou mais conexões capturadas."""
+
+    def __init__(self, stats: ReplayStats):
+        self.stats = stats
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.pending: Dict[bytes, Deque[float]] = defaultdict(deque)  # contador -> instantes de envio
+        self.ack_task: Optional[asyncio.Task] = None
+
+    async def open(self, host: str, port: int):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.ack_task = asyncio.create_task(self.read_acks())
+        self.stats.connections += 1
+
+    async def send(self, frame: bytes):
+        key = ack_key(frame)
+        if key is not None:
+            self.pending[key].append(time.perf_counter())
+            self.stats.expecting_ack += 1
+        self.writer.write(frame)
+        self.stats.sent += 1
+        if self.writer.transport.get_write_buffer_size() > 65536:
+            await self.writer.drain()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(times) for times in self.pending.values())
+
+    async def read_acks(self):
+        buffer = b""
+        while True:
+            data = await self.reader.read(4096)
+            if not data:
+                self.stats.disconnects += 1
+                return
+            received = time.perf_counter()
+            buffer += data
+            *frames, buffer = buffer.split(b"$")
+            for frame in frames:
+                if not frame.startswith(b"+SACK:"):
+                    self.stats.other_messages += 1  # Heartbeat ou comando do servidor
+                    continue
+                times = self.pending.get(frame.rsplit(b",", 1)[-1])
+                if not times:
+                    self.stats.unexpected_acks += 1
+                    continue
+                self.stats.acked += 1
+                self.stats.latencies.append(received - times.popleft())
+
+    def close(self):
+        if self.ack_task:
+            self.ack_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+async def replay(args) -> ReplayStats:
+    stats = ReplayStats()
+    slots: Dict[int, ReplayConnection] = {}  # Conexão capturada -> socket da reprodução
+    sockets: List[ReplayConnection] = []
+
+    async def connection_for(original: int) -> ReplayConnection:
+        connection = slots.get(original)
+        if connection is None:
+            if args.connections and len(sockets) >= args.connections:
+                connection = sockets[len(slots) % args.connections]
+            else:
+                connection = ReplayConnection(stats)
+                await connection.open(args.host, args.port)
+                sockets.append(connection)
+            slots[original] = connection
+        return connection
+
+    cpu_start = process_cpu_seconds(args.server_pid) if args.server_pid else None
+    started = time.monotonic()
+    try:
+        for timestamp, original, frame in records(args.files):
+            if stats.first_ts is None:
+                stats.first_ts = timestamp
+            stats.last_ts = timestamp
+            if args.speed > 0:
+                delay = started + (timestamp - stats.first_ts) / args.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            connection = await connection_for(original)
+            try:
+                await connection.send(frame)
+            except (ConnectionResetError, BrokenPipeError, OSError):
+                stats.disconnects += 1
+            if args.limit and stats.sent >= args.limit:
+                break
+
+        # Aguardar os ACKs que faltam
+        deadline = time.monotonic() + args.ack_timeout
+        while any(connection.waiting for connection in sockets) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    finally:
+        elapsed = time.monotonic() - started
+        for connection in sockets:
+            connection.close()
+
+    captured = (stats.last_ts - stats.first_ts) if stats.first_ts is not None else 0.0
+    print(f"\n=== Reprodução: {len(args.files)} arquivos, {len(slots)} conexões capturadas em {stats.connections} sockets ===")
+    print(f"Frames enviados:          {stats.sent} (esperando ACK: {stats.expecting_ack})")
+    print(f"ACKs corretos:            {stats.acked}")
+    print(f"Sem ACK:                  {stats.expecting_ack - stats.acked}")
+    print(f"ACKs inesperados:         {stats.unexpected_acks}")
+    print(f"Outras mensagens:         {stats.other_messages}")
+    print(f"Desconexões:              {stats.disconnects}")
+    print(f"Duração:                  {elapsed:.1f}s (capturado em {captured:.1f}s, {captured / max(elapsed, 1e-9):.1f}x)")
+    print(f"Throughput:               {stats.sent / max(elapsed, 1e-9):.0f} frames/s")
+    print(
+        f"Latência do ACK:          p50={percentile(stats.latencies, 0.5) * 1000:.2f}ms "
+        f"p99={percentile(stats.latencies, 0.99) * 1000:.2f}ms "
+        f"máx={max(stats.latencies, default=0) * 1000:.2f}ms"
+    )
+    if args.server_pid:
+        cpu = process_cpu_seconds(args.server_pid) - cpu_start
+        print(f"CPU do servidor:          {cpu * 1e6 / max(stats.sent, 1):.0f} µs/frame ({cpu / max(elapsed, 1e-9) * 100:.0f}% de um núcleo)")
+    return stats
+
+def parse_only(args):
+    """Passa cada frame capturado por parse_gv50_message e resume por tipo."""
+    import logging
+    from protocol_parser import parse_gv50_message
+    logging.disable(logging.CRITICAL)
+
+    types: Counter = Counter()
+    failures = 0
+    total = 0
+    started = time.perf_counter()
+    for _, _, frame in records(args.files):
+        parsed = parse_gv50_message(memoryview(frame))
+        total += 1
+        if parsed is None or not parsed.imei:
+            failures += 1
+        else:
+            types[f"{parsed.message_type}:{parsed.command_type}"] += 1
+        if args.limit and total >= args.limit:
+            break
+    elapsed = time.perf_counter() - started
+
+    print(f"\n=== Parse de {total} frames em {elapsed:.2f}s ({total / max(elapsed, 1e-9):.0f} frames/s, inclui leitura do gzip) ===")
+    for name, count in types.most_common():
+        print(f"{name:<24} {count}")
+    print(f"{'inválidos':<24} {failures}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprodução de frames GV50 capturados (CAPTURE_DIR)")
+    parser.add_argument("files", nargs="+", help="Arquivos .gv50cap.gz")
+    parser.add_argument("--speed", type=float, default=1.0, help="Multiplicador do ritmo original (0 = o mais rápido possível)")
+    parser.add_argument("--connections", type=int, default=0, help="Sockets da reprodução (0 = um por conexão capturada)")
+    parser.add_argument("--limit", type=int, default=0, help="Parar após N frames")
+    parser.add_argument("--ack-timeout", type=float, default=5, help="Segundos aguardando ACKs pendentes no fim")
+    parser.add_argument("--parse-only", action="store_true", help="Apenas o parser, sem rede nem MongoDB")
+    parser.add_argument("--host", default=None, help="Servidor externo (sem isso, sobe um com MongoDB em memória)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--server-pid", type=int, default=None, help="PID do servidor externo para medir CPU")
+    parser.add_argument("--log-level", default="WARNING", help="Nível de log do servidor em memória")
+    args = parser.parse_args()
+
+    if args.parse_only:
+        parse_only(args)
+        return
+
+    raise_fd_limit()
+    server = None
+    if args.host is None:
+        try:
+            import mongomock_motor  # noqa: F401
+        except ImportError:
+            parser.error("o servidor em memória requer mongomock-motor (pip install mongomock-motor) ou use --host")
+        args.host, args.port = '127.0.0.1', free_port()
+        os.environ['CAPTURE_DIR'] = ''  # O servidor da reprodução não recaptura o próprio tráfego
+        server = multiprocessing.get_context('fork').Process(
+            target=run_stand_in_server, args=(args.port, args.log_level), name="gps-stand-in"
+        )
+        server.start()
+        args.server_pid = server.pid
+
+    try:
+        asyncio.run(wait_for_server(args.host, args.port))
+        asyncio.run(replay(args))
+    finally:
+        if server:
+            os.kill(server.pid, signal.SIGTERM)
+            server.join(30)
+
+if __name__ == "__main__":
+    main()
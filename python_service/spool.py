@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Spool em disco (write-ahead log) para dados_veiculo
+Quando o MongoDB não aceita um lote, os documentos vão para segmentos append-only
+em disco com fsync em grupo e uma task os regrava no MongoDB depois, a partir de
+um checkpoint. A ingestão continua na velocidade normal durante quedas e
+manutenções do banco sem perder relatórios já confirmados com +SACK.
+
+Formato do registro: <tamanho u32><crc32 u32><documento BSON>. Segmentos
+00000001.seg, 00000002.seg, ...; o writer sempre abre um segmento novo ao
+iniciar, então o final truncado de um crash fica só em segmentos fechados.
+
+Cada documento recebe o _id antes de ir para o disco. Regravar um lote que já
+entrou (crash entre o insert e o checkpoint, insert parcial) é recusado pelo índice
+único de _id em coleção regular; em time-series, sem esse índice, o replay filtra
+os _id já gravados (mongodb_client.insert_dados_veiculo_retry).
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, List, Optional, Tuple
+import bson
+from bson import ObjectId
+from metrics import Counter, Gauge
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+RECORD_HEADER = struct.Struct("<II")  # Tamanho do documento, crc32
+SEGMENT_SUFFIX = ".seg"
+CHECKPOINT_FILE = "checkpoint.json"
+
+SPOOL_APPENDED = Counter("gv50_spool_appended_total", "Documentos de dados_veiculo gravados no spool em disco")
+SPOOL_REPLAYED = Counter("gv50_spool_replayed_total", "Documentos do spool regravados no MongoDB")
+SPOOL_PENDING_BYTES = Gauge("gv50_spool_pending_bytes", "Bytes no spool ainda não regravados no MongoDB")
+
+Position = Tuple[int, int]  # (segmento, offset)
+
+def spool_path(path: str, worker_id: int = 0) -> str:
+    """Diretório próprio de cada worker (spool -> spool/worker2)."""
+    if not path or not worker_id:
+        return path
+    return os.path.join(path, f"worker{worker_id}")
+
+class SegmentReader:
+    """Leitura de um segmento via mmap (sem cópia do arquivo para a memória do processo)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def read(self, offset: int, limit: int, max_records: int) -> Tuple[List[dict], int, bool]:
+        """
+        Documentos a partir de `offset` até `limit` bytes. Retorna (documentos, novo
+        offset, registro inválido encontrado).
+        """
+        documents: List[dict] = []
+        data = self.map
+        while offset < limit and len(documents) < max_records:
+            if offset + RECORD_HEADER.size > limit:
+                return documents, offset, True
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            end = start + length
+            if end > limit:
+                return documents, offset, True
+            payload = data[start:end]
+            if zlib.crc32(payload) != crc:
+                return documents, offset, True
+            documents.append(bson.decode(payload))
+            offset = end
+        return documents, offset, False
+
+class DadosSpool:
+    """Segmentos append-only com fsync em grupo, checkpoint de leitura e remoção dos já regravados."""
+
+    def __init__(self, directory: str, segment_size: int):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segments: List[int] = []  # Segmentos existentes, em ordem
+        self.pending_bytes = 0
+        self._file = None
+        self._segment = 0
+        self._written = 0  # Bytes escritos no segmento atual
+        self._synced: Position = (0, 0)  # Até onde os dados estão em disco (e podem ser lidos)
+        self._checkpoint: Position = (0, 0)  # Até onde já foi regravado no MongoDB
+        self._readers: Dict[int, SegmentReader] = {}
+        self._sync_waiters: List[asyncio.Future] = []
+        self._sync_requested = asyncio.Event()
+        self._data_available = asyncio.Event()
+        self.sync_task: Optional[asyncio.Task] = None
+
+    @property
+    def empty(self) -> bool:
+        return self.pending_bytes == 0
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+    async def open(self):
+        """Retoma o spool existente (replay a partir do checkpoint) e abre um segmento novo."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+        )
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as file:
+                checkpoint = json.load(file)
+            self._checkpoint = (checkpoint['segment'], checkpoint['offset'])
+        except FileNotFoundError:
+            self._checkpoint = (self.segments[0], 0) if self.segments else (0, 0)
+        except (ValueError, KeyError) as e:
+            logger.error(f"Checkpoint do spool inválido, relendo todos os segmentos: {e}")
+            self._checkpoint = (self.segments[0], 0) if self.segments else (0, 0)
+        self._remove_consumed()
+
+        for segment in self.segments:
+            size = os.path.getsize(self._segment_path(segment))
+            self.pending_bytes += size - (self._checkpoint[1] if segment == self._checkpoint[0] else 0)
+        self.pending_bytes = max(self.pending_bytes, 0)
+
+        self._open_segment((self.segments[-1] if self.segments else 0) + 1)
+        self._synced = (self._segment, 0)
+        if not self.segments[:-1]:
+            self._checkpoint = (self._segment, 0)
+        SPOOL_PENDING_BYTES.set_function(lambda: self.pending_bytes)
+        self.sync_task = asyncio.create_task(self._sync_loop())
+        if not self.empty:
+            self._data_available.set()
+            logger.warning(f"Spool com {self.pending_bytes} bytes não regravados em {self.directory}, retomando")
+        logger.info(f"Spool de dados_veiculo em {self.directory}")
+
+    async def close(self):
+        """Sincroniza o segmento atual e fecha os arquivos."""
+        if self.sync_task:
+            self.sync_task.cancel()
+            self.sync_task = None
+        if self._file:
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                logger.error(f"Erro ao sincronizar spool no encerramento: {e}")
+            self._file.close()
+            self._file = None
+        for waiter in self._sync_waiters:
+            if not waiter.done():
+                waiter.set_exception(OSError("spool fechado"))
+        self._sync_waiters = []
+        for reader in self._readers.values():
+            reader.close()
+        self._readers.clear()
+
+    def _open_segment(self, segment: int):
+        self._file = open(self._segment_path(segment), "ab")
+        self._segment = segment
+        self._written = 0
+        self.segments.append(segment)
+
+    async def append(self, documents: List[dict]):
+        """Grava os documentos e retorna quando estão em disco (fsync compartilhado com outros lotes)."""
+        parts = []
+        for document in documents:
+            if '_id' not in document:
+                document['_id'] = ObjectId()  # Replay idempotente: reinserir o mesmo _id falha como duplicado
+            payload = bson.encode(document)
+            parts.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+            parts.append(payload)
+        data = b"".join(parts)
+        self._file.write(data)
+        self._written += len(data)
+        self.pending_bytes += len(data)
+        SPOOL_APPENDED.inc(amount=len(documents))
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._sync_waiters.append(waiter)
+        self._sync_requested.set()
+        await waiter
+
+    async def _sync_loop(self):
+        """Um fsync cobre todos os append() que chegaram enquanto o anterior rodava."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._sync_requested.wait()
+            self._sync_requested.clear()
+            waiters, self._sync_waiters = self._sync_waiters, []
+            file, segment, offset = self._file, self._segment, self._written
+            rotated = False
+            try:
+                file.flush()
+                if offset >= self.segment_size:
+                    self._open_segment(segment + 1)  # Novos append() já vão para o próximo segmento
+                    rotated = True
+                await loop.run_in_executor(None, self._fsync, file, rotated)
+            except OSError as e:
+                logger.error(f"Erro ao sincronizar spool em disco: {e}")
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                continue
+            finally:
+                if rotated:
+                    file.close()
+            self._synced = (segment, offset)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._data_available.set()
+
+    def _fsync(self, file, rotated: bool):
+        os.fsync(file.fileno())
+        if rotated:
+            # Entrada do novo segmento no diretório
+            directory = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    async def wait_data(self):
+        await self._data_available.wait()
+
+    def _reader(self, segment: int, limit: int) -> SegmentReader:
+        reader = self._readers.get(segment)
+        if reader is None or reader.size < limit:
+            if reader is not None:
+                reader.close()
+            reader = self._readers[segment] = SegmentReader(self._segment_path(segment))
+        return reader
+
+    def read_batch(self, max_records: int) -> Tuple[List[dict], Position, int]:
+        """
+        Próximos documentos após o checkpoint, só do que já passou por fsync.
+        Retorna (documentos, posição após eles, bytes consumidos) para commit().
+        """
+        segment, offset = self._checkpoint
+        synced_segment, synced_offset = self._synced
+        documents: List[dict] = []
+        consumed = 0
+        while len(documents) < max_records and segment <= synced_segment:
+            if segment not in self.segments:
+                later = [s for s in self.segments if s > segment]
+                if not later:
+                    break
+                segment, offset = later[0], 0
+                continue
+            if segment == synced_segment:
+                limit = synced_offset
+            else:
+                limit = os.path.getsize(self._segment_path(segment))
+            if offset < limit:
+                reader = self._reader(segment, limit)
+                batch, new_offset, invalid = reader.read(offset, limit, max_records - len(documents))
+                documents.extend(batch)
+                consumed += new_offset - offset
+                if invalid:
+                    # Final truncado por crash (ou registro corrompido): o resto do segmento é descartado
+                    logger.error(
+                        f"Registro inválido no spool {self._segment_path(segment)} (offset {new_offset}), "
+                        f"{limit - new_offset} bytes descartados"
+                    )
+                    consumed += limit - new_offset
+                    new_offset = limit
+                offset = new_offset
+            if offset < limit or segment == synced_segment:
+                break
+            later = [s for s in self.segments if s > segment]
+            if not later:
+                break
+            segment, offset = later[0], 0
+
+        if not documents and (segment, offset) == self._checkpoint:
+            self._data_available.clear()
+        return documents, (segment, offset), consumed
+
+    def commit(self, position: Position, consumed: int):
+        """Avança o checkpoint após regravar no MongoDB e remove os segmentos já consumidos."""
+        self._checkpoint = position
+        self.pending_bytes = max(self.pending_bytes - consumed, 0)
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        try:
+            with open(path + ".tmp", "w") as file:
+                json.dump({'segment': position[0], 'offset': position[1]}, file)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            # Sem checkpoint o próximo início regrava de novo (duplicados são ignorados pelo _id)
+            logger.error(f"Erro ao gravar checkpoint do spool: {e}")
+        self._remove_consumed()
+
+    def _remove_consumed(self):
+        """Compactação: segmentos inteiramente antes do checkpoint (e fechados) são apagados."""
+        for segment in [s for s in self.segments if s < self._checkpoint[0] and s != self._segment]:
+            reader = self._readers.pop(segment, None)
+            if reader is not None:
+                reader.close()
+            try:
+                os.unlink(self._segment_path(segment))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Erro ao remover segmento do spool {segment}: {e}")
+                continue
+            self.segments.remove(segment)
@@ -5,98 +5,154 @@ Recebe dados GPS e verifica comandos de bloqueio
 """
 
 import asyncio
-from typing import Dict, Set, Optional
-from datetime import datetime, timedelta
-from protocol_parser import parse_gv50_message, create_ack_message, create_block_command, create_unblock_command, create_ip_config_command
+import time
+from typing import Dict, Iterable, List, Set, Optional
+from datetime import datetime
+from protocol_parser import GV50Message, parse_gv50_message, create_ack_message, create_block_command, create_unblock_command, create_ip_config_command
 from mongodb_client import mongodb_client
-from models import DadosVeiculo, Veiculo
-from config import get_settings
-from logger import get_logger
+from dados_writer import dados_writer
+from spool import spool_path
+from veiculo_cache import VeiculoCache
+from posicao_atual import PosicaoAtualCache
+from trip_tracker import TripTracker
+from command_dispatcher import CommandDispatcher
+from command_outbox import CommandOutbox
+from frame_reader import FrameBuffer
+from frame_capture import FrameCapture, capture_prefix
+from connection_manager import AdmissionController, DeadlineWheel, DeviceConnection, OutboundWriter
+import metrics
+from metrics import ACK_LATENCY, COMMANDS_SENT, FRAMES, PARSE_FAILURES, HttpEndpoint, MetricsServer
+from events import event_bus, events_socket_path
+from models import dados_from_message
+from config import RELOADABLE_FIELDS, get_settings, reload_settings
+from logger import apply_log_settings, get_dropped_count, get_logger
 
 logger = get_logger(__name__)
 
 class GPSDeviceHandler:
     """Manipulador para conexões de dispositivos GPS - Long Connection Mode."""
     
+    @property
+    def settings(self):
+        # Sempre a configuração atual: o reload (SIGHUP) troca o objeto inteiro
+        return get_settings()
+    
     def __init__(self):
-        self.connected_devices: Dict[str, dict] = {}  # IMEI -> {writer, last_seen, client_ip}
-        self.settings = get_settings()
-        self.cleanup_task: Optional[asyncio.Task] = None
+        self.connected_devices: Dict[str, dict] = {}  # IMEI -> {writer, client_ip, reader, outbound}
+        self.stats_task: Optional[asyncio.Task] = None
+        self.veiculo_cache = VeiculoCache()
+        self.posicoes = PosicaoAtualCache()
+        self.viagens = TripTracker()
+        self.admission = AdmissionController(
+            self.settings.max_connections,
+            max_per_ip=self.settings.max_connections_per_ip,
+            policy=self.settings.connection_policy,
+            queue_size=self.settings.admission_queue_size,
+            queue_timeout=self.settings.admission_queue_timeout
+        )
+        # Um único tick para todas as conexões em vez de um wait_for por leitura;
+        # cobre o keep-alive (heartbeat) e o DEVICE_TIMEOUT (encerramento)
+        self.idle_wheel = DeadlineWheel(self.settings.timer_resolution, self.on_idle_timeout, name="inatividade")
+        self.background_tasks: Set[asyncio.Task] = set()
+        # Todas as conexões (inclusive sem IMEI ou na fila de admissão), aguardadas no encerramento
+        self.handler_tasks: Set[asyncio.Task] = set()
+        self.writers: Set[asyncio.StreamWriter] = set()
+        self.command_outbox = CommandOutbox(self.lookup_outbound, self.on_command_confirmed)
+        self.capture: Optional[FrameCapture] = None  # Captura de frames brutos (CAPTURE_DIR)
+        
+    def apply_settings(self):
+        """Aplica à admissão os limites alterados no reload de configuração."""
+        settings = self.settings
+        self.admission.max_connections = settings.max_connections
+        self.admission.max_per_ip = settings.max_connections_per_ip
+        self.admission.policy = settings.connection_policy
+        self.admission.queue_size = settings.admission_queue_size
+        self.admission.queue_timeout = settings.admission_queue_timeout
+        self.admission.apply_limits()
+        # Prazos já agendados com o timeout anterior (a roda só adia no touch, nunca antecipa)
+        idle_timeout = self.idle_timeout
+        for connection in self.idle_wheel.entries():
+            self.idle_wheel.schedule(connection, connection.last_seen + idle_timeout)
+    
+    @property
+    def idle_timeout(self) -> float:
+        """Inatividade até o próximo keep-alive ou encerramento (lido a cada uso: ajustável no reload)."""
+        settings = self.settings
+        return min(settings.keep_alive_timeout, settings.device_timeout)
         
     async def handle_device(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Registra a conexão para o encerramento aguardá-la e atende o dispositivo."""
+        task = asyncio.current_task()
+        self.handler_tasks.add(task)
+        self.writers.add(writer)
+        try:
+            await self.serve_device(reader, writer)
+        finally:
+            self.handler_tasks.discard(task)
+            self.writers.discard(writer)
+    
+    async def close_connections(self, timeout: float):
+        """
+        Fecha todas as conexões e aguarda os handlers terminarem (no Python 3.11
+        Server.wait_closed não espera por eles); os que passarem do prazo são cancelados.
+        """
+        self.admission.close()
+        for writer in list(self.writers):
+            if not writer.is_closing():
+                writer.close()
+        tasks = list(self.handler_tasks)
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f"{len(pending)} conexões não terminaram em {timeout}s, cancelando")
+            for task in pending:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        
+    async def serve_device(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """Manipula conexão de um dispositivo GPS - Long Connection Mode."""
         client_ip = writer.get_extra_info('peername')[0]
-        logger.info(f"Nova conexão GPS long-connection de {client_ip}")
         
+        if not await self.admission.admit(client_ip):
+            writer.close()
+            return
         imei = None
-        device_info = None
-        
+        connection = None
         try:
-            # Configurar timeout de leitura
+            logger.info(f"Nova conexão GPS long-connection de {client_ip}")
+            event_bus.publish('connect', ip=client_ip)
+            
+            frame_buffer = FrameBuffer(self.settings.max_frame_size)
+            outbound = OutboundWriter(writer, self.settings.outbound_high_water, self.settings.outbound_low_water)
+            connection = DeviceConnection(reader, writer, client_ip, outbound)
+            self.idle_wheel.schedule(connection, time.monotonic() + self.idle_timeout)
+            
             while True:
                 try:
-                    # Aguardar dados com timeout
-                    data = await asyncio.wait_for(
-                        reader.read(1024), 
-                        timeout=self.settings.keep_alive_timeout
-                    )
+                    # Inatividade é detectada pela roda de prazos (on_idle_timeout)
+                    data = await reader.read(self.settings.read_chunk_size)
                     
                     if not data:
                         logger.info(f"Dispositivo {client_ip} encerrou conexão normalmente")
                         break
-                        
-                    message = data.decode('utf-8').strip()
-                    logger.info(f"[Long-Conn] Recebido de {client_ip}: {message}")
-                    
-                    # Processar mensagem do protocolo GV50
-                    parsed = parse_gv50_message(message)
-                    if parsed and parsed.get('imei'):
-                        imei = parsed['imei']
-                        
-                        # Registrar/atualizar dispositivo conectado
-                        device_info = {
-                            'writer': writer,
-                            'last_seen': datetime.now(),
-                            'client_ip': client_ip,
-                            'reader': reader
-                        }
-                        self.connected_devices[imei] = device_info
-                        
-                        # Salvar dados GPS no MongoDB
-                        await self.save_gps_data(parsed, message)
-                        
-                        # Log eventos especiais de ignição
-                        if parsed.get('ignition_event'):
-                            ignition_status = "LIGADA" if parsed.get('ignition') else "DESLIGADA"
-                            logger.info(f"🔥 Evento ignição {ignition_status}: IMEI={parsed['imei']}")
-                        
-                        # Verificar comandos pendentes (crítico para long-connection)
-                        await self.check_pending_commands(imei, writer)
-                        
-                        # Enviar ACK específico para o tipo de comando
-                        command_type = parsed.get('command_type', 'GTFRI')
-                        await self.send_ack(writer, parsed.get('number', '0000'), command_type)
                     
                     # Heartbeat implícito - qualquer mensagem mantém conexão viva
-                    if device_info:
-                        device_info['last_seen'] = datetime.now()
+                    connection.last_seen = time.monotonic()
+                    self.idle_wheel.touch(connection, connection.last_seen + self.idle_timeout)
+                    
+                    # Uma leitura pode conter vários frames ($) ou apenas parte de um
+                    frame_buffer.max_size = self.settings.max_frame_size
+                    frame_imei = await self.process_frames(frame_buffer.feed(data), connection)
+                    if frame_imei:
+                        imei = connection.imei = frame_imei
+                    
+                    # Só espera o socket se o buffer de envio passou do high watermark
+                    await outbound.wait_writable()
                         
-                except asyncio.TimeoutError:
-                    logger.warning(f"Timeout na conexão long-connection de {client_ip}")
-                    # Enviar heartbeat request se necessário
-                    if imei:
-                        try:
-                            await self.send_heartbeat_request(writer)
-                        except (ConnectionResetError, BrokenPipeError, OSError):
-                            logger.info(f"Dispositivo {client_ip} desconectou durante heartbeat")
-                            break
-                    continue
                 except (ConnectionResetError, BrokenPipeError, OSError) as e:
                     logger.info(f"Dispositivo {client_ip} desconectou abruptamente: {type(e).__name__}")
                     break
-                except UnicodeDecodeError:
-                    logger.warning(f"Dados inválidos recebidos de {client_ip}, ignorando mensagem")
-                    continue
                     
         except asyncio.IncompleteReadError:
             logger.info(f"Dispositivo {client_ip} desconectado (leitura incompleta)")
@@ -105,10 +161,20 @@ class GPSDeviceHandler:
         except Exception as e:
             logger.error(f"Erro inesperado ao processar dispositivo {client_ip}: {e}")
         finally:
-            # Cleanup da conexão
-            if imei and imei in self.connected_devices:
+            # Cleanup da conexão (a vaga de admissão primeiro, mesmo se a conexão nem chegou a ser montada)
+            self.admission.release(client_ip)
+            if connection is not None:
+                connection.closed = True
+                self.idle_wheel.cancel(connection)
+                event_bus.publish('disconnect', imei, ip=client_ip,
+                                  duration=round(time.monotonic() - connection.connected_at, 1))
+            
+            # Só remover se o IMEI não reconectou por outra conexão nesse meio tempo
+            if imei and imei in self.connected_devices and self.connected_devices[imei]['writer'] is writer:
                 logger.info(f"Removendo dispositivo {imei} das conexões ativas")
                 del self.connected_devices[imei]
+                self.veiculo_cache.evict(imei)
+                self.command_outbox.evict(imei)
             
             # Fechar conexão de forma segura
             if not writer.is_closing():
@@ -121,219 +187,381 @@ class GPSDeviceHandler:
                 except Exception as e:
                     logger.debug(f"Erro ao fechar conexão de {client_ip}: {e}")
             
-    async def save_gps_data(self, parsed_data: dict, raw_message: str):
+    async def process_frames(self, frames: Iterable[memoryview], connection: DeviceConnection) -> Optional[str]:
+        """
+        Processa os frames completos de uma leitura e retorna o último IMEI identificado.
+        Sequências de +BUFF (backlog após reconexão) são agrupadas e gravadas em lote.
+        ACKs e comandos da leitura saem juntos numa única escrita no final.
+        """
+        received = time.perf_counter()
+        imei = None
+        acks: List[GV50Message] = []
+        backlog: List[GV50Message] = []
+        outbound = connection.outbound
+        capture = self.capture
+        outbound.cork()
+        try:
+            for frame in frames:
+                if capture is not None:
+                    capture.record(connection.id, frame)
+                parsed = parse_gv50_message(frame)
+                if parsed is not None and parsed.imei and parsed.message_type == '+BUFF':
+                    backlog.append(parsed)
+                    continue
+                if backlog:
+                    imei = await self.process_backlog(backlog, connection)
+                    acks.extend(backlog)
+                    backlog = []
+                if await self.process_message(parsed, frame, connection):
+                    imei = parsed.imei
+                    acks.append(parsed)
+            if backlog:
+                imei = await self.process_backlog(backlog, connection)
+                acks.extend(backlog)
+            
+            if acks and self.settings.ack_after_durable:
+                # Inclui o que outras conexões enfileiraram depois: espera no máximo um lote a mais
+                if not await dados_writer.wait_durable(dados_writer.enqueued):
+                    logger.warning(
+                        f"Lote não gravado no MongoDB: {len(acks)} ACKs retidos para "
+                        f"{imei or connection.client_ip}, o dispositivo vai reenviar"
+                    )
+                    acks = []
+            if acks:
+                self.send_acks(outbound, acks)
+                latency = time.perf_counter() - received
+                for _ in acks:
+                    ACK_LATENCY.observe(latency)
+        finally:
+            outbound.uncork()
+        return imei
+            
+    async def process_message(self, parsed: Optional[GV50Message], frame: memoryview,
+                              connection: DeviceConnection) -> Optional[str]:
+        """Processa um frame GV50 ao vivo e retorna o IMEI identificado (o ACK fica para o fim da leitura)."""
+        client_ip = connection.client_ip
+        if not parsed or not parsed.imei:
+            message = bytes(frame).strip().decode('utf-8', errors='replace')
+            if message:
+                PARSE_FAILURES.inc()
+                logger.info(f"[Long-Conn] Recebido de {client_ip}: {message}")
+                event_bus.publish('parse_error', ip=client_ip, message=message[:200])
+            return None
+        
+        imei = parsed.imei
+        self.register_frame(parsed, connection)
+        
+        if parsed.message_type == '+ACK':
+            # Confirmação de comando enviado (serial do comando volta no +ACK). Não é relatório:
+            # sem posição nem horário, não vai para dados_veiculo nem altera o estado do veículo
+            await self.command_outbox.confirm(parsed)
+        else:
+            # Salvar dados GPS no MongoDB
+            await self.save_gps_data(parsed)
+            
+            # Log eventos especiais de ignição
+            if parsed.ignition_event:
+                ignition_status = "LIGADA" if parsed.ignition else "DESLIGADA"
+                logger.info(f"🔥 Evento ignição {ignition_status}: IMEI={imei}")
+        
+        # Verificar comandos pendentes (crítico para long-connection)
+        await self.check_pending_commands(imei, connection.outbound)
+        
+        return imei
+    
+    async def process_backlog(self, backlog: List[GV50Message], connection: DeviceConnection) -> str:
+        """
+        Grava uma sequência de relatórios +BUFF de uma vez: todos vão para dados_veiculo,
+        mas o estado do veículo só é atualizado pelo mais recente (horário do dispositivo).
+        """
+        newest: Dict[str, GV50Message] = {}
+        for parsed in backlog:
+            self.register_frame(parsed, connection)
+            if parsed.device_time is None:
+                continue  # Sem horário não dá para ordenar: vai só para o histórico
+            current = newest.get(parsed.imei)
+            if current is None or parsed.device_time >= current.device_time:
+                newest[parsed.imei] = parsed
+        
+        try:
+            await dados_writer.enqueue_many([dados_from_message(parsed) for parsed in backlog])
+            for parsed in newest.values():
+                await self.update_vehicle_state(parsed)
+                self.posicoes.update(parsed)
+            # A viagem acompanha todo o trajeto do backlog, em ordem de horário do dispositivo
+            for parsed in sorted((parsed for parsed in backlog if parsed.device_time), key=lambda parsed: parsed.device_time):
+                self.viagens.observe(parsed)
+            for parsed in backlog:
+                self.publish_save(parsed)
+        except Exception as e:
+            logger.error(f"Erro ao salvar backlog +BUFF de {connection.client_ip}: {e}")
+        
+        imei = backlog[-1].imei
+        times = [parsed.device_time for parsed in backlog if parsed.device_time]
+        period = f" de {min(times)} a {max(times)}" if times else ""
+        logger.info(f"📦 Backlog +BUFF de {imei}: {len(backlog)} relatórios gravados em lote{period}",
+                    extra={'imei': imei})
+        
+        await self.check_pending_commands(imei, connection.outbound)
+        return imei
+    
+    def register_frame(self, parsed: GV50Message, connection: DeviceConnection):
+        """Contabiliza o frame e registra/atualiza o dispositivo conectado."""
+        imei = parsed.imei
+        FRAMES.inc(parsed.message_type, parsed.command_type)
+        event_bus.publish('frame', imei, ip=connection.client_ip, message_type=parsed.message_type,
+                          command_type=parsed.command_type, number=parsed.number)
+        logger.info(f"[Long-Conn] Recebido de {connection.client_ip}: {parsed.raw_message}", extra={'imei': imei})
+        
+        self.connected_devices[imei] = {
+            'writer': connection.writer,
+            'client_ip': connection.client_ip,
+            'reader': connection.reader,
+            'outbound': connection.outbound
+        }
+    
+    async def save_gps_data(self, parsed: GV50Message):
         """Salva apenas dados do dispositivo GPS no MongoDB."""
         try:
+            imei = parsed.imei
+            raw_message = parsed.raw_message
+            
             # Criar objeto DadosVeiculo (dados do dispositivo)
-            dados = DadosVeiculo(
-                IMEI=parsed_data['imei'],
-                longitude=parsed_data.get('longitude', '0'),
-                latitude=parsed_data.get('latitude', '0'), 
-                altidude=parsed_data.get('altitude', '0'),
-                speed=parsed_data.get('speed', '0'),
-                ignicao=parsed_data.get('ignition', False),
-                dataDevice=parsed_data.get('device_time', ''),
-                mensagem_raw=raw_message  # Mensagem completa original
-            )
+            dados = dados_from_message(parsed)
             
             # Debug log para confirmar mensagem_raw
-            logger.debug(f"💾 Salvando dados GPS: IMEI={parsed_data['imei']}, raw_message='{raw_message[:50]}...'")
+            logger.debug(f"💾 Salvando dados GPS: IMEI={imei}, raw_message='{raw_message[:50]}...'")
             
             # Verificar se mensagem_raw foi definida corretamente
             if not dados.mensagem_raw:
-                logger.error(f"❌ ERRO: mensagem_raw está vazia para IMEI {parsed_data['imei']}")
+                logger.error(f"❌ ERRO: mensagem_raw está vazia para IMEI {imei}")
             else:
                 logger.debug(f"✅ mensagem_raw definida: {len(dados.mensagem_raw)} caracteres")
             
-            # Inserir dados do dispositivo no MongoDB
-            await mongodb_client.insert_dados_veiculo(dados)
-            
-            # Atualizar ou criar registro do veículo para controle de comandos
-            veiculo = await mongodb_client.get_veiculo_by_imei(parsed_data['imei'])
-            if not veiculo:
-                # Criar novo veículo se não existe
-                from models import Veiculo
-                veiculo = Veiculo(
-                    IMEI=parsed_data['imei'],
-                    ignicao=parsed_data.get('ignition', False)
-                )
-            else:
-                # Atualizar ignição
-                veiculo.ignicao = parsed_data.get('ignition', False)
-                
-            # Processar dados de bateria baixa (protocolo GTIGL)
-            if parsed_data.get('battery_low') == 'true':
-                try:
-                    battery_voltage = float(parsed_data.get('battery_voltage', '0'))
-                    veiculo.bateria_voltagem = battery_voltage
-                    veiculo.bateria_baixa = True
-                    veiculo.ultimo_alerta_bateria = datetime.utcnow()
-                    
-                    logger.warning(f"🔋 BATERIA BAIXA detectada: IMEI={parsed_data['imei']}, Voltagem={battery_voltage}V")
-                    
-                    # Log crítico para bateria muito baixa
-                    if battery_voltage < 11.0:
-                        logger.critical(f"🚨 BATERIA CRÍTICA: IMEI={parsed_data['imei']}, {battery_voltage}V - Dispositivo pode desligar!")
-                    elif battery_voltage < 11.5:
-                        logger.error(f"⚠️ BATERIA MUITO BAIXA: IMEI={parsed_data['imei']}, {battery_voltage}V - Atenção necessária")
-                        
-                except (ValueError, TypeError):
-                    logger.error(f"Erro ao processar voltagem da bateria: {parsed_data.get('battery_voltage')}")
-            else:
-                # Resetar alerta de bateria baixa se não for GTIGL
-                if veiculo.bateria_baixa and parsed_data.get('command_type') == 'GTFRI':
-                    # Só reseta se receber dados normais (GTFRI) - indica que bateria melhorou
-                    veiculo.bateria_baixa = False
-                    logger.info(f"✅ Status de bateria baixa resetado para IMEI={parsed_data['imei']}")
-                
-            await mongodb_client.update_veiculo(veiculo)
+            # Enfileirar dados do dispositivo para gravação em lote no MongoDB
+            await dados_writer.enqueue(dados)
             
-            logger.info(f"✅ Dados salvos: IMEI={parsed_data['imei']}, Tipo={parsed_data.get('command_type')}, Ignição={parsed_data.get('ignition', False)}")
+            # Atualizar estado do veículo em cache (gravado com $set coalescido)
+            await self.update_vehicle_state(parsed)
+            self.posicoes.update(parsed)
+            self.viagens.observe(parsed)
+            
+            logger.info(
+                f"✅ Dados salvos: IMEI={imei}, Tipo={parsed.command_type}, Ignição={parsed.ignition}",
+                extra={'imei': imei}
+            )
+            self.publish_save(parsed)
             
         except Exception as e:
             logger.error(f"Erro ao salvar dados do dispositivo: {e}")
+    
+    def publish_save(self, parsed: GV50Message):
+        event_bus.publish(
+            'save', parsed.imei, message_type=parsed.message_type, command_type=parsed.command_type,
+            ignition=parsed.ignition, latitude=parsed.latitude, longitude=parsed.longitude,
+            speed=parsed.speed, device_time=parsed.device_time,
+            battery_voltage=parsed.battery_voltage if parsed.battery_low else None
+        )
+            
+    async def update_vehicle_state(self, parsed: GV50Message):
+        """
+        Atualiza o estado do veículo em cache (gravado com $set coalescido). Relatórios com
+        horário do dispositivo anterior ao último estado aplicado (backlog +BUFF entregue
+        depois de um relatório ao vivo) ou sem horário, depois que o veículo já tem um,
+        não sobrescrevem ignição nem bateria.
+        """
+        imei = parsed.imei
+        veiculo = await self.veiculo_cache.get(imei)
+        if veiculo.dataDevice and (parsed.device_time is None or parsed.device_time < veiculo.dataDevice):
+            logger.debug(f"Relatório de {parsed.device_time} anterior ao estado de {veiculo.dataDevice}: IMEI={imei}")
+            return
+        
+        changes = {'ignicao': parsed.ignition}
+        if parsed.device_time:
+            changes['dataDevice'] = parsed.device_time
+            
+        # Processar dados de bateria baixa (protocolo GTIGL)
+        if parsed.battery_low:
+            try:
+                battery_voltage = float(parsed.battery_voltage)
+                changes['bateria_voltagem'] = battery_voltage
+                changes['bateria_baixa'] = True
+                changes['ultimo_alerta_bateria'] = datetime.utcnow()
+                
+                logger.warning(f"🔋 BATERIA BAIXA detectada: IMEI={imei}, Voltagem={battery_voltage}V")
+                
+                # Log crítico para bateria muito baixa
+                if battery_voltage < 11.0:
+                    logger.critical(f"🚨 BATERIA CRÍTICA: IMEI={imei}, {battery_voltage}V - Dispositivo pode desligar!")
+                elif battery_voltage < 11.5:
+                    logger.error(f"⚠️ BATERIA MUITO BAIXA: IMEI={imei}, {battery_voltage}V - Atenção necessária")
+                    
+            except (ValueError, TypeError):
+                logger.error(f"Erro ao processar voltagem da bateria: {parsed.battery_voltage}")
+        else:
+            # Resetar alerta de bateria baixa se não for GTIGL
+            if veiculo.bateria_baixa and parsed.command_type == 'GTFRI':
+                # Só reseta se receber dados normais (GTFRI) - indica que bateria melhorou
+                changes['bateria_baixa'] = False
+                logger.info(f"✅ Status de bateria baixa resetado para IMEI={imei}")
+            
+        self.veiculo_cache.update(imei, **changes)
             
-    async def check_pending_commands(self, imei: str, writer: asyncio.StreamWriter):
-        """Verifica e envia comandos pendentes para o dispositivo."""
+    async def check_pending_commands(self, imei: str, outbound: OutboundWriter):
+        """Converte os pedidos da coleção veiculo em comandos rastreados e entrega os pendentes."""
         try:
-            if writer.is_closing():
+            if outbound.closing:
                 return
                 
-            veiculo = await mongodb_client.get_veiculo_by_imei(imei)
-            if not veiculo:
+            veiculo = await self.veiculo_cache.get(imei)
+            if outbound.closing:
                 return
                 
             # Verificar comando de bloqueio/desbloqueio
             if veiculo.comandoBloqueo is not None:
-                if veiculo.comandoBloqueo:
-                    command = "AT+GTOUT=gv50,1,0,,,,,,FFFF$"  # Bloquear
-                    logger.info(f"Enviando comando de BLOQUEIO para {imei}")
-                else:
-                    command = "AT+GTOUT=gv50,0,0,,,,,,FFFF$"  # Desbloquear  
-                    logger.info(f"Enviando comando de DESBLOQUEIO para {imei}")
-                    
-                # Enviar comando
-                try:
-                    writer.write(command.encode('utf-8'))
-                    await writer.drain()
-                    
-                    # Limpar comando após envio
-                    await mongodb_client.clear_comando_bloqueio(imei)
-                    
-                    # Atualizar status de bloqueado
-                    veiculo.bloqueado = veiculo.comandoBloqueo
-                    await mongodb_client.update_veiculo(veiculo)
-                except (ConnectionResetError, BrokenPipeError, OSError):
-                    logger.warning(f"Dispositivo {imei} desconectou durante envio de comando de bloqueio")
-                    return
+                # Marcar como consumido no cache antes de qualquer await para não duplicar e
+                # consumir no MongoDB de forma atômica: um poll que leu o pedido antes da limpeza
+                # (ou outro worker) não encontra mais nada para enviar.
+                # bloqueado só muda quando o dispositivo confirmar com +ACK
+                veiculo.comandoBloqueo = None
+                comando = await mongodb_client.claim_comando_veiculo(imei, 'comandoBloqueo')
+                if comando is not None:
+                    tipo = 'bloqueio' if comando else 'desbloqueio'
+                    build = create_block_command if comando else create_unblock_command
+                    logger.info(f"Enviando comando de {tipo.upper()} para {imei}")
+                    try:
+                        await self.command_outbox.submit(imei, tipo, lambda serial: build(serial=serial), outbound)
+                    except Exception:
+                        await mongodb_client.restore_comando_veiculo(imei, 'comandoBloqueo', comando)
+                        raise
             
             # Verificar comando de trocar IP
             if veiculo.comandoTrocarIP:
-                try:
-                    await self.send_ip_config_command(imei, writer)
-                    await mongodb_client.clear_comando_trocar_ip(imei)
-                except (ConnectionResetError, BrokenPipeError, OSError):
-                    logger.warning(f"Dispositivo {imei} desconectou durante envio de comando de IP")
-                    return
+                veiculo.comandoTrocarIP = None
+                if await mongodb_client.claim_comando_veiculo(imei, 'comandoTrocarIP'):
+                    try:
+                        await self.send_ip_config_command(imei, outbound)
+                    except Exception:
+                        await mongodb_client.restore_comando_veiculo(imei, 'comandoTrocarIP', True)
+                        raise
+            
+            # Comandos ainda sem +ACK (enviados antes de uma reconexão ou com prazo vencido)
+            await self.command_outbox.deliver(imei, outbound)
             
         except Exception as e:
             logger.error(f"Erro ao verificar comandos para {imei}: {e}")
             
 
-    async def send_ip_config_command(self, imei: str, writer: asyncio.StreamWriter):
+    async def send_ip_config_command(self, imei: str, outbound: OutboundWriter):
         """Envia comando para configurar novo IP do servidor."""
-        try:
-            if writer.is_closing():
-                return
-                
-            settings = self.settings
+        settings = self.settings
+        
+        # Verificar se há IPs configurados
+        if not settings.new_server_ip:
+            logger.warning(f"Novo IP do servidor não configurado para {imei}")
+            return
             
-            # Verificar se há IPs configurados
-            if not settings.new_server_ip:
-                logger.warning(f"Novo IP do servidor não configurado para {imei}")
+        logger.info(f"Enviando comando de CONFIGURAÇÃO IP para {imei}")
+        logger.info(f"Novo IP: {settings.new_server_ip}:{settings.new_server_port}")
+        
+        # Comando GTSRI para configurar novo servidor
+        # Formato: AT+GTSRI=gv50,password,0,server_ip,server_port,0,backup_ip,backup_port,,,serial$
+        await self.command_outbox.submit(
+            imei, 'trocar_ip',
+            lambda serial: create_ip_config_command(
+                "gv50", settings.new_server_ip, settings.new_server_port,
+                settings.backup_server_ip, settings.backup_server_port, serial=serial
+            ),
+            outbound
+        )
+    
+    async def on_command_confirmed(self, command: dict):
+        """Aplica ao veículo o efeito de um comando confirmado pelo dispositivo."""
+        if command['tipo'] not in ('bloqueio', 'desbloqueio'):
+            return
+        imei = command['IMEI']
+        bloqueado = command['tipo'] == 'bloqueio'
+        if self.veiculo_cache.peek(imei) is not None:
+            self.veiculo_cache.update(imei, bloqueado=bloqueado)
+        else:
+            await mongodb_client.update_veiculos_fields({imei: {'bloqueado': bloqueado}})
+    
+    def lookup_outbound(self, imei: str) -> Optional[OutboundWriter]:
+        device_info = self.connected_devices.get(imei)
+        return device_info['outbound'] if device_info else None
+            
+    def send_acks(self, outbound: OutboundWriter, messages: List[GV50Message]):
+        """Envia os ACKs de vários relatórios numa única escrita."""
+        ack_messages = "".join(
+            create_ack_message(message.number or '0000', message.command_type) for message in messages
+        )
+        outbound.send(ack_messages.encode('utf-8'))
+        logger.debug(f"ACK enviado: {ack_messages}")
+    
+    def on_idle_timeout(self, connection: DeviceConnection):
+        """
+        Chamado pela roda de prazos quando a conexão fica KEEP_ALIVE_TIMEOUT sem enviar dados.
+        Após DEVICE_TIMEOUT sem dados a conexão é encerrada; antes disso, envia heartbeat.
+        """
+        if connection.closed:
+            return
+        inactive_time = time.monotonic() - connection.last_seen
+        if inactive_time >= self.settings.device_timeout:
+            logger.warning(f"Dispositivo {connection.imei or connection.client_ip} inativo há {inactive_time:.0f}s (long-connection)")
+            coro = self.close_connection(connection)
+        else:
+            logger.warning(f"Timeout na conexão long-connection de {connection.client_ip}")
+            coro = self.keep_alive(connection)
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        
+    async def keep_alive(self, connection: DeviceConnection):
+        """Envia heartbeat request (se o IMEI já é conhecido) e rearma o prazo de inatividade."""
+        if connection.imei:
+            if connection.outbound.closing:
+                logger.info(f"Dispositivo {connection.client_ip} desconectou antes do heartbeat")
+                await self.close_connection(connection)
                 return
-                
-            # Comando GTSRI para configurar novo servidor
-            # Formato: AT+GTSRI=gv50,password,0,server_ip,server_port,0,backup_ip,backup_port,,,FFFF$
-            command = (
-                f"AT+GTSRI=gv50,123456,0,"
-                f"{settings.new_server_ip},{settings.new_server_port},0,"
-                f"{settings.backup_server_ip or settings.new_server_ip},"
-                f"{settings.backup_server_port},,,,FFFF$"
+            self.send_heartbeat_request(connection.outbound)
+        if not connection.closed:
+            # Próximo prazo: novo keep-alive ou o DEVICE_TIMEOUT, o que vier antes
+            deadline = min(
+                time.monotonic() + self.settings.keep_alive_timeout,
+                connection.last_seen + self.settings.device_timeout
             )
+            self.idle_wheel.schedule(connection, deadline)
             
-            logger.info(f"Enviando comando de CONFIGURAÇÃO IP para {imei}")
-            logger.info(f"Novo IP: {settings.new_server_ip}:{settings.new_server_port}")
-            
-            # Enviar comando
-            writer.write(command.encode('utf-8'))
-            await writer.drain()
-            
-        except (ConnectionResetError, BrokenPipeError, OSError):
-            logger.warning(f"Dispositivo {imei} desconectou durante envio de comando de IP")
-            raise  # Re-lançar para permitir tratamento na função chamadora
-        except Exception as e:
-            logger.error(f"Erro ao enviar comando de IP para {imei}: {e}")
-            raise
-            
-    async def send_ack(self, writer: asyncio.StreamWriter, number: str, command_type: str = "GTFRI"):
-        """Envia ACK para o dispositivo."""
+    async def close_connection(self, connection: DeviceConnection):
+        """
+        Fecha o socket de uma conexão inativa. O loop de leitura recebe EOF e faz o
+        cleanup (connected_devices, cache, admissão), evitando corrida com quem o atualiza.
+        """
+        writer = connection.writer
+        if writer.is_closing():
+            return
+        writer.close()
         try:
-            if writer.is_closing():
-                return
-            ack_message = create_ack_message(number, command_type)
-            writer.write(ack_message.encode('utf-8'))
-            await writer.drain()
-            logger.debug(f"ACK enviado: {ack_message}")
+            await asyncio.wait_for(writer.wait_closed(), timeout=self.settings.command_timeout)
+        except asyncio.TimeoutError:
+            # Buffer de escrita preso num peer morto: descartar sem esperar o flush
+            writer.transport.abort()
         except (ConnectionResetError, BrokenPipeError, OSError):
-            logger.debug(f"Dispositivo desconectou antes do ACK")
-        except Exception as e:
-            logger.error(f"Erro ao enviar ACK: {e}")
+            pass
+        logger.info(f"Long-connection {connection.imei or connection.client_ip} removida por timeout ({self.settings.device_timeout}s)")
     
-    async def send_heartbeat_request(self, writer: asyncio.StreamWriter):
+    def send_heartbeat_request(self, outbound: OutboundWriter):
         """Envia heartbeat request para manter conexão viva no modo long-connection."""
-        try:
-            if writer.is_closing():
-                return
-            # Comando heartbeat conforme documentação GV50
-            heartbeat = "AT+GTHBD=gv50$"
-            writer.write(heartbeat.encode('utf-8'))
-            await writer.drain()
-            logger.debug("Heartbeat request enviado para manter long-connection")
-        except (ConnectionResetError, BrokenPipeError, OSError):
-            logger.debug("Dispositivo desconectou durante heartbeat")
-            raise  # Re-lançar para permitir cleanup na chamada principal
-        except Exception as e:
-            logger.error(f"Erro ao enviar heartbeat: {e}")
-            raise
+        # Comando heartbeat conforme documentação GV50
+        heartbeat = "AT+GTHBD=gv50$"
+        outbound.send(heartbeat.encode('utf-8'))
+        COMMANDS_SENT.inc('heartbeat')
+        logger.debug("Heartbeat request enviado para manter long-connection")
     
-    async def cleanup_stale_connections(self):
-        """Remove conexões inativas - task para modo long-connection."""
-        logger.info("Iniciando task de cleanup para long-connections")
+    async def log_connection_stats(self):
+        """Registra periodicamente as long-connections ativas (a expiração fica na roda de prazos)."""
         while True:
             try:
-                now = datetime.now()
-                stale_devices = []
-                
-                for imei, device_info in self.connected_devices.items():
-                    last_seen = device_info['last_seen']
-                    inactive_time = now - last_seen
-                    
-                    if inactive_time > timedelta(seconds=self.settings.device_timeout):
-                        stale_devices.append(imei)
-                        logger.warning(f"Dispositivo {imei} inativo há {inactive_time} (long-connection)")
-                
-                # Remover dispositivos inativos
-                for imei in stale_devices:
-                    device_info = self.connected_devices.get(imei)
-                    if device_info:
-                        writer = device_info['writer']
-                        if not writer.is_closing():
-                            writer.close()
-                        del self.connected_devices[imei]
-                        logger.info(f"Long-connection {imei} removida por timeout ({self.settings.device_timeout}s)")
-                
-                # Estatísticas de conexões ativas
                 active_count = len(self.connected_devices)
                 if active_count > 0:
                     logger.info(f"Long-connections ativas: {active_count}")
@@ -342,32 +570,91 @@ class GPSDeviceHandler:
                 await asyncio.sleep(self.settings.heartbeat_interval)
                 
             except Exception as e:
-                logger.error(f"Erro no cleanup long-connections: {e}")
+                logger.error(f"Erro nas estatísticas de long-connections: {e}")
                 await asyncio.sleep(60)
 
 class TCPServer:
     """Servidor TCP principal para dispositivos GPS."""
     
+    @property
+    def settings(self):
+        return get_settings()
+    
     def __init__(self):
-        self.settings = get_settings()
         self.device_handler = GPSDeviceHandler()
+        self.command_dispatcher = CommandDispatcher(self.device_handler)
         self.server = None
+        self.metrics_server: Optional[MetricsServer] = None
+        self.posicoes_server: Optional[HttpEndpoint] = None
+        self.worker_id = 0  # Definido por run_worker quando há vários processos
+        self.started_at = time.monotonic()
+        self.bind_metrics()
+        event_bus.status_provider = self.status
+        
+    def status(self) -> dict:
+        """Resumo enviado ao monitor de eventos quando ele se conecta."""
+        handler = self.device_handler
+        return {
+            'worker': self.worker_id,
+            'connections': handler.admission.active,
+            'devices': len(handler.connected_devices),
+            'uptime': round(time.monotonic() - self.started_at),
+        }
+        
+    def bind_metrics(self):
+        """Liga os gauges de conexões e filas ao estado deste processo (lidos no scrape)."""
+        handler = self.device_handler
+        metrics.CONNECTIONS_ACTIVE.set_function(lambda: handler.admission.active)
+        metrics.DEVICES_CONNECTED.set_function(lambda: len(handler.connected_devices))
+        metrics.ADMISSION_QUEUED.set_function(lambda: handler.admission.queued)
+        metrics.CONNECTIONS_REJECTED.set_function(lambda: handler.admission.rejected_count)
+        metrics.DADOS_QUEUE_DEPTH.set_function(lambda: dados_writer.queue.qsize() if dados_writer.queue else 0)
+        metrics.VEICULO_PENDING.set_function(lambda: handler.veiculo_cache.pending)
+        metrics.COMMANDS_IN_FLIGHT.set_function(lambda: handler.command_outbox.in_flight)
+        metrics.LOG_DROPPED.set_function(get_dropped_count)
         
     async def start_server(self):
         """Inicia o servidor TCP em modo Long-Connection."""
         try:
             # Conectar ao MongoDB primeiro
             await mongodb_client.connect()
+            await dados_writer.start(spool_path(self.settings.spool_dir, self.worker_id))
+            await self.device_handler.veiculo_cache.start()
+            await self.device_handler.posicoes.start()
+            await self.device_handler.viagens.start()
+            await self.command_dispatcher.start()
+            await self.device_handler.command_outbox.start()
+            await self.device_handler.idle_wheel.start()
+            self.configure_capture()
             
-            # Iniciar task de cleanup para long-connections
-            cleanup_coro = self.device_handler.cleanup_stale_connections()
-            self.device_handler.cleanup_task = asyncio.create_task(cleanup_coro)
+            # Endpoint de métricas: uma porta por worker (SO_REUSEPORT distribuiria o scrape)
+            if self.settings.metrics_port:
+                port = self.settings.metrics_port + max(self.worker_id - 1, 0)
+                self.metrics_server = MetricsServer(self.settings.metrics_host, port)
+                await self.metrics_server.start()
+            
+            # Posições atuais direto da memória: opcional e separado das métricas (dados da frota)
+            if self.settings.posicoes_port:
+                port = self.settings.posicoes_port + max(self.worker_id - 1, 0)
+                self.posicoes_server = HttpEndpoint(self.settings.posicoes_host, port, name="posições")
+                self.posicoes_server.add_route('/posicoes', self.device_handler.posicoes.http_response)
+                await self.posicoes_server.start()
+            
+            # Eventos para o monitor em tempo real (um socket por worker)
+            if self.settings.events_socket:
+                await event_bus.start(events_socket_path(self.settings.events_socket, self.worker_id))
+            
+            # Iniciar task de estatísticas das long-connections
+            stats_coro = self.device_handler.log_connection_stats()
+            self.device_handler.stats_task = asyncio.create_task(stats_coro)
             
             # Iniciar servidor TCP
+            # Com vários workers, cada processo abre o próprio socket na mesma porta
             self.server = await asyncio.start_server(
                 self.device_handler.handle_device,
                 self.settings.tcp_host,
-                self.settings.tcp_port
+                self.settings.tcp_port,
+                reuse_port=self.settings.workers > 1
             )
             
             addr = self.server.sockets[0].getsockname()
@@ -376,6 +663,10 @@ class TCPServer:
             logger.info(f"  - Device timeout: {self.settings.device_timeout}s")
             logger.info(f"  - Heartbeat interval: {self.settings.heartbeat_interval}s") 
             logger.info(f"  - Keep-alive timeout: {self.settings.keep_alive_timeout}s")
+            logger.info(
+                f"  - Max conexões: {self.settings.max_connections} "
+                f"(política {self.settings.connection_policy}, por IP {self.settings.max_connections_per_ip or 'sem limite'})"
+            )
             
             # Manter servidor rodando
             async with self.server:
@@ -385,23 +676,82 @@ class TCPServer:
             logger.error(f"Erro ao iniciar servidor long-connection: {e}")
             raise
             
+    def reload(self):
+        """SIGHUP: relê a configuração e aplica os parâmetros ajustáveis sem derrubar conexões."""
+        try:
+            changes = reload_settings()
+        except Exception as e:
+            logger.error(f"Configuração inválida no reload, mantendo a atual: {e}")
+            return
+        
+        if not changes:
+            logger.info("Reload de configuração: nenhuma alteração")
+            return
+        for name, (old, new) in changes.items():
+            if name in RELOADABLE_FIELDS:
+                logger.info(f"Configuração {name} alterada: {old} -> {new}")
+            else:
+                logger.warning(f"Configuração {name} alterada, mas só será aplicada após reinício")
+        
+        self.device_handler.apply_settings()
+        self.configure_capture()
+        apply_log_settings(self.settings)
+        
+    def configure_capture(self):
+        """Liga, desliga ou ajusta a captura de frames brutos conforme CAPTURE_DIR."""
+        handler = self.device_handler
+        settings = self.settings
+        capture = handler.capture
+        if capture and capture.directory == settings.capture_dir:
+            capture.max_bytes = settings.capture_max_bytes
+            capture.max_files = settings.capture_max_files
+            return
+        if capture:
+            handler.capture = None
+            task = asyncio.create_task(capture.stop())
+            handler.background_tasks.add(task)
+            task.add_done_callback(handler.background_tasks.discard)
+        if settings.capture_dir:
+            capture = FrameCapture(
+                settings.capture_dir, capture_prefix(self.worker_id),
+                settings.capture_max_bytes, settings.capture_max_files
+            )
+            capture.start()
+            handler.capture = capture
+            
     async def stop_server(self):
         """Para o servidor TCP e cleanup tasks."""
         try:
-            if self.device_handler.cleanup_task:
-                self.device_handler.cleanup_task.cancel()
+            if self.device_handler.stats_task:
+                self.device_handler.stats_task.cancel()
+            await self.command_dispatcher.stop()
                 
             if self.server:
                 self.server.close()
-                await self.server.wait_closed()
                 
-            # Fechar todas as conexões ativas
-            for imei, device_info in self.device_handler.connected_devices.items():
-                writer = device_info['writer']
-                if not writer.is_closing():
-                    writer.close()
-                    
+            # Fechar todas as conexões e aguardar os handlers: depois disso nada mais é
+            # enfileirado para o MongoDB nem enviado pelo outbox
+            await self.device_handler.close_connections(self.settings.connection_drain_timeout)
             self.device_handler.connected_devices.clear()
+            if self.server:
+                await self.server.wait_closed()
+            
+            await self.device_handler.command_outbox.stop()
+            await self.device_handler.idle_wheel.stop()
+            if self.device_handler.capture:
+                await self.device_handler.capture.stop()
+                self.device_handler.capture = None
+            if self.metrics_server:
+                await self.metrics_server.stop()
+            if self.posicoes_server:
+                await self.posicoes_server.stop()
+            await event_bus.stop()
+            
+            # Gravar o que ainda está na fila antes de desconectar
+            await dados_writer.stop()
+            await self.device_handler.veiculo_cache.stop()
+            await self.device_handler.posicoes.stop()
+            await self.device_handler.viagens.stop()
             await mongodb_client.disconnect()
             logger.info("Servidor Long-Connection parado")
             
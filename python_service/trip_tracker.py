@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Segmentação de viagens em tempo real (coleção viagens)
+Uma máquina de estados por IMEI no caminho de ingestão: a viagem abre com a
+ignição ligada (GTIGN ou GTFRI com ignição), acumula distância (haversine),
+velocidades e área percorrida a cada relatório e fecha com a ignição desligada
+ou depois de VIAGEM_INATIVIDADE segundos sem relatório. Cada viagem fechada vira
+um documento, sem reprocessar o histórico de dados_veiculo.
+"""
+
+import asyncio
+import math
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from bson import ObjectId
+from protocol_parser import GV50Message
+from models import geo_point
+from mongodb_client import mongodb_client
+from connection_manager import DeadlineWheel
+from metrics import Counter, Gauge
+from events import event_bus
+from config import get_settings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+EARTH_RADIUS_M = 6371008.8  # Raio médio da Terra (IUGG)
+FLUSH_INTERVAL = 5.0  # Segundos entre gravações das viagens fechadas (são poucas por veículo por dia)
+MAX_UNSAVED = 10000  # Viagens retidas enquanto o MongoDB não aceita a gravação
+
+TRIPS_CLOSED = Counter("gv50_trips_closed_total", "Viagens fechadas por motivo", ("motivo",))
+TRIPS_OPEN = Gauge("gv50_trips_open", "Viagens em andamento neste worker")
+TRIPS_LATE_REPORTS = Counter("gv50_trips_late_reports_total",
+                             "Relatórios anteriores ao último da viagem, fora dos agregados")
+
+def haversine(longitude1: float, latitude1: float, longitude2: float, latitude2: float) -> float:
+    """Distância em metros entre dois pontos (graus decimais) sobre a esfera."""
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    half_dphi = (phi2 - phi1) / 2
+    half_dlambda = math.radians(longitude2 - longitude1) / 2
+    a = math.sin(half_dphi) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(half_dlambda) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+class Trip:
+    """Agregados de uma viagem em andamento (atualizados em O(1) por relatório)."""
+
+    __slots__ = (
+        'imei', 'started_at', 'last_time', 'origin', 'last_point', 'distance',
+        'max_speed', 'speed_sum', 'speed_count', 'reports',
+        'min_longitude', 'min_latitude', 'max_longitude', 'max_latitude',
+    )
+
+    def __init__(self, imei: str, started_at: datetime):
+        self.imei = imei
+        self.started_at = started_at  # Horário do dispositivo do relatório que abriu a viagem
+        self.last_time = started_at
+        self.origin: Optional[tuple] = None  # (longitude, latitude)
+        self.last_point: Optional[tuple] = None
+        self.distance = 0.0  # Metros
+        self.max_speed = 0.0
+        self.speed_sum = 0.0
+        self.speed_count = 0
+        self.reports = 0
+        self.min_longitude = self.min_latitude = math.inf
+        self.max_longitude = self.max_latitude = -math.inf
+
+    def add(self, parsed: GV50Message):
+        self.reports += 1
+        self.last_time = parsed.device_time
+        if parsed.speed is not None:
+            self.speed_sum += parsed.speed
+            self.speed_count += 1
+            if parsed.speed > self.max_speed:
+                self.max_speed = parsed.speed
+        if geo_point(parsed.longitude, parsed.latitude) is None:
+            return  # Sem fix GPS: conta o relatório, mas não a posição
+        point = (parsed.longitude, parsed.latitude)
+        if self.last_point is None:
+            self.origin = point
+        else:
+            self.distance += haversine(*self.last_point, *point)
+        self.last_point = point
+        longitude, latitude = point
+        self.min_longitude = min(self.min_longitude, longitude)
+        self.max_longitude = max(self.max_longitude, longitude)
+        self.min_latitude = min(self.min_latitude, latitude)
+        self.max_latitude = max(self.max_latitude, latitude)
+
+    def document(self, reason: str) -> dict:
+        return {
+            '_id': ObjectId(),  # Definido no fechamento: regravar após falha não duplica
+            'IMEI': self.imei,
+            'inicio': self.started_at,
+            'fim': self.last_time,
+            'duracao': (self.last_time - self.started_at).total_seconds(),  # Segundos
+            'distancia': round(self.distance, 1),  # Metros
+            'velocidade_maxima': self.max_speed,  # km/h
+            'velocidade_media': round(self.speed_sum / self.speed_count, 1) if self.speed_count else None,
+            'relatorios': self.reports,
+            'motivo_fim': reason,
+            'origem': geo_point(*self.origin) if self.origin else None,
+            'destino': geo_point(*self.last_point) if self.last_point else None,
+            # GeoJSON bbox: [oeste, sul, leste, norte]
+            'bbox': [self.min_longitude, self.min_latitude, self.max_longitude, self.max_latitude]
+                    if self.origin else None,
+            'data': datetime.utcnow(),
+        }
+
+class TripTracker:
+    """Viagem em andamento por IMEI e gravação em lote das fechadas."""
+
+    @property
+    def settings(self):
+        return get_settings()
+
+    def __init__(self):
+        self._open: Dict[str, Trip] = {}
+        self._last_seen: Dict[str, datetime] = {}  # IMEI -> horário do último relatório aplicado
+        self._closed: List[dict] = []
+        # Fecha viagens de dispositivos que pararam de reportar (ex: desconectados com a ignição ligada)
+        self.inactivity_wheel = DeadlineWheel(self.settings.timer_resolution, self._on_inactive, name="viagens")
+        self.flush_task: Optional[asyncio.Task] = None
+        TRIPS_OPEN.set_function(lambda: len(self._open))
+
+    def __len__(self) -> int:
+        return len(self._open)
+
+    async def start(self):
+        await self.inactivity_wheel.start()
+        self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Fecha as viagens em andamento (motivo encerramento) e grava as pendentes."""
+        await self.inactivity_wheel.stop()
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        for imei in list(self._open):
+            self._close(imei, 'encerramento')
+        await self.flush()
+
+    def get(self, imei: str) -> Optional[Trip]:
+        """Viagem em andamento do IMEI neste processo."""
+        return self._open.get(imei)
+
+    def observe(self, parsed: GV50Message):
+        """Aplica um relatório à máquina de estados do IMEI (relatórios em ordem de horário do dispositivo)."""
+        if parsed.device_time is None:
+            return
+        imei = parsed.imei
+        last_seen = self._last_seen.get(imei)
+        if last_seen is not None and parsed.device_time < last_seen:
+            # Backlog +BUFF entregue depois de relatórios mais novos: fica só em dados_veiculo
+            if imei in self._open:
+                TRIPS_LATE_REPORTS.inc()
+            return
+        self._last_seen[imei] = parsed.device_time
+
+        # GTFRI traz o estado da ignição; GTIGN/GTIGF são as transições. Os demais não mudam o estado
+        ignition_known = parsed.ignition_event or parsed.command_type == 'GTFRI'
+        gap = self.settings.viagem_inatividade
+        trip = self._open.get(imei)
+        if trip is not None and (parsed.device_time - trip.last_time).total_seconds() > gap:
+            self._close(imei, 'inatividade')
+            trip = None
+
+        if trip is None:
+            if not (ignition_known and parsed.ignition):
+                return
+            trip = self._open[imei] = Trip(imei, parsed.device_time)
+            logger.debug(f"Viagem iniciada: IMEI={imei} em {parsed.device_time}")
+        trip.add(parsed)
+        self.inactivity_wheel.touch(imei, time.monotonic() + gap)
+
+        if ignition_known and not parsed.ignition:
+            self._close(imei, 'ignicao_desligada')
+
+    def _on_inactive(self, imei: str):
+        if imei in self._open:
+            self._close(imei, 'inatividade')
+
+    def _close(self, imei: str, reason: str):
+        trip = self._open.pop(imei)
+        self.inactivity_wheel.cancel(imei)
+        document = trip.document(reason)
+        self._closed.append(document)
+        TRIPS_CLOSED.inc(reason)
+        event_bus.publish('trip', imei, reason=reason, start=trip.started_at, end=trip.last_time,
+                          distance=document['distancia'], max_speed=trip.max_speed)
+        logger.info(
+            f"🚗 Viagem fechada ({reason}): IMEI={imei}, {trip.started_at} a {trip.last_time}, "
+            f"{document['distancia'] / 1000:.1f} km, máx {trip.max_speed:.0f} km/h",
+            extra={'imei': imei}
+        )
+
+    async def flush(self):
+        """Grava de uma vez as viagens fechadas desde o último flush."""
+        if not self._closed:
+            return
+        documents, self._closed = self._closed, []
+        if not await mongodb_client.insert_viagens(documents):
+            # Devolver para a próxima tentativa (o _id evita duplicar o que já foi gravado)
+            self._closed = (documents + self._closed)[-MAX_UNSAVED:]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Erro ao gravar viagens: {e}")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Cache em memória do estado dos veículos conectados
+Evita buscar e regravar o documento Veiculo a cada mensagem GPS
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional
+from models import Veiculo
+from mongodb_client import mongodb_client
+from metrics import MONGO_UPDATE_BATCH, MONGO_UPDATE_SECONDS
+from config import get_settings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Campos que operadores alteram diretamente no MongoDB
+COMMAND_FIELDS = ('comandoBloqueo', 'comandoTrocarIP', 'bloqueado')
+
+class VeiculoCache:
+    """Estado por IMEI carregado no primeiro contato e gravado com $set coalescido."""
+
+    @property
+    def settings(self):
+        return get_settings()
+
+    def __init__(self):
+        self._entries: Dict[str, Veiculo] = {}
+        self._dirty: Dict[str, dict] = {}  # IMEI -> campos alterados ainda não gravados
+        self._flushing: Dict[str, dict] = {}  # Campos do flush em andamento (ainda podem não estar no MongoDB)
+        self._loading: Dict[str, asyncio.Future] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def pending(self) -> int:
+        """Veículos com campos alterados aguardando o flush."""
+        return len(self._dirty)
+
+    async def start(self):
+        """Inicia a task de gravação coalescida."""
+        self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Para a task de gravação e grava os campos pendentes."""
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+
+    async def get(self, imei: str) -> Veiculo:
+        """Retorna o veículo do cache, carregando (ou criando) no primeiro contato."""
+        veiculo = self._entries.get(imei)
+        if veiculo is not None:
+            return veiculo
+
+        # Evitar carregar o mesmo IMEI duas vezes em paralelo
+        pending = self._loading.get(imei)
+        if pending is not None:
+            return await pending
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[imei] = future
+        try:
+            documents = await mongodb_client.get_veiculos_by_imeis([imei])
+            if documents:
+                document = documents[0]
+                document['_id'] = str(document['_id'])
+                veiculo = Veiculo(**document)
+            else:
+                # Veículo novo: o documento vai no primeiro flush (upsert), sem os campos
+                # de comando para não sobrescrever um comando criado nesse intervalo
+                veiculo = Veiculo(IMEI=imei)
+                defaults = veiculo.model_dump(exclude={'_id', 'IMEI', 'ts_user_manu', *COMMAND_FIELDS})
+                self._dirty[imei] = {**defaults, **self._dirty.get(imei, {})}
+            # Reconexão antes do flush: o documento lido ainda não tem o que foi alterado
+            # antes do evict, e update() compararia os valores novos com essa cópia antiga
+            for field, value in {**self._flushing.get(imei, {}), **self._dirty.get(imei, {})}.items():
+                setattr(veiculo, field, value)
+            self._entries[imei] = veiculo
+            future.set_result(veiculo)
+            return veiculo
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Evita aviso de exceção não consumida quando não há outro aguardando
+            raise
+        finally:
+            del self._loading[imei]
+
+    def peek(self, imei: str) -> Optional[Veiculo]:
+        """Retorna o veículo se já estiver no cache, sem acessar o MongoDB."""
+        return self._entries.get(imei)
+
+    def update(self, imei: str, **fields):
+        """Altera campos do veículo em cache e marca apenas os que mudaram para gravação."""
+        veiculo = self._entries.get(imei)
+        if veiculo is None:
+            return
+        dirty = None
+        for field, value in fields.items():
+            if getattr(veiculo, field) != value:
+                setattr(veiculo, field, value)
+                if dirty is None:
+                    dirty = self._dirty.setdefault(imei, {})
+                dirty[field] = value
+
+    def evict(self, imei: str):
+        """Remove o veículo do cache; campos pendentes ainda serão gravados no próximo flush."""
+        self._entries.pop(imei, None)
+
+    def apply_remote(self, imei: str, document: dict):
+        """Aplica alterações de comando feitas fora do serviço sem sobrescrever campos locais pendentes."""
+        veiculo = self._entries.get(imei)
+        if veiculo is None:
+            return
+        dirty = self._dirty.get(imei, {})
+        for field in COMMAND_FIELDS:
+            if field in document and field not in dirty:
+                setattr(veiculo, field, document[field])
+
+    async def flush(self):
+        """Grava de uma vez todos os campos alterados desde o último flush."""
+        if not self._dirty:
+            return
+        updates, self._dirty = self._dirty, {}
+        self._flushing = updates
+        started = time.perf_counter()
+        saved = await mongodb_client.update_veiculos_fields(updates)
+        self._flushing = {}
+        if saved:
+            MONGO_UPDATE_SECONDS.observe(time.perf_counter() - started)
+            MONGO_UPDATE_BATCH.observe(len(updates))
+        else:
+            # Devolver para a próxima tentativa sem perder alterações mais novas
+            for imei, fields in updates.items():
+                self._dirty[imei] = {**fields, **self._dirty.get(imei, {})}
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.settings.veiculo_flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Erro ao gravar cache de veículos: {e}")